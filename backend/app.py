@@ -12,7 +12,7 @@ from datetime import datetime
 from typing import List, Dict, Any, Optional
 
 # FastAPI imports
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, BackgroundTasks, status
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, status
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, StreamingResponse
@@ -44,17 +44,18 @@ from llm_config import (
 )
 from storage_management import (
     get_storage_overview, get_user_storage_details, cleanup_user_storage,
-    cleanup_orphaned_files
+    cleanup_orphaned_files, record_storage_usage, check_storage_quota,
+    reconcile_storage_ledger, storage_reconciler
 )
 from analytics import (
     track_analytics_event, track_token_usage, track_performance_metric, track_user_feedback,
     get_analytics_overview, get_usage_patterns, get_token_analytics,
     get_performance_analytics, get_user_satisfaction_analytics
 )
-from background_tasks import process_document_task, task_manager
+from background_tasks import processing_queue, task_manager
 from llm_integration import (
     ask_question, get_llm_status, set_llm_mode, get_available_llm_modes,
-    clear_document_cache, clear_all_cache
+    clear_document_cache, clear_all_cache, warm_up_ollama_async, get_cache_stats
 )
 
 # Configure logging
@@ -105,7 +106,6 @@ def read_users_me(current_user: User = Depends(get_current_user)):
 
 @app.post("/documents", response_model=DocumentResponse)
 def upload_document(
-    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -119,6 +119,9 @@ def upload_document(
     user_dir = f"{STORAGE_PATH}/temp/{current_user.id}"
     ensure_dir_exists(user_dir)
 
+    if not check_storage_quota(db, current_user.id)["allowed"]:
+        raise HTTPException(status_code=413, detail="Storage quota exceeded")
+
     # Save file
     file_path = f"{user_dir}/{file.filename}"
     try:
@@ -136,6 +139,14 @@ def upload_document(
     # Get file size
     file_size = os.path.getsize(file_path)
 
+    quota = check_storage_quota(db, current_user.id, file_size)
+    if not quota["allowed"]:
+        os.remove(file_path)
+        raise HTTPException(
+            status_code=413,
+            detail=f"Storage quota exceeded: {quota['used_bytes']} of {quota['quota_bytes']} bytes used"
+        )
+
     # Create document in database
     db_document = Document(
         filename=file.filename,
@@ -145,6 +156,7 @@ def upload_document(
         owner_id=current_user.id
     )
     db.add(db_document)
+    record_storage_usage(db, current_user.id, "documents", file_path, file_size)
     db.commit()
     db.refresh(db_document)
 
@@ -159,8 +171,8 @@ def upload_document(
         success=True, document_id=db_document.id, file_size_bytes=file_size
     )
 
-    # Process document in background
-    background_tasks.add_task(process_document_task, db, db_document.id)
+    # Queue document for processing by the worker pool
+    processing_queue.submit(db_document.id)
 
     return db_document
 
@@ -436,7 +448,9 @@ def get_document_processing_status(document_id: int, current_user: User = Depend
         "document_id": document_id,
         "status": document.status,
         "is_processing": is_processing,
-        "can_cancel": is_processing and document.status == "PROCESSING"
+        "can_cancel": is_processing and document.status in ("UPLOADED", "PROCESSING"),
+        "queue_position": processing_queue.get_position(document_id),
+        "eta_seconds": processing_queue.get_eta_seconds(document_id)
     }
 
 @app.post("/documents/{document_id}/clear-cache")
@@ -740,10 +754,10 @@ def test_llm_config_admin(
 
 # Storage Management endpoints (Admin only)
 @app.get("/admin/storage/overview", response_model=StorageOverviewResponse)
-def get_storage_overview_admin(admin_user: User = Depends(get_current_admin_user)):
+def get_storage_overview_admin(admin_user: User = Depends(get_current_admin_user), db: Session = Depends(get_db)):
     """Get storage overview (admin only)."""
     try:
-        overview = get_storage_overview()
+        overview = get_storage_overview(db)
         return StorageOverviewResponse(**overview)
     except Exception as e:
         logger.error(f"Error getting storage overview: {e}")
@@ -794,6 +808,20 @@ def cleanup_orphaned_files_admin(admin_user: User = Depends(get_current_admin_us
         logger.error(f"Error cleaning up orphaned files: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/admin/storage/reconcile")
+def reconcile_storage_admin(admin_user: User = Depends(get_current_admin_user), db: Session = Depends(get_db)):
+    """Recompute the storage ledger now (admin only)."""
+    try:
+        return reconcile_storage_ledger(db)
+    except Exception as e:
+        logger.error(f"Error reconciling storage ledger: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/users/me/storage")
+def read_my_storage(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Storage used by the current user against their quota."""
+    return check_storage_quota(db, current_user.id)
+
 # Analytics endpoints (Admin only)
 @app.get("/admin/analytics/overview", response_model=AnalyticsOverviewResponse)
 def get_analytics_overview_admin(
@@ -897,6 +925,16 @@ def clear_all_cache_endpoint(current_user: User = Depends(get_current_user)):
     else:
         raise HTTPException(status_code=500, detail="Failed to clear all cache")
 
+@app.get("/admin/processing-queue")
+def processing_queue_endpoint(admin_user: User = Depends(get_current_admin_user)):
+    """Get document processing queue status (admin function)."""
+    return processing_queue.stats()
+
+@app.get("/admin/cache-stats")
+def cache_stats_endpoint(admin_user: User = Depends(get_current_admin_user)):
+    """Get analysis result cache statistics (admin function)."""
+    return get_cache_stats()
+
 @app.get("/health")
 def health_check():
     """Health check endpoint with detailed status information."""
@@ -1012,6 +1050,12 @@ def startup_event():
             create_admin_user(db, "admin@example.com", "admin123", "Admin User", is_active=True, is_admin=True)
             logger.info("Admin user created successfully")
 
+    # Keep the storage ledger in line with what is on disk and in MinIO
+    storage_reconciler.start()
+
+    # Load the Ollama model in the background so the first request doesn't pay for it
+    warm_up_ollama_async()
+
 # Run the application
 if __name__ == "__main__":
     import uvicorn
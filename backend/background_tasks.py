@@ -1,8 +1,11 @@
+import os
 import json
+import time
 import logging
 import threading
-from typing import Dict, Set
-from sqlalchemy.orm import Session
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set
+from config import SessionLocal
 from models import Document, AnalysisResult
 from llm_integration import process_document
 
@@ -38,6 +41,11 @@ class TaskManager:
                 del self._running_tasks[document_id]
                 logger.info(f"Finished tracking task for document {document_id}")
 
+    def get_cancel_event(self, document_id: int) -> Optional[threading.Event]:
+        """Get the cancellation event for a tracked task."""
+        with self._lock:
+            return self._running_tasks.get(document_id)
+
     def is_task_running(self, document_id: int) -> bool:
         """Check if a task is currently running."""
         with self._lock:
@@ -51,11 +59,13 @@ class TaskManager:
 # Global task manager instance
 task_manager = TaskManager()
 
-def process_document_task(db: Session, document_id: int):
-    """Background task to process a document with cancellation support."""
-    # Start tracking this task
-    cancel_event = task_manager.start_task(document_id)
+def process_document_task(document_id: int, cancel_event: Optional[threading.Event] = None):
+    """Process a document with cancellation support, using its own database session."""
+    # Start tracking this task unless the queue already does
+    if cancel_event is None:
+        cancel_event = task_manager.start_task(document_id)
 
+    db = SessionLocal()
     try:
         # Get document
         document = db.query(Document).filter(Document.id == document_id).first()
@@ -126,4 +136,128 @@ def process_document_task(db: Session, document_id: int):
                 db.commit()
     finally:
         # Always clean up task tracking
-        task_manager.finish_task(document_id)
\ No newline at end of file
+        db.close()
+        task_manager.finish_task(document_id)
+
+class DocumentProcessingQueue:
+    """
+    Bounded worker pool for document processing.
+
+    Uploads are queued FIFO and processed by at most `max_workers` threads, so a
+    batch upload can't start an unbounded number of LLM jobs on the web process.
+    Queued and running jobs are both tracked in `task_manager`, so cancelling
+    a queued document drops it before it starts.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max(1, max_workers)
+        self._queue: Deque[int] = deque()
+        self._running: Dict[int, float] = {}  # document_id -> start time
+        self._durations: Deque[float] = deque(maxlen=20)  # Recent job durations for ETAs
+        self._condition = threading.Condition()
+        self._workers: List[threading.Thread] = []
+
+    def _ensure_workers(self):
+        # Started on first use so importing the module doesn't spawn threads
+        if self._workers:
+            return
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"document-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self.max_workers} document processing workers")
+
+    def submit(self, document_id: int) -> int:
+        """Queue a document for processing and return its queue position."""
+        task_manager.start_task(document_id)
+        with self._condition:
+            self._ensure_workers()
+            self._queue.append(document_id)
+            position = len(self._queue)
+            self._condition.notify()
+        logger.info(f"Queued document {document_id} for processing (position {position})")
+        return position
+
+    def _worker_loop(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                document_id = self._queue.popleft()
+
+            cancel_event = task_manager.get_cancel_event(document_id)
+            if cancel_event is None or cancel_event.is_set():
+                logger.info(f"Skipping cancelled document {document_id}")
+                self._mark_cancelled(document_id)
+                task_manager.finish_task(document_id)
+                continue
+
+            with self._condition:
+                self._running[document_id] = time.time()
+            try:
+                process_document_task(document_id, cancel_event)
+            except Exception as e:
+                logger.error(f"Unhandled error processing document {document_id}: {e}")
+            finally:
+                with self._condition:
+                    started = self._running.pop(document_id, None)
+                    if started is not None:
+                        self._durations.append(time.time() - started)
+
+    def _mark_cancelled(self, document_id: int):
+        db = SessionLocal()
+        try:
+            document = db.query(Document).filter(Document.id == document_id).first()
+            if document:
+                document.status = "CANCELLED"
+                db.commit()
+        finally:
+            db.close()
+
+    def _average_duration(self) -> Optional[float]:
+        return sum(self._durations) / len(self._durations) if self._durations else None
+
+    def get_position(self, document_id: int) -> Optional[int]:
+        """1-based position among queued (not cancelled) jobs, 0 if running, None if unknown."""
+        with self._condition:
+            if document_id in self._running:
+                return 0
+            position = 0
+            for queued_id in self._queue:
+                event = task_manager.get_cancel_event(queued_id)
+                if event is not None and event.is_set():
+                    continue
+                position += 1
+                if queued_id == document_id:
+                    return position
+        return None
+
+    def get_eta_seconds(self, document_id: int) -> Optional[float]:
+        """Estimated seconds until the document finishes, from recent job durations."""
+        # One acquisition (the condition's lock is reentrant), so the job can't
+        # finish between finding it running and reading its start time
+        with self._condition:
+            position = self.get_position(document_id)
+            average = self._average_duration()
+            if position is None or average is None:
+                return None
+            now = time.time()
+            if position == 0:
+                return round(max(0.0, average - (now - self._running[document_id])), 1)
+            # Jobs ahead of this one, including those already running, drain in waves of max_workers
+            remaining = [max(0.0, average - (now - started)) for started in self._running.values()]
+            ahead = (position - 1) * average + sum(remaining)
+            return round(ahead / self.max_workers + average, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            average = self._average_duration()
+            return {
+                "max_workers": self.max_workers,
+                "running": sorted(self._running),
+                "queued": list(self._queue),
+                "average_duration_seconds": round(average, 1) if average is not None else None
+            }
+
+# Global processing queue; DOCUMENT_WORKERS bounds concurrent LLM jobs
+processing_queue = DocumentProcessingQueue(int(os.environ.get("DOCUMENT_WORKERS", "2")))
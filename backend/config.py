@@ -21,6 +21,10 @@ MINIO_SECRET_KEY = os.environ.get("MINIO_SECRET_KEY", "minioadmin")
 MINIO_SECURE = os.environ.get("MINIO_SECURE", "false").lower() == "true"
 DOCUMENTS_BUCKET = os.environ.get("DOCUMENTS_BUCKET", "documents")
 
+# Storage ledger configuration
+STORAGE_USER_QUOTA_BYTES = int(os.environ.get("STORAGE_USER_QUOTA_BYTES", "0"))  # 0 disables the quota
+STORAGE_RECONCILE_INTERVAL = float(os.environ.get("STORAGE_RECONCILE_INTERVAL", "3600"))  # Seconds
+
 def ensure_dir_exists(dir_path):
     """Ensure directory exists, create if it doesn't."""
     try:
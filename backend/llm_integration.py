@@ -6,20 +6,23 @@ Supports Ollama (with Gemma 3 27B), OpenAI, and mock LLM backends.
 import os
 import time
 import json
-import hashlib
 import logging
 import requests
 from typing import List, Dict, Any, Optional, Union, Tuple
 from pathlib import Path
 import pickle
 import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 # Vector store and document processing
-import numpy as np
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import FAISS
 from langchain.docstore.document import Document as LangchainDocument
 
+from result_cache import ResultCache
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,12 +36,21 @@ OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://host.docker.internal
 OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "gemma3:27b")
 OLLAMA_USE_CPU = os.environ.get("OLLAMA_USE_CPU", "false").lower() == "true"
 OLLAMA_MAX_TOKENS = int(os.environ.get("OLLAMA_MAX_TOKENS", "8192"))  # Default to 8192 if not specified
+OLLAMA_DISCOVERY_TTL = int(os.environ.get("OLLAMA_DISCOVERY_TTL", "300"))  # Seconds before re-probing a working endpoint
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded between requests
 
 # OpenAI Configuration (also supports LM Studio)
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "none")
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o")
 OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")  # Default to OpenAI, can be set to LM Studio
 
+# Embedding configuration for the per-document vector index
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_BASE_URL = os.environ.get("EMBEDDING_BASE_URL")  # Defaults to OPENAI_BASE_URL
+OLLAMA_EMBEDDING_MODEL = os.environ.get("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))  # Chunks sent as context per question
+VECTOR_INDEX_CACHE_SIZE = int(os.environ.get("VECTOR_INDEX_CACHE_SIZE", "8"))  # Loaded FAISS indexes kept in memory
+
 # Vector store and caching configuration
 STORAGE_PATH = os.environ.get("STORAGE_PATH", "/data")
 VECTOR_DB_PATH = f"{STORAGE_PATH}/vector_db"
@@ -255,17 +267,7 @@ MOCK_QA_RESPONSES = {
 }
 
 # Helper functions for caching
-def get_file_md5(file_path: str) -> str:
-    """Calculate MD5 hash of a file."""
-    hash_md5 = hashlib.md5()
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_md5.update(chunk)
-    return hash_md5.hexdigest()
-
-def get_cache_path(document_id: str, operation: str) -> str:
-    """Get cache file path for a document and operation."""
-    return os.path.join(CACHE_PATH, f"{document_id}_{operation}.pkl")
+result_cache = ResultCache(os.path.join(CACHE_PATH, "results.db"))
 
 def save_to_cache(document_id: str, operation: str, data: Any) -> None:
     """Save data to cache."""
@@ -273,9 +275,7 @@ def save_to_cache(document_id: str, operation: str, data: Any) -> None:
         return
     
     try:
-        cache_path = get_cache_path(document_id, operation)
-        with open(cache_path, 'wb') as f:
-            pickle.dump(data, f)
+        result_cache.set(document_id, operation, data)
         logger.info(f"Saved {operation} to cache for document {document_id}")
     except Exception as e:
         logger.error(f"Error saving to cache: {str(e)}")
@@ -285,47 +285,57 @@ def load_from_cache(document_id: str, operation: str) -> Optional[Any]:
     if not ENABLE_CACHING:
         return None
     
-    cache_path = get_cache_path(document_id, operation)
-    if os.path.exists(cache_path):
-        try:
-            with open(cache_path, 'rb') as f:
-                data = pickle.load(f)
+    try:
+        data = result_cache.get(document_id, operation)
+        if data is not None:
             logger.info(f"Loaded {operation} from cache for document {document_id}")
-            return data
-        except Exception as e:
-            logger.error(f"Error loading from cache: {str(e)}")
+        return data
+    except Exception as e:
+        logger.error(f"Error loading from cache: {str(e)}")
     
     return None
 
-def check_document_processed(document_id: str, file_path: str) -> bool:
-    """Check if document has been processed and cached with the same MD5."""
+def load_cached_results(document_id: str, file_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Cached analysis results for a document, or None if it hasn't been processed
+    with the current file contents. The file is only re-hashed when its size
+    or mtime changed, and all results are read in a single query.
+    """
     if not ENABLE_CACHING:
-        return False
+        return None
     
     try:
-        # Get current file MD5
-        current_md5 = get_file_md5(file_path)
-        
-        # Check if MD5 cache exists
-        md5_cache_path = get_cache_path(document_id, "md5")
-        if os.path.exists(md5_cache_path):
-            with open(md5_cache_path, 'rb') as f:
-                cached_md5 = pickle.load(f)
-            
-            # Check if vector DB exists
-            vector_db_path = load_from_cache(document_id, "vector_db_path")
-            if vector_db_path and os.path.exists(vector_db_path):
-                # Check if summary exists
-                summary = load_from_cache(document_id, "summary")
-                if summary is not None:
-                    # Check if MD5 matches
-                    if cached_md5 == current_md5:
-                        logger.info(f"Document {document_id} already processed with same MD5")
-                        return True
+        cached = result_cache.get_many(document_id, ["md5", "summary", "key_figures", "vector_db_path"])
+        if cached.get("summary") is None or "md5" not in cached:
+            return None
+
+        # Check if vector DB exists
+        vector_db_path = cached.get("vector_db_path")
+        if not vector_db_path or not os.path.exists(vector_db_path):
+            return None
+
+        # Check if MD5 matches
+        if cached["md5"] == result_cache.file_md5(document_id, file_path):
+            logger.info(f"Document {document_id} already processed with same MD5")
+            return {
+                "summary": cached["summary"],
+                "key_figures": cached.get("key_figures"),
+                "vector_db_path": vector_db_path
+            }
     except Exception as e:
         logger.error(f"Error checking document processed: {str(e)}")
     
-    return False
+    return None
+
+def check_document_processed(document_id: str, file_path: str) -> bool:
+    """Check if document has been processed and cached with the same MD5."""
+    return load_cached_results(document_id, file_path) is not None
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Statistics for the analysis result cache."""
+    stats = result_cache.stats()
+    stats["enabled"] = ENABLE_CACHING
+    return stats
 
 def get_document_type(file_path: str) -> str:
     """Determine document type based on content or filename."""
@@ -374,213 +384,129 @@ def process_document_mock(file_path: str, cancel_event=None) -> Dict[str, Any]:
         "vector_db_path": vector_db_path
     }
 
-def process_document_ollama(file_path: str, cancel_event=None) -> Dict[str, Any]:
-    """Process document using Ollama with cancellation support."""
-    logger.info(f"Processing document with Ollama: {file_path}")
-    logger.info(f"Using Ollama model: {OLLAMA_MODEL}")
-    logger.info(f"Using Ollama max tokens: {OLLAMA_MAX_TOKENS}")
+def _timed_call(func, *args) -> Tuple[Any, float]:
+    """Call func(*args) and return its result with the elapsed seconds."""
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round(time.perf_counter() - started, 3)
 
-    try:
-        # Check for cancellation before text extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama processing cancelled before text extraction")
-            return {"error": "Processing cancelled"}
-
-        # Extract text from document
-        text = extract_text_from_document(file_path)
-        if not text:
-            return {"error": "Failed to extract text from document"}
-
-        # Check for cancellation after text extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama processing cancelled after text extraction")
-            return {"error": "Processing cancelled"}
-        
-        # Create chunks
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=100
-        )
-        chunks = text_splitter.split_text(text)
-        
-        # Create vector DB
-        document_id = os.path.basename(os.path.dirname(file_path))
-        vector_db_path = os.path.join(VECTOR_DB_PATH, document_id)
-        
-        # Create embeddings for chunks
-        documents = [LangchainDocument(page_content=chunk, metadata={"source": file_path}) for chunk in chunks]
-        
-        # Use simple numpy embeddings for demo
-        embeddings = np.random.rand(len(documents), 768)
-        
-        # Save to FAISS
-        os.makedirs(vector_db_path, exist_ok=True)
-        with open(os.path.join(vector_db_path, "documents.pkl"), "wb") as f:
-            pickle.dump(documents, f)
-        
-        # Generate summary using Ollama
-        summary_prompt = f"""
-        {FINANCIAL_ANALYST_SYSTEM_PROMPT}
-        
-        Please analyze the following financial document and provide a comprehensive summary:
-        
-        {text[:50000]}  # Limit text to avoid token limits
-        
-        Your summary should include:
-        1. Key financial highlights
-        2. Important trends
-        3. Potential risks or opportunities
-        4. Management's outlook
-        """
-        
-        # Check for cancellation before summary generation
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama processing cancelled before summary generation")
-            return {"error": "Processing cancelled"}
+def run_analysis_stages(file_path: str, call_api, backend_name: str, cancel_event=None) -> Dict[str, Any]:
+    """
+    Run the document analysis stages for an LLM backend with cancellation support.
 
-        summary = call_ollama_api(summary_prompt, cancel_event)
+    Summary, key-figure extraction and chunk indexing only depend on the
+    extracted text, not on each other. Both LLM prompts are submitted to a small
+    thread pool while the calling thread builds the chunk index, so the wall time
+    is roughly the slowest generation instead of the sum of all stages.
+    """
+    timings = {}
 
-        # Check for cancellation after summary generation
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama processing cancelled after summary generation")
-            return {"error": "Processing cancelled"}
+    # Check for cancellation before text extraction
+    if cancel_event and cancel_event.is_set():
+        logger.info(f"{backend_name} processing cancelled before text extraction")
+        return {"error": "Processing cancelled"}
 
-        # Extract key figures using Ollama
-        key_figures_prompt = f"""
-        {FINANCIAL_ANALYST_SYSTEM_PROMPT}
+    # Extract text from document
+    text, timings["parse"] = _timed_call(extract_text_from_document, file_path)
+    if not text:
+        return {"error": "Failed to extract text from document"}
 
-        Please extract key financial figures from the following document:
+    # Check for cancellation after text extraction
+    if cancel_event and cancel_event.is_set():
+        logger.info(f"{backend_name} processing cancelled after text extraction")
+        return {"error": "Processing cancelled"}
 
-        {text[:50000]}  # Limit text to avoid token limits
+    summary_prompt = f"""
+    {FINANCIAL_ANALYST_SYSTEM_PROMPT}
+    
+    Please analyze the following financial document and provide a comprehensive summary:
+    
+    {text[:50000]}  # Limit text to avoid token limits
+    
+    Your summary should include:
+    1. Key financial highlights
+    2. Important trends
+    3. Potential risks or opportunities
+    4. Management's outlook
+    """
 
-        For each key figure, provide:
-        1. Name of the figure (e.g., "Annual Revenue", "Net Income", "Debt-to-Equity Ratio")
-        2. Value (e.g., "$1.25 billion", "15%", "0.68")
-        3. Source page number if available
+    key_figures_prompt = f"""
+    {FINANCIAL_ANALYST_SYSTEM_PROMPT}
 
-        Format your response as a JSON array of objects with "name", "value", and "source_page" fields.
-        """
+    Please extract key financial figures from the following document:
 
-        # Check for cancellation before key figures extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama processing cancelled before key figures extraction")
-            return {"error": "Processing cancelled"}
+    {text[:50000]}  # Limit text to avoid token limits
 
-        key_figures_response = call_ollama_api(key_figures_prompt, cancel_event)
-        
-        # Parse key figures from response
-        key_figures = extract_key_figures_from_response(key_figures_response)
-        
-        return {
-            "summary": summary,
-            "key_figures": key_figures,
-            "vector_db_path": vector_db_path
-        }
-    except Exception as e:
-        logger.error(f"Error processing document with Ollama: {e}")
-        return {"error": str(e)}
+    For each key figure, provide:
+    1. Name of the figure (e.g., "Annual Revenue", "Net Income", "Debt-to-Equity Ratio")
+    2. Value (e.g., "$1.25 billion", "15%", "0.68")
+    3. Source page number if available
 
-def process_document_openai(file_path: str, cancel_event=None) -> Dict[str, Any]:
-    """Process document using OpenAI with cancellation support."""
-    if not OPENAI_API_KEY:
-        return {"error": "OpenAI API key not provided"}
+    Format your response as a JSON array of objects with "name", "value", and "source_page" fields.
+    """
 
-    try:
-        # Check for cancellation before text extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("OpenAI processing cancelled before text extraction")
-            return {"error": "Processing cancelled"}
+    document_id = os.path.basename(os.path.dirname(file_path))
+    vector_db_path = os.path.join(VECTOR_DB_PATH, document_id)
 
-        # Extract text from document
-        text = extract_text_from_document(file_path)
-        if not text:
-            return {"error": "Failed to extract text from document"}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        summary_future = executor.submit(_timed_call, call_api, summary_prompt, cancel_event)
+        key_figures_future = executor.submit(_timed_call, call_api, key_figures_prompt, cancel_event)
 
-        # Check for cancellation after text extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("OpenAI processing cancelled after text extraction")
-            return {"error": "Processing cancelled"}
-        
-        # Create chunks
+        # Build the chunk index while both generations are in flight
+        index_started = time.perf_counter()
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=100
         )
         chunks = text_splitter.split_text(text)
-        
-        # Create vector DB
-        document_id = os.path.basename(os.path.dirname(file_path))
-        vector_db_path = os.path.join(VECTOR_DB_PATH, document_id)
-        
-        # Create embeddings for chunks
-        documents = [LangchainDocument(page_content=chunk, metadata={"source": file_path}) for chunk in chunks]
-        
-        # Use simple numpy embeddings for demo
-        embeddings = np.random.rand(len(documents), 768)
-        
-        # Save to FAISS
-        os.makedirs(vector_db_path, exist_ok=True)
-        with open(os.path.join(vector_db_path, "documents.pkl"), "wb") as f:
-            pickle.dump(documents, f)
-        
-        # Generate summary using OpenAI
-        summary_prompt = f"""
-        {FINANCIAL_ANALYST_SYSTEM_PROMPT}
-        
-        Please analyze the following financial document and provide a comprehensive summary:
-        
-        {text[:50000]}  # Limit text to avoid token limits
-        
-        Your summary should include:
-        1. Key financial highlights
-        2. Important trends
-        3. Potential risks or opportunities
-        4. Management's outlook
-        """
-        
-        # Check for cancellation before summary generation
-        if cancel_event and cancel_event.is_set():
-            logger.info("OpenAI processing cancelled before summary generation")
-            return {"error": "Processing cancelled"}
+        documents = [
+            LangchainDocument(page_content=chunk, metadata={"source": file_path, "chunk": i})
+            for i, chunk in enumerate(chunks)
+        ]
 
-        summary = call_openai_api(summary_prompt, cancel_event)
+        # Embed the chunks and persist the FAISS index next to the raw chunks
+        build_vector_index(documents, vector_db_path)
+        timings["index"] = round(time.perf_counter() - index_started, 3)
 
-        # Check for cancellation after summary generation
-        if cancel_event and cancel_event.is_set():
-            logger.info("OpenAI processing cancelled after summary generation")
-            return {"error": "Processing cancelled"}
+        summary, timings["summary"] = summary_future.result()
+        key_figures_response, timings["key_figures"] = key_figures_future.result()
 
-        # Extract key figures using OpenAI
-        key_figures_prompt = f"""
-        {FINANCIAL_ANALYST_SYSTEM_PROMPT}
+    # Check for cancellation after generation
+    if cancel_event and cancel_event.is_set():
+        logger.info(f"{backend_name} processing cancelled during generation")
+        return {"error": "Processing cancelled"}
+
+    # Parse key figures from response
+    key_figures = extract_key_figures_from_response(key_figures_response)
 
-        Please extract key financial figures from the following document:
+    logger.info(f"{backend_name} analysis stage timings for {file_path}: {timings}")
 
-        {text[:50000]}  # Limit text to avoid token limits
+    return {
+        "summary": summary,
+        "key_figures": key_figures,
+        "vector_db_path": vector_db_path,
+        "stage_timings": timings
+    }
 
-        For each key figure, provide:
-        1. Name of the figure (e.g., "Annual Revenue", "Net Income", "Debt-to-Equity Ratio")
-        2. Value (e.g., "$1.25 billion", "15%", "0.68")
-        3. Source page number if available
+def process_document_ollama(file_path: str, cancel_event=None) -> Dict[str, Any]:
+    """Process document using Ollama with cancellation support."""
+    logger.info(f"Processing document with Ollama: {file_path}")
+    logger.info(f"Using Ollama model: {OLLAMA_MODEL}")
+    logger.info(f"Using Ollama max tokens: {OLLAMA_MAX_TOKENS}")
 
-        Format your response as a JSON array of objects with "name", "value", and "source_page" fields.
-        """
+    try:
+        return run_analysis_stages(file_path, call_ollama_api, "Ollama", cancel_event)
+    except Exception as e:
+        logger.error(f"Error processing document with Ollama: {e}")
+        return {"error": str(e)}
 
-        # Check for cancellation before key figures extraction
-        if cancel_event and cancel_event.is_set():
-            logger.info("OpenAI processing cancelled before key figures extraction")
-            return {"error": "Processing cancelled"}
+def process_document_openai(file_path: str, cancel_event=None) -> Dict[str, Any]:
+    """Process document using OpenAI with cancellation support."""
+    if not OPENAI_API_KEY:
+        return {"error": "OpenAI API key not provided"}
 
-        key_figures_response = call_openai_api(key_figures_prompt, cancel_event)
-        
-        # Parse key figures from response
-        key_figures = extract_key_figures_from_response(key_figures_response)
-        
-        return {
-            "summary": summary,
-            "key_figures": key_figures,
-            "vector_db_path": vector_db_path
-        }
+    try:
+        return run_analysis_stages(file_path, call_openai_api, "OpenAI", cancel_event)
     except Exception as e:
         logger.error(f"Error processing document with OpenAI: {e}")
         return {"error": str(e)}
@@ -632,41 +558,102 @@ def extract_text_from_document(file_path: str) -> str:
         logger.error(f"Error extracting text from document {file_path}: {e}")
         return f"Error extracting text: {str(e)}"
 
-def call_ollama_api(prompt: str, cancel_event=None) -> str:
-    """Call Ollama API with prompt and cancellation support."""
-    # Declare global variable at the very beginning of the function
-    global OLLAMA_BASE_URL
+class OllamaEndpointDiscovery:
+    """
+    Resolves and caches the working Ollama endpoint.
 
-    try:
-        # Check for cancellation before starting
-        if cancel_event and cancel_event.is_set():
-            logger.info("Ollama API call cancelled before starting")
-            return "Processing cancelled"
+    The candidate URLs are probed with GET /api/version once, and the result is
+    reused for OLLAMA_DISCOVERY_TTL seconds or until a request against it fails.
+    All Ollama traffic goes through one keep-alive session so connections are
+    reused across generations.
+    """
 
-        # Try multiple URLs to find Ollama
-        urls_to_try = [
+    def __init__(self, ttl: int = OLLAMA_DISCOVERY_TTL):
+        self.ttl = ttl
+        self._url: Optional[str] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def candidates(self) -> List[str]:
+        return list(dict.fromkeys([
             OLLAMA_BASE_URL,
             "http://host.docker.internal:11434",
             "http://localhost:11434",
             "http://172.17.0.1:11434"  # Docker default bridge network
-        ]
+        ]))
 
-        working_url = None
-        for url in urls_to_try:
-            try:
-                logger.info(f"Trying Ollama URL: {url}")
-                response = requests.get(f"{url}/api/version", timeout=5)
-                if response.status_code == 200:
-                    working_url = url
-                    logger.info(f"Found working Ollama URL: {url}")
-                    # Update global URL if different
-                    if OLLAMA_BASE_URL != working_url:
-                        OLLAMA_BASE_URL = working_url
-                        logger.info(f"Updated OLLAMA_BASE_URL to {working_url}")
-                    break
-            except Exception as e:
-                logger.warning(f"Failed to connect to Ollama at {url}: {e}")
+    def get_url(self, force_refresh: bool = False) -> Optional[str]:
+        """Return the cached working URL, probing the candidates only when needed."""
+        global OLLAMA_BASE_URL
 
+        with self._lock:
+            if not force_refresh and self._url and time.time() - self._resolved_at < self.ttl:
+                return self._url
+
+            for url in self.candidates():
+                try:
+                    logger.info(f"Trying Ollama URL: {url}")
+                    response = self.session.get(f"{url}/api/version", timeout=5)
+                    if response.status_code == 200:
+                        logger.info(f"Found working Ollama URL: {url}")
+                        self._url = url
+                        self._resolved_at = time.time()
+                        # Update global URL if different
+                        if OLLAMA_BASE_URL != url:
+                            OLLAMA_BASE_URL = url
+                            logger.info(f"Updated OLLAMA_BASE_URL to {url}")
+                        return url
+                except Exception as e:
+                    logger.warning(f"Failed to connect to Ollama at {url}: {e}")
+
+            self._url = None
+            return None
+
+    def invalidate(self):
+        """Forget the cached endpoint so the next call probes again."""
+        with self._lock:
+            self._url = None
+
+    def warm_up(self, model: Optional[str] = None) -> bool:
+        """Load the model ahead of the first user request (an empty prompt only loads it)."""
+        url = self.get_url()
+        if not url:
+            logger.warning("Ollama warm-up skipped: no reachable endpoint")
+            return False
+        try:
+            response = self.session.post(
+                f"{url}/api/generate",
+                json={"model": model or OLLAMA_MODEL, "prompt": "", "keep_alive": OLLAMA_KEEP_ALIVE},
+                timeout=300
+            )
+            logger.info(f"Ollama warm-up for {model or OLLAMA_MODEL} returned {response.status_code}")
+            return response.status_code == 200
+        except Exception as e:
+            logger.warning(f"Ollama warm-up failed: {e}")
+            self.invalidate()
+            return False
+
+ollama_discovery = OllamaEndpointDiscovery()
+
+def warm_up_ollama_async():
+    """Warm up the Ollama model on a background thread when Ollama is the active backend."""
+    if LLM_MODE != "ollama":
+        return
+    threading.Thread(target=ollama_discovery.warm_up, name="ollama-warm-up", daemon=True).start()
+
+def call_ollama_api(prompt: str, cancel_event=None) -> str:
+    """Call Ollama API with prompt and cancellation support."""
+    try:
+        # Check for cancellation before starting
+        if cancel_event and cancel_event.is_set():
+            logger.info("Ollama API call cancelled before starting")
+            return "Processing cancelled"
+
+        working_url = ollama_discovery.get_url()
         if not working_url:
             return "Error: Could not connect to Ollama server. Please ensure Ollama is running and accessible."
 
@@ -680,6 +667,7 @@ def call_ollama_api(prompt: str, cancel_event=None) -> str:
             "model": OLLAMA_MODEL,
             "prompt": prompt,
             "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
             "options": {
                 "num_ctx": OLLAMA_MAX_TOKENS  # Use the configured max tokens
             }
@@ -688,43 +676,48 @@ def call_ollama_api(prompt: str, cancel_event=None) -> str:
         if OLLAMA_USE_CPU:
             payload["options"]["num_gpu"] = 0
 
-        # Create a session for better control
-        session = requests.Session()
-
         # Call Ollama API with reasonable timeout and cancellation checks
         logger.info("Starting Ollama API request")
         try:
-            response = session.post(
-                f"{working_url}/api/generate",
-                json=payload,
-                timeout=900  # 15 minutes timeout - reasonable for large documents
-            )
+            try:
+                response = ollama_discovery.session.post(
+                    f"{working_url}/api/generate",
+                    json=payload,
+                    timeout=900  # 15 minutes timeout - reasonable for large documents
+                )
+            except requests.exceptions.ConnectionError:
+                # The cached endpoint went away; re-probe once and retry
+                logger.warning(f"Lost connection to Ollama at {working_url}, re-probing endpoints")
+                working_url = ollama_discovery.get_url(force_refresh=True)
+                if not working_url:
+                    return "Error: Could not connect to Ollama server. Please ensure Ollama is running and accessible."
+                response = ollama_discovery.session.post(
+                    f"{working_url}/api/generate",
+                    json=payload,
+                    timeout=900
+                )
 
             # Check for cancellation after request
             if cancel_event and cancel_event.is_set():
                 logger.info("Ollama API call cancelled after request")
-                session.close()
                 return "Processing cancelled"
 
             if response.status_code == 200:
                 result = response.json().get("response", "")
-                session.close()
                 # Remove thinking sections from response (for models like DeepSeek R1)
                 result = remove_thinking_tags(result)
                 return result
             else:
                 logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                session.close()
                 return f"Error: Ollama API returned status code {response.status_code}"
         except requests.exceptions.Timeout:
-            logger.warning("Ollama API request timed out after 5 minutes")
-            session.close()
+            logger.warning("Ollama API request timed out after 15 minutes")
             if cancel_event and cancel_event.is_set():
                 return "Processing cancelled"
-            return "Error: Request timed out after 5 minutes. The document may be too large or complex for processing."
+            return "Error: Request timed out after 15 minutes. The document may be too large or complex for processing."
         except Exception as e:
             logger.error(f"Error during Ollama API request: {e}")
-            session.close()
+            ollama_discovery.invalidate()
             raise
 
     except Exception as e:
@@ -867,13 +860,10 @@ def process_document(file_path: str, cancel_event=None) -> Dict[str, Any]:
     document_id = os.path.basename(os.path.dirname(file_path))
 
     # Check if document already processed
-    if check_document_processed(document_id, file_path):
+    cached = load_cached_results(document_id, file_path)
+    if cached is not None:
         logger.info(f"Loading document {document_id} from cache")
-        return {
-            "summary": load_from_cache(document_id, "summary"),
-            "key_figures": load_from_cache(document_id, "key_figures"),
-            "vector_db_path": load_from_cache(document_id, "vector_db_path")
-        }
+        return cached
     
     # Check for cancellation before processing
     if cancel_event and cancel_event.is_set():
@@ -898,8 +888,8 @@ def process_document(file_path: str, cancel_event=None) -> Dict[str, Any]:
 
     # Cache results if successful
     if "error" not in result:
-        # Save MD5 hash
-        save_to_cache(document_id, "md5", get_file_md5(file_path))
+        # Save MD5 hash (reuses the fingerprint when the file is unchanged)
+        save_to_cache(document_id, "md5", result_cache.file_md5(document_id, file_path))
 
         # Save results
         save_to_cache(document_id, "summary", result.get("summary"))
@@ -908,6 +898,143 @@ def process_document(file_path: str, cancel_event=None) -> Dict[str, Any]:
 
     return result
 
+def get_embeddings():
+    """Embedding model for the active LLM backend, or None in mock mode."""
+    if LLM_MODE == "ollama":
+        from langchain_community.embeddings import OllamaEmbeddings
+        base_url = ollama_discovery.get_url() or OLLAMA_BASE_URL
+        return OllamaEmbeddings(base_url=base_url, model=OLLAMA_EMBEDDING_MODEL)
+    if LLM_MODE == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        api_key = OPENAI_API_KEY if OPENAI_API_KEY != "none" else "lm-studio"
+        return OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            openai_api_base=EMBEDDING_BASE_URL or OPENAI_BASE_URL,
+            openai_api_key=api_key,
+            # LM Studio and other compatible servers don't accept pre-tokenized input
+            check_embedding_ctx_length=False
+        )
+    return None
+
+def get_embedding_signature() -> str:
+    """Identifies the embedding model, so an index is only queried with the model that built it."""
+    if LLM_MODE == "ollama":
+        return f"ollama:{OLLAMA_EMBEDDING_MODEL}"
+    if LLM_MODE == "openai":
+        return f"openai:{EMBEDDING_MODEL}"
+    return "none"
+
+def build_vector_index(documents: List[LangchainDocument], vector_db_path: str) -> bool:
+    """
+    Persist the chunks and their FAISS index under vector_db_path.
+
+    The raw chunks are always written to documents.pkl; if the embedding
+    backend is unavailable, questions fall back to keyword ranking over them.
+    """
+    os.makedirs(vector_db_path, exist_ok=True)
+    with open(os.path.join(vector_db_path, "documents.pkl"), "wb") as f:
+        pickle.dump(documents, f)
+
+    if not documents:
+        return False
+
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return False
+
+    try:
+        index = FAISS.from_documents(documents, embeddings)
+        index.save_local(vector_db_path)
+        with open(os.path.join(vector_db_path, "embedding.json"), "w") as f:
+            json.dump({"signature": get_embedding_signature(), "chunks": len(documents)}, f)
+        evict_vector_index(vector_db_path)
+        logger.info(f"Built vector index with {len(documents)} chunks at {vector_db_path}")
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to build vector index at {vector_db_path}, questions will use keyword ranking: {e}")
+        return False
+
+# The VECTOR_INDEX_CACHE_SIZE most recently used FAISS indexes, keyed by path,
+# with the index file mtime they were loaded at
+_vector_index_cache: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+_vector_index_lock = threading.Lock()
+
+def evict_vector_index(vector_db_path: str):
+    """Drop a loaded index from memory, e.g. after it is rebuilt or its document is deleted."""
+    with _vector_index_lock:
+        _vector_index_cache.pop(vector_db_path, None)
+
+def load_vector_index(vector_db_path: str):
+    """Load the persisted FAISS index for a document, or None if there is no usable one."""
+    index_file = os.path.join(vector_db_path, "index.faiss")
+    meta_file = os.path.join(vector_db_path, "embedding.json")
+    if not os.path.exists(index_file) or not os.path.exists(meta_file):
+        return None
+
+    with open(meta_file, "r") as f:
+        signature = json.load(f).get("signature")
+    if signature != get_embedding_signature():
+        logger.info(f"Vector index at {vector_db_path} was built with {signature}, not {get_embedding_signature()}")
+        return None
+
+    mtime = os.path.getmtime(index_file)
+    with _vector_index_lock:
+        cached = _vector_index_cache.get(vector_db_path)
+        if cached and cached[0] == mtime:
+            _vector_index_cache.move_to_end(vector_db_path)
+            return cached[1]
+
+    embeddings = get_embeddings()
+    if embeddings is None:
+        return None
+    index = FAISS.load_local(vector_db_path, embeddings)
+    with _vector_index_lock:
+        _vector_index_cache[vector_db_path] = (mtime, index)
+        _vector_index_cache.move_to_end(vector_db_path)
+        while len(_vector_index_cache) > max(VECTOR_INDEX_CACHE_SIZE, 1):
+            _vector_index_cache.popitem(last=False)
+    return index
+
+def _keyword_rank(documents: List[LangchainDocument], question: str, k: int) -> List[LangchainDocument]:
+    """Rank chunks by how many question terms they contain (used when no vector index exists)."""
+    import re
+    terms = {t for t in re.findall(r"[a-z0-9]+", question.lower()) if len(t) > 2}
+    if not terms:
+        return documents[:k]
+    scored = []
+    for position, doc in enumerate(documents):
+        words = re.findall(r"[a-z0-9]+", doc.page_content.lower())
+        score = sum(1 for w in words if w in terms)
+        scored.append((-score, position, doc))
+    scored.sort(key=lambda item: (item[0], item[1]))
+    return [doc for _, _, doc in scored[:k]]
+
+def retrieve_relevant_chunks(vector_db_path: str, question: str, k: int = RETRIEVAL_TOP_K) -> Optional[List[LangchainDocument]]:
+    """
+    Top-k chunks for a question: similarity search over the document's FAISS
+    index, or keyword ranking over the stored chunks for documents indexed
+    before embeddings were available. Returns None if the document has no chunks.
+    """
+    try:
+        index = load_vector_index(vector_db_path)
+        if index is not None:
+            return index.similarity_search(question, k=k)
+    except Exception as e:
+        logger.warning(f"Vector search failed for {vector_db_path}, falling back to keyword ranking: {e}")
+
+    documents_path = os.path.join(vector_db_path, "documents.pkl")
+    if not os.path.exists(documents_path):
+        return None
+    with open(documents_path, "rb") as f:
+        documents = pickle.load(f)
+    return _keyword_rank(documents, question, k)
+
+def _chunk_sources(chunks: List[LangchainDocument]) -> List[Dict[str, Any]]:
+    return [{
+        "page": doc.metadata.get("chunk", i) + 1,  # Chunk position; page numbers aren't tracked
+        "snippet": doc.page_content[:100] + "..."  # First 100 chars
+    } for i, doc in enumerate(chunks)]
+
 def ask_question(vector_db_path: str, question: str) -> Dict[str, Any]:
     """Ask a question about a document."""
     # Get document ID from vector DB path
@@ -968,19 +1095,13 @@ def ask_question_mock(document_id: str, question: str) -> Dict[str, Any]:
 def ask_question_ollama(vector_db_path: str, question: str) -> Dict[str, Any]:
     """Ask a question using Ollama."""
     try:
-        # Load documents from vector DB
-        documents_path = os.path.join(vector_db_path, "documents.pkl")
-        if not os.path.exists(documents_path):
+        # Retrieve the chunks most similar to the question
+        relevant_chunks = retrieve_relevant_chunks(vector_db_path, question)
+        if relevant_chunks is None:
             return {
                 "answer": "Document vector database not found",
                 "sources": []
             }
-        
-        with open(documents_path, "rb") as f:
-            documents = pickle.load(f)
-        
-        # Get relevant chunks (simple approach for demo)
-        relevant_chunks = documents[:3]  # Just use first 3 chunks
         context = "\n\n".join([doc.page_content for doc in relevant_chunks])
         
         # Prepare prompt
@@ -998,17 +1119,9 @@ def ask_question_ollama(vector_db_path: str, question: str) -> Dict[str, Any]:
         # Call Ollama API
         answer = call_ollama_api(prompt)
         
-        # Prepare sources
-        sources = []
-        for i, doc in enumerate(relevant_chunks):
-            sources.append({
-                "page": i + 1,  # Mock page number
-                "snippet": doc.page_content[:100] + "..."  # First 100 chars
-            })
-        
         return {
             "answer": answer,
-            "sources": sources
+            "sources": _chunk_sources(relevant_chunks)
         }
     except Exception as e:
         logger.error(f"Error asking question with Ollama: {e}")
@@ -1026,19 +1139,13 @@ def ask_question_openai(vector_db_path: str, question: str) -> Dict[str, Any]:
         }
     
     try:
-        # Load documents from vector DB
-        documents_path = os.path.join(vector_db_path, "documents.pkl")
-        if not os.path.exists(documents_path):
+        # Retrieve the chunks most similar to the question
+        relevant_chunks = retrieve_relevant_chunks(vector_db_path, question)
+        if relevant_chunks is None:
             return {
                 "answer": "Document vector database not found",
                 "sources": []
             }
-        
-        with open(documents_path, "rb") as f:
-            documents = pickle.load(f)
-        
-        # Get relevant chunks (simple approach for demo)
-        relevant_chunks = documents[:3]  # Just use first 3 chunks
         context = "\n\n".join([doc.page_content for doc in relevant_chunks])
         
         # Prepare prompt
@@ -1054,17 +1161,9 @@ def ask_question_openai(vector_db_path: str, question: str) -> Dict[str, Any]:
         # Call OpenAI API
         answer = call_openai_api(prompt)
         
-        # Prepare sources
-        sources = []
-        for i, doc in enumerate(relevant_chunks):
-            sources.append({
-                "page": i + 1,  # Mock page number
-                "snippet": doc.page_content[:100] + "..."  # First 100 chars
-            })
-        
         return {
             "answer": answer,
-            "sources": sources
+            "sources": _chunk_sources(relevant_chunks)
         }
     except Exception as e:
         logger.error(f"Error asking question with OpenAI: {e}")
@@ -1075,8 +1174,6 @@ def ask_question_openai(vector_db_path: str, question: str) -> Dict[str, Any]:
 
 def get_llm_status() -> Dict[str, Any]:
     """Get LLM status."""
-    global OLLAMA_BASE_URL
-
     status = {
         "status": "available",
         "mode": LLM_MODE,
@@ -1091,33 +1188,14 @@ def get_llm_status() -> Dict[str, Any]:
 
         # Check Ollama connection
         try:
-            # Try multiple URLs to find Ollama
-            urls_to_try = [
-                OLLAMA_BASE_URL,
-                "http://host.docker.internal:11434",
-                "http://localhost:11434",
-                "http://172.17.0.1:11434"  # Docker default bridge network
-            ]
+            working_url = ollama_discovery.get_url()
 
-            working_url = None
-            for url in urls_to_try:
-                try:
-                    response = requests.get(f"{url}/api/version", timeout=5)
-                    if response.status_code == 200:
-                        working_url = url
-                        # Update global URL if different
-                        if OLLAMA_BASE_URL != working_url:
-                            OLLAMA_BASE_URL = working_url
-                        break
-                except:
-                    pass
-            
             if not working_url:
                 status["status"] = "error"
                 status["error"] = "Could not connect to Ollama server"
             else:
                 # Check if model is available
-                response = requests.get(f"{working_url}/api/tags", timeout=5)
+                response = ollama_discovery.session.get(f"{working_url}/api/tags", timeout=5)
                 if response.status_code == 200:
                     models = response.json().get("models", [])
                     model_names = [model.get("name") for model in models]
@@ -1178,6 +1256,9 @@ def set_llm_mode(mode: str, api_key: Optional[str] = None, model: Optional[str]
     elif mode == "ollama" and model:
         OLLAMA_MODEL = model
 
+    # Load the newly selected Ollama model before the first request needs it
+    warm_up_ollama_async()
+
     return {
         "status": "success",
         "message": f"LLM mode set to {mode}",
@@ -1195,17 +1276,8 @@ def get_available_llm_modes() -> List[str]:
 def clear_document_cache(document_id: str) -> bool:
     """Clear cache for a specific document."""
     try:
-        cache_operations = ["md5", "summary", "key_figures", "vector_db_path"]
-        cleared_count = 0
-
-        for operation in cache_operations:
-            cache_path = get_cache_path(document_id, operation)
-            if os.path.exists(cache_path):
-                os.remove(cache_path)
-                cleared_count += 1
-                logger.info(f"Cleared cache for document {document_id}, operation: {operation}")
-
-        logger.info(f"Cleared {cleared_count} cache files for document {document_id}")
+        cleared_count = result_cache.delete_document(document_id)
+        logger.info(f"Cleared {cleared_count} cache entries for document {document_id}")
         return True
     except Exception as e:
         logger.error(f"Error clearing cache for document {document_id}: {e}")
@@ -1214,12 +1286,13 @@ def clear_document_cache(document_id: str) -> bool:
 def clear_all_cache() -> bool:
     """Clear all cached data."""
     try:
+        result_cache.clear()
+        # Remove per-key pickle files left by the previous cache layout
         if os.path.exists(CACHE_PATH):
-            import shutil
-            shutil.rmtree(CACHE_PATH)
-            os.makedirs(CACHE_PATH, exist_ok=True)
-            logger.info("Cleared all cache data")
-            return True
+            for name in os.listdir(CACHE_PATH):
+                if name.endswith(".pkl"):
+                    os.remove(os.path.join(CACHE_PATH, name))
+        logger.info("Cleared all cache data")
         return True
     except Exception as e:
         logger.error(f"Error clearing all cache: {e}")
@@ -37,6 +37,17 @@ class Document(Base):
     analysis_results = relationship("AnalysisResult", back_populates="document", cascade="all, delete-orphan")
     qa_sessions = relationship("QASession", back_populates="document", cascade="all, delete-orphan")
 
+class StorageUsage(Base):
+    """Running storage totals per owner, area and file extension (owner 0: not tied to a user)."""
+    __tablename__ = "storage_usage"
+
+    owner_id = Column(Integer, primary_key=True)
+    bucket = Column(String, primary_key=True)  # documents, vector_db, cache, database or minio
+    extension = Column(String, primary_key=True)
+    size_bytes = Column(Integer, default=0)
+    object_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class AnalysisResult(Base):
     __tablename__ = "analysis_results"
     
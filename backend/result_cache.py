@@ -0,0 +1,247 @@
+"""
+Result cache for document analysis.
+
+Keeps every cached (document, operation) result in a single SQLite file under
+CACHE_PATH instead of one pickle file per key. Entries are indexed by
+(document_id, operation) and by last access time, so lookups and LRU eviction
+stay cheap as the cache grows. File fingerprints are stored alongside the
+results: a (size, mtime) match reuses the stored MD5 without re-reading the file.
+"""
+
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(512 * 1024 * 1024)))  # 512 MB
+HASH_BUFFER_SIZE = 1024 * 1024  # Read files in 1 MB blocks when hashing
+EVICT_BATCH = 500  # Entries considered per eviction round when only the byte limit is exceeded
+
+class ResultCache:
+    """Single-file SQLite store for cached analysis results and file fingerprints."""
+
+    def __init__(self, db_path: str, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fingerprint_shortcuts = 0
+        self.full_hashes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        # Running totals of cache_entries, so writes don't have to scan it
+        self._entries = 0
+        self._bytes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so clearing the cache directory doesn't leave a dead handle
+        if self._conn is None or not os.path.exists(self.db_path):
+            if self._conn is not None:
+                self._conn.close()
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    document_id TEXT NOT NULL,
+                    operation TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (document_id, operation)
+                );
+                CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+                CREATE TABLE IF NOT EXISTS file_fingerprints (
+                    document_id TEXT PRIMARY KEY,
+                    file_size INTEGER NOT NULL,
+                    file_mtime_ns INTEGER NOT NULL,
+                    md5 TEXT NOT NULL
+                );
+            """)
+            self._load_totals(self._conn)
+        return self._conn
+
+    def _load_totals(self, conn: sqlite3.Connection):
+        self._entries, self._bytes = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+
+    def get(self, document_id: str, operation: str) -> Optional[Any]:
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value FROM cache_entries WHERE document_id = ? AND operation = ?",
+                (document_id, operation)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE document_id = ? AND operation = ?",
+                (time.time(), document_id, operation)
+            )
+            self.hits += 1
+        return pickle.loads(row[0])
+
+    def get_many(self, document_id: str, operations) -> Dict[str, Any]:
+        """Fetch several operations for a document in one query; missing ones are omitted."""
+        operations = list(operations)
+        placeholders = ",".join("?" for _ in operations)
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(
+                f"SELECT operation, value FROM cache_entries WHERE document_id = ? AND operation IN ({placeholders})",
+                [document_id] + operations
+            ).fetchall()
+            if rows:
+                conn.execute(
+                    f"UPDATE cache_entries SET accessed_at = ? WHERE document_id = ? AND operation IN ({placeholders})",
+                    [time.time(), document_id] + operations
+                )
+            self.hits += len(rows)
+            self.misses += len(operations) - len(rows)
+        return {operation: pickle.loads(value) for operation, value in rows}
+
+    def set(self, document_id: str, operation: str, data: Any) -> None:
+        value = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            replaced = conn.execute(
+                "SELECT size FROM cache_entries WHERE document_id = ? AND operation = ?",
+                (document_id, operation)
+            ).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (document_id, operation, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (document_id, operation, value, len(value), now, now)
+            )
+            if replaced:
+                self._bytes -= replaced[0]
+            else:
+                self._entries += 1
+            self._bytes += len(value)
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """
+        Drop least recently used entries until both the entry and byte limits
+        hold. The running totals decide whether to evict; the table is only
+        counted again once a limit is exceeded, which also corrects any drift
+        from other processes sharing the file.
+        """
+        if self._entries <= self.max_entries and self._bytes <= self.max_bytes:
+            return
+        self._load_totals(conn)
+        count, total = self._entries, self._bytes
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = 0
+        while count > self.max_entries or total > self.max_bytes:
+            # Of the oldest entries, delete as many as cover both excesses, in SQL
+            excess_entries = max(count - self.max_entries, 0)
+            excess_bytes = max(total - self.max_bytes, 0)
+            deleted = conn.execute("""
+                DELETE FROM cache_entries WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, size,
+                               ROW_NUMBER() OVER (ORDER BY accessed_at, rowid) AS position,
+                               SUM(size) OVER (ORDER BY accessed_at, rowid) AS running_bytes
+                        FROM (SELECT rowid, size, accessed_at FROM cache_entries ORDER BY accessed_at LIMIT ?)
+                    )
+                    WHERE position <= ? OR running_bytes - size < ?
+                )
+            """, (max(excess_entries, EVICT_BATCH), excess_entries, excess_bytes)).rowcount
+            if not deleted:
+                break
+            evicted += deleted
+            self._load_totals(conn)
+            count, total = self._entries, self._bytes
+        self.evictions += evicted
+        logger.info(f"Evicted {evicted} cache entries (now {count} entries, {total} bytes)")
+
+    def file_md5(self, document_id: str, file_path: str) -> str:
+        """
+        MD5 of a document's file, re-hashed only when its size or mtime changed
+        since the last time it was fingerprinted.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT file_size, file_mtime_ns, md5 FROM file_fingerprints WHERE document_id = ?",
+                (document_id,)
+            ).fetchone()
+            if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+                self.fingerprint_shortcuts += 1
+                return row[2]
+
+        md5 = compute_file_md5(file_path)
+        with self._lock:
+            self.full_hashes += 1
+            self._connection().execute(
+                "INSERT OR REPLACE INTO file_fingerprints (document_id, file_size, file_mtime_ns, md5) VALUES (?, ?, ?, ?)",
+                (document_id, stat.st_size, stat.st_mtime_ns, md5)
+            )
+        return md5
+
+    def delete_document(self, document_id: str) -> int:
+        """Remove all cached results and the fingerprint for a document."""
+        with self._lock:
+            conn = self._connection()
+            entries, size = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE document_id = ?", (document_id,)
+            ).fetchone()
+            deleted = conn.execute("DELETE FROM cache_entries WHERE document_id = ?", (document_id,)).rowcount
+            self._entries -= entries
+            self._bytes -= size
+            conn.execute("DELETE FROM file_fingerprints WHERE document_id = ?", (document_id,))
+        return deleted
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM cache_entries")
+            conn.execute("DELETE FROM file_fingerprints")
+            conn.execute("VACUUM")
+            self._entries = self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            conn = self._connection()
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+            documents = conn.execute("SELECT COUNT(DISTINCT document_id) FROM cache_entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "db_path": self.db_path,
+            "entries": entries,
+            "documents": documents,
+            "total_bytes": total,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "fingerprint_shortcuts": self.fingerprint_shortcuts,
+            "full_hashes": self.full_hashes
+        }
+
+def compute_file_md5(file_path: str) -> str:
+    """Calculate MD5 hash of a file."""
+    hash_md5 = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+            hash_md5.update(chunk)
+    return hash_md5.hexdigest()
@@ -7,29 +7,31 @@ import os
 import json
 import logging
 import shutil
+import threading
+from collections import defaultdict
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, text
 
-from models import User, Document, AnalysisResult, QASession, Question
-from config import STORAGE_PATH, DOCUMENTS_BUCKET, minio_client
+from models import User, Document, AnalysisResult, QASession, Question, StorageUsage
+from config import (
+    STORAGE_PATH, DOCUMENTS_BUCKET, minio_client, SessionLocal,
+    STORAGE_USER_QUOTA_BYTES, STORAGE_RECONCILE_INTERVAL
+)
 
 logger = logging.getLogger(__name__)
 
-def get_directory_size(path: str) -> int:
-    """Calculate total size of directory in bytes."""
-    total_size = 0
-    try:
-        for dirpath, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                if os.path.exists(filepath):
-                    total_size += os.path.getsize(filepath)
-    except Exception as e:
-        logger.error(f"Error calculating directory size for {path}: {e}")
-    return total_size
+# Storage areas tracked in the storage_usage ledger
+STORAGE_AREAS = {
+    "database": f"{STORAGE_PATH}/db",
+    "documents": f"{STORAGE_PATH}/temp",  # Local temp storage
+    "vector_db": f"{STORAGE_PATH}/vector_db",
+    "cache": f"{STORAGE_PATH}/cache"
+}
+MINIO_AREA = "minio"
+UNOWNED = 0  # Owner of files not tied to a user
 
 def format_file_size(size_bytes: int) -> str:
     """Format file size in human readable format."""
@@ -44,18 +46,167 @@ def format_file_size(size_bytes: int) -> str:
     
     return f"{size_bytes:.1f} {size_names[i]}"
 
-def get_file_count(path: str) -> int:
-    """Count total number of files in directory."""
-    count = 0
-    try:
-        for dirpath, dirnames, filenames in os.walk(path):
-            count += len(filenames)
-    except Exception as e:
-        logger.error(f"Error counting files in {path}: {e}")
-    return count
+def file_extension(name: str) -> str:
+    return os.path.splitext(name or "")[1].lower()
+
+def record_storage_usage(db: Session, owner_id: int, bucket: str, name: str, size_bytes: int, object_count: int = 1):
+    """
+    Apply a delta to the storage ledger; negative values for removals.
+    Not committed here, so it lands in the same transaction as the change it records.
+    """
+    db.execute(text("""
+        INSERT INTO storage_usage (owner_id, bucket, extension, size_bytes, object_count, updated_at)
+        VALUES (:owner_id, :bucket, :extension, :size_bytes, :object_count, :now)
+        ON CONFLICT (owner_id, bucket, extension) DO UPDATE SET
+            size_bytes = storage_usage.size_bytes + excluded.size_bytes,
+            object_count = storage_usage.object_count + excluded.object_count,
+            updated_at = excluded.updated_at
+    """), {
+        "owner_id": owner_id, "bucket": bucket, "extension": file_extension(name),
+        "size_bytes": size_bytes, "object_count": object_count, "now": datetime.utcnow()
+    })
+
+def get_user_storage_usage(db: Session, user_id: int) -> int:
+    """Bytes stored for a user, from the ledger."""
+    used = db.query(func.sum(StorageUsage.size_bytes)).filter(StorageUsage.owner_id == user_id).scalar()
+    return int(used or 0)
+
+def check_storage_quota(db: Session, user_id: int, incoming_bytes: int = 0) -> Dict[str, Any]:
+    """Whether a user can store `incoming_bytes` more under STORAGE_USER_QUOTA_BYTES."""
+    used = get_user_storage_usage(db, user_id)
+    quota = STORAGE_USER_QUOTA_BYTES
+    return {
+        "quota_bytes": quota or None,
+        "used_bytes": used,
+        "remaining_bytes": max(quota - used, 0) if quota else None,
+        "allowed": not quota or used + incoming_bytes <= quota
+    }
+
+def _walk_usage(path: str, bucket: str, owner_of) -> Dict[Tuple[int, str, str], List[int]]:
+    """Sizes and counts of the files under `path`, keyed like storage_usage rows."""
+    usage = defaultdict(lambda: [0, 0])
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            try:
+                size = os.path.getsize(filepath)
+            except OSError:
+                continue  # Removed while walking
+            entry = usage[(owner_of(filepath), bucket, file_extension(filename))]
+            entry[0] += size
+            entry[1] += 1
+    return usage
+
+def reconcile_storage_ledger(db: Session) -> Dict[str, Any]:
+    """
+    Recompute the storage ledger from what is actually stored.
+
+    Documents are counted from their rows, which is what uploads and deletes
+    keep the ledger in step with. The other areas are only written by the
+    document pipeline and are walked (or listed, for MinIO) before the
+    ledger is rewritten in a single transaction.
+    """
+    started = datetime.utcnow()
+    document_owners = {str(doc_id): owner_id for doc_id, owner_id in db.query(Document.id, Document.owner_id)}
+
+    def vector_db_owner(filepath: str) -> int:
+        # Vector stores live in vector_db/<document_id>/
+        relative = os.path.relpath(filepath, STORAGE_AREAS["vector_db"])
+        return document_owners.get(relative.split(os.sep)[0], UNOWNED)
+
+    def cache_owner(filepath: str) -> int:
+        prefix = os.path.basename(filepath).split("_")[0]
+        return int(prefix) if prefix.isdigit() else UNOWNED
+
+    actual = defaultdict(lambda: [0, 0])
+    walks = [
+        ("database", lambda filepath: UNOWNED),
+        ("vector_db", vector_db_owner),
+        ("cache", cache_owner),
+    ]
+    for bucket, owner_of in walks:
+        if os.path.exists(STORAGE_AREAS[bucket]):
+            for key, (size, count) in _walk_usage(STORAGE_AREAS[bucket], bucket, owner_of).items():
+                actual[key][0] += size
+                actual[key][1] += count
 
-def get_storage_overview() -> Dict[str, Any]:
-    """Get comprehensive storage overview."""
+    if minio_client:
+        try:
+            for obj in minio_client.list_objects(DOCUMENTS_BUCKET, recursive=True):
+                # Objects are stored as <user_id>/<filename>
+                prefix = obj.object_name.split("/")[0]
+                owner_id = int(prefix) if prefix.isdigit() else UNOWNED
+                entry = actual[(owner_id, MINIO_AREA, file_extension(obj.object_name))]
+                entry[0] += obj.size or 0
+                entry[1] += 1
+        except Exception as e:
+            logger.error(f"Error listing MinIO objects for the storage ledger: {e}")
+
+    recorded = {
+        (row.owner_id, row.bucket, row.extension): (row.size_bytes, row.object_count)
+        for row in db.query(StorageUsage).all()
+    }
+
+    # Taking the write lock first keeps uploads and deletes out until the ledger is rewritten
+    db.query(StorageUsage).delete(synchronize_session=False)
+    for owner_id, file_path, file_size in db.query(Document.owner_id, Document.file_path, Document.file_size):
+        entry = actual[(owner_id, "documents", file_extension(file_path))]
+        entry[0] += file_size or 0
+        entry[1] += 1
+    for (owner_id, bucket, extension), (size, count) in actual.items():
+        db.add(StorageUsage(
+            owner_id=owner_id, bucket=bucket, extension=extension,
+            size_bytes=size, object_count=count, updated_at=started
+        ))
+    db.commit()
+
+    drifted = [
+        key for key in set(actual) | set(recorded)
+        if tuple(actual.get(key, (0, 0))) != tuple(recorded.get(key, (0, 0)))
+    ]
+    if drifted:
+        logger.info(f"Storage ledger corrected {len(drifted)} rows")
+    return {
+        "corrected_rows": len(drifted),
+        "seconds": round((datetime.utcnow() - started).total_seconds(), 3),
+        "finished_at": datetime.utcnow().isoformat()
+    }
+
+class StorageLedgerReconciler:
+    """Runs reconcile_storage_ledger periodically, or sooner when triggered."""
+
+    def __init__(self, interval: float = STORAGE_RECONCILE_INTERVAL):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="storage-reconciler", daemon=True)
+            self._thread.start()
+
+    def trigger(self):
+        """Reconcile soon, e.g. after a cleanup removed files the ledger doesn't track."""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                with SessionLocal() as db:
+                    self.last_result = reconcile_storage_ledger(db)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Error reconciling storage ledger: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+storage_reconciler = StorageLedgerReconciler()
+
+def get_storage_overview(db: Session) -> Dict[str, Any]:
+    """Get comprehensive storage overview from the storage ledger."""
     try:
         storage_info = {
             "total_size": 0,
@@ -64,69 +215,42 @@ def get_storage_overview() -> Dict[str, Any]:
             "last_updated": datetime.utcnow().isoformat()
         }
         
-        # Define storage directories
-        directories = {
-            "database": f"{STORAGE_PATH}/db",
-            "documents": f"{STORAGE_PATH}/temp",  # Local temp storage
-            "vector_db": f"{STORAGE_PATH}/vector_db",
-            "cache": f"{STORAGE_PATH}/cache"
+        totals = {
+            bucket: (int(size or 0), int(count or 0))
+            for bucket, size, count in db.query(
+                StorageUsage.bucket, func.sum(StorageUsage.size_bytes), func.sum(StorageUsage.object_count)
+            ).group_by(StorageUsage.bucket)
         }
         
-        for name, path in directories.items():
-            if os.path.exists(path):
-                size = get_directory_size(path)
-                file_count = get_file_count(path)
-                
-                storage_info["directories"][name] = {
-                    "path": path,
-                    "size_bytes": size,
-                    "size_formatted": format_file_size(size),
-                    "file_count": file_count,
-                    "exists": True
-                }
-                
-                storage_info["total_size"] += size
-                storage_info["total_files"] += file_count
-            else:
-                storage_info["directories"][name] = {
-                    "path": path,
-                    "size_bytes": 0,
-                    "size_formatted": "0 B",
-                    "file_count": 0,
-                    "exists": False
-                }
-        
-        storage_info["total_size_formatted"] = format_file_size(storage_info["total_size"])
+        for name, path in STORAGE_AREAS.items():
+            size, file_count = totals.get(name, (0, 0))
+            exists = os.path.exists(path)
+            storage_info["directories"][name] = {
+                "path": path,
+                "size_bytes": size,
+                "size_formatted": format_file_size(size),
+                "file_count": file_count,
+                "exists": exists
+            }
+            storage_info["total_size"] += size
+            storage_info["total_files"] += file_count
         
         # Add MinIO storage info if available
         if minio_client:
-            try:
-                minio_objects = list(minio_client.list_objects(DOCUMENTS_BUCKET, recursive=True))
-                minio_size = sum(obj.size for obj in minio_objects if obj.size)
-                minio_count = len(minio_objects)
-                
-                storage_info["directories"]["minio"] = {
-                    "path": f"MinIO bucket: {DOCUMENTS_BUCKET}",
-                    "size_bytes": minio_size,
-                    "size_formatted": format_file_size(minio_size),
-                    "file_count": minio_count,
-                    "exists": True
-                }
-                
-                storage_info["total_size"] += minio_size
-                storage_info["total_files"] += minio_count
-                storage_info["total_size_formatted"] = format_file_size(storage_info["total_size"])
-                
-            except Exception as e:
-                logger.error(f"Error getting MinIO storage info: {e}")
-                storage_info["directories"]["minio"] = {
-                    "path": f"MinIO bucket: {DOCUMENTS_BUCKET}",
-                    "size_bytes": 0,
-                    "size_formatted": "Error",
-                    "file_count": 0,
-                    "exists": False,
-                    "error": str(e)
-                }
+            size, file_count = totals.get(MINIO_AREA, (0, 0))
+            storage_info["directories"][MINIO_AREA] = {
+                "path": f"MinIO bucket: {DOCUMENTS_BUCKET}",
+                "size_bytes": size,
+                "size_formatted": format_file_size(size),
+                "file_count": file_count,
+                "exists": True
+            }
+            storage_info["total_size"] += size
+            storage_info["total_files"] += file_count
+        
+        storage_info["total_size_formatted"] = format_file_size(storage_info["total_size"])
+        if storage_reconciler.last_result:
+            storage_info["last_updated"] = storage_reconciler.last_result["finished_at"]
         
         return storage_info
         
@@ -151,6 +275,17 @@ def get_user_storage_details(db: Session, user_id: Optional[int] = None) -> List
         users = query.all()
         user_storage_data = []
         
+        # Ledger totals for all requested users in one query
+        usage = defaultdict(dict)
+        ledger_query = db.query(
+            StorageUsage.owner_id, StorageUsage.bucket,
+            func.sum(StorageUsage.size_bytes), func.sum(StorageUsage.object_count)
+        ).filter(StorageUsage.owner_id != UNOWNED)
+        if user_id:
+            ledger_query = ledger_query.filter(StorageUsage.owner_id == user_id)
+        for owner_id, bucket, size, count in ledger_query.group_by(StorageUsage.owner_id, StorageUsage.bucket):
+            usage[owner_id][bucket] = (int(size or 0), int(count or 0))
+        
         for user in users:
             user_data = {
                 "user_id": user.id,
@@ -180,56 +315,25 @@ def get_user_storage_details(db: Session, user_id: Optional[int] = None) -> List
                 }
             }
             
-            # Get document statistics
-            documents = db.query(Document).filter(Document.owner_id == user.id).all()
-            user_data["storage"]["documents"]["count"] = len(documents)
-            
-            # Calculate document sizes
-            total_doc_size = 0
-            for doc in documents:
-                if doc.file_path and os.path.exists(doc.file_path):
-                    total_doc_size += os.path.getsize(doc.file_path)
-                
-                # Add MinIO document size if available
-                if minio_client and doc.filename:
-                    try:
-                        obj_info = minio_client.stat_object(DOCUMENTS_BUCKET, f"{user.id}/{doc.filename}")
-                        total_doc_size += obj_info.size
-                    except Exception:
-                        pass  # Object might not exist in MinIO
-            
-            user_data["storage"]["documents"]["total_size"] = total_doc_size
-            user_data["storage"]["documents"]["total_size_formatted"] = format_file_size(total_doc_size)
+            user_usage = usage.get(user.id, {})
+            doc_size, doc_count = user_usage.get("documents", (0, 0))
+            minio_size, _ = user_usage.get(MINIO_AREA, (0, 0))
+            user_data["storage"]["documents"]["count"] = doc_count
+            user_data["storage"]["documents"]["total_size"] = doc_size + minio_size
+            user_data["storage"]["documents"]["total_size_formatted"] = format_file_size(doc_size + minio_size)
             
-            # Get cache statistics
-            cache_dir = f"{STORAGE_PATH}/cache"
-            if os.path.exists(cache_dir):
-                cache_files = [f for f in os.listdir(cache_dir) if f.startswith(f"{user.id}_")]
-                user_data["storage"]["cache"]["count"] = len(cache_files)
-                
-                cache_size = 0
-                for cache_file in cache_files:
-                    cache_path = os.path.join(cache_dir, cache_file)
-                    if os.path.exists(cache_path):
-                        cache_size += os.path.getsize(cache_path)
-                
-                user_data["storage"]["cache"]["total_size"] = cache_size
-                user_data["storage"]["cache"]["total_size_formatted"] = format_file_size(cache_size)
+            for area in ("cache", "vector_db"):
+                size, count = user_usage.get(area, (0, 0))
+                user_data["storage"][area]["count"] = count
+                user_data["storage"][area]["total_size"] = size
+                user_data["storage"][area]["total_size_formatted"] = format_file_size(size)
             
-            # Get vector DB statistics
-            vector_db_dir = f"{STORAGE_PATH}/vector_db"
-            if os.path.exists(vector_db_dir):
-                user_vector_dirs = [d for d in os.listdir(vector_db_dir) 
-                                  if os.path.isdir(os.path.join(vector_db_dir, d)) and d.startswith(str(user.id))]
-                user_data["storage"]["vector_db"]["count"] = len(user_vector_dirs)
-                
-                vector_size = 0
-                for vector_dir in user_vector_dirs:
-                    vector_path = os.path.join(vector_db_dir, vector_dir)
-                    vector_size += get_directory_size(vector_path)
-                
-                user_data["storage"]["vector_db"]["total_size"] = vector_size
-                user_data["storage"]["vector_db"]["total_size_formatted"] = format_file_size(vector_size)
+            used = sum(size for size, _ in user_usage.values())
+            user_data["storage"]["quota"] = {
+                "quota_bytes": STORAGE_USER_QUOTA_BYTES or None,
+                "used_bytes": used,
+                "remaining_bytes": max(STORAGE_USER_QUOTA_BYTES - used, 0) if STORAGE_USER_QUOTA_BYTES else None
+            }
             
             # Get database statistics
             user_data["storage"]["analysis_results"] = db.query(AnalysisResult).join(Document).filter(Document.owner_id == user.id).count()
@@ -302,6 +406,7 @@ def cleanup_user_storage(db: Session, user_id: int) -> Dict[str, Any]:
                 except Exception as e:
                     result["errors"].append(f"Vector DB cleanup error for {vector_dir}: {str(e)}")
         
+        storage_reconciler.trigger()
         return result
         
     except Exception as e:
@@ -344,6 +449,7 @@ def cleanup_orphaned_files() -> Dict[str, Any]:
                     except Exception as e:
                         result["errors"].append(f"Temp file cleanup error for {file}: {str(e)}")
         
+        storage_reconciler.trigger()
         return result
         
     except Exception as e:
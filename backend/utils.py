@@ -4,8 +4,10 @@ import shutil
 import logging
 from typing import List, Dict, Any, Optional
 from sqlalchemy.orm import Session
-from models import User, Document, AnalysisResult, QASession, Question
+from models import User, Document, AnalysisResult, QASession, Question, StorageUsage
 from config import STORAGE_PATH, DOCUMENTS_BUCKET, minio_client
+from storage_management import record_storage_usage
+from llm_integration import evict_vector_index
 
 logger = logging.getLogger(__name__)
 
@@ -96,6 +98,10 @@ def delete_user(db: Session, user_id: int):
     if not db_user:
         return False
 
+    # Their documents go with them (cascade), and so does their ledger usage
+    db.query(StorageUsage).filter(StorageUsage.owner_id == user_id, StorageUsage.bucket == "documents").delete(
+        synchronize_session=False
+    )
     db.delete(db_user)
     db.commit()
     return True
@@ -164,13 +170,15 @@ def delete_document_and_related_data(db: Session, document_id: int):
             except Exception as e:
                 logger.error(f"Error deleting from MinIO: {e}")
         
-        # Delete vector DB if exists
-        if analysis_result and analysis_result.vector_db_path and os.path.exists(analysis_result.vector_db_path):
-            try:
-                shutil.rmtree(analysis_result.vector_db_path)
-                logger.info(f"Deleted vector DB: {analysis_result.vector_db_path}")
-            except Exception as e:
-                logger.error(f"Error deleting vector DB: {e}")
+        # Delete vector DB if exists, and drop it from memory
+        if analysis_result and analysis_result.vector_db_path:
+            evict_vector_index(analysis_result.vector_db_path)
+            if os.path.exists(analysis_result.vector_db_path):
+                try:
+                    shutil.rmtree(analysis_result.vector_db_path)
+                    logger.info(f"Deleted vector DB: {analysis_result.vector_db_path}")
+                except Exception as e:
+                    logger.error(f"Error deleting vector DB: {e}")
         
         # Delete cache files
         cache_dir = f"{STORAGE_PATH}/cache"
@@ -184,6 +192,7 @@ def delete_document_and_related_data(db: Session, document_id: int):
                 logger.error(f"Error deleting cache files: {e}")
         
         # Delete document from database (will cascade delete analysis results and QA sessions)
+        record_storage_usage(db, document.owner_id, "documents", document.file_path, -(document.file_size or 0), -1)
         db.delete(document)
         db.commit()
         
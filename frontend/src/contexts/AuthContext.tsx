@@ -149,6 +149,12 @@ export const AuthProvider: React.FC<AuthProviderProps> = ({ children }) => {
 
   const logout = () => {
     console.log('Logging out, removing token');
+    if (token) {
+      // Revoke the token server-side; local logout doesn't wait for it
+      axios.post(`${API_URL}/logout`, null, {
+        headers: { Authorization: `Bearer ${token}` }
+      }).catch((error) => console.warn('Token revocation failed:', error));
+    }
     localStorage.removeItem('token');
     setToken(null);
     setUser(null);
@@ -135,10 +135,20 @@ interface PerformanceAnalytics {
     avg_duration: number;
     min_duration: number;
     max_duration: number;
+    p50: number | null;
+    p90: number | null;
+    p99: number | null;
     operation_count: number;
     success_rate: number;
   }>;
-  daily_performance: Array<{ date: string; avg_duration: number; operation_count: number }>;
+  daily_performance: Array<{
+    date: string;
+    avg_duration: number;
+    p50: number | null;
+    p90: number | null;
+    p99: number | null;
+    operation_count: number;
+  }>;
   file_size_correlation: Array<{ file_size_mb: number; duration_seconds: number }>;
   error_rates: Array<{ operation: string; total_operations: number; error_count: number; error_rate: number }>;
 }
@@ -646,6 +656,8 @@ const Analytics: React.FC = () => {
                     <TableRow>
                       <TableCell>Operation</TableCell>
                       <TableCell align="right">Avg Duration</TableCell>
+                      <TableCell align="right">p90</TableCell>
+                      <TableCell align="right">p99</TableCell>
                       <TableCell align="right">Success Rate</TableCell>
                       <TableCell align="right">Count</TableCell>
                     </TableRow>
@@ -657,6 +669,8 @@ const Analytics: React.FC = () => {
                           <Chip label={op.operation} variant="outlined" size="small" />
                         </TableCell>
                         <TableCell align="right">{formatDuration(op.avg_duration)}</TableCell>
+                        <TableCell align="right">{op.p90 != null ? formatDuration(op.p90) : '-'}</TableCell>
+                        <TableCell align="right">{op.p99 != null ? formatDuration(op.p99) : '-'}</TableCell>
                         <TableCell align="right">
                           <Box sx={{ display: 'flex', alignItems: 'center', gap: 1 }}>
                             <LinearProgress
@@ -703,6 +717,7 @@ const Analytics: React.FC = () => {
                   <YAxis yAxisId="right" orientation="right" />
                   <RechartsTooltip />
                   <Line yAxisId="left" type="monotone" dataKey="avg_duration" stroke="#8884d8" strokeWidth={2} name="Avg Duration (ms)" />
+                  <Line yAxisId="left" type="monotone" dataKey="p99" stroke="#ff7300" strokeWidth={2} name="p99 Duration (ms)" />
                   <Line yAxisId="right" type="monotone" dataKey="operation_count" stroke="#82ca9d" strokeWidth={2} name="Operation Count" />
                   <Legend />
                 </LineChart>
@@ -96,7 +96,7 @@ const Dashboard: React.FC = () => {
     setUploading(true);
     try {
       const newDoc = await documentService.uploadDocument(selectedFile);
-      setDocuments([...documents, newDoc]);
+      setDocuments([newDoc, ...documents]);
       setUploadDialogOpen(false);
       setSelectedFile(null);
       toast.success('Document uploaded successfully! 🎉');
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import {
   Container,
@@ -65,14 +65,16 @@ const DocumentView: React.FC = () => {
   const [exportMenuAnchor, setExportMenuAnchor] = useState<null | HTMLElement>(null);
   const [cancelling, setCancelling] = useState(false);
   const [pollingInterval, setPollingInterval] = useState<NodeJS.Timeout | null>(null);
+  const progressStream = useRef<AbortController | null>(null);
 
   useEffect(() => {
     if (documentId) {
       fetchDocument(documentId);
     }
 
-    // Cleanup polling on unmount
+    // Cleanup progress stream and polling on unmount
     return () => {
+      stopProgressStream();
       stopPolling();
     };
   }, [documentId]);
@@ -85,11 +87,12 @@ const DocumentView: React.FC = () => {
       setDocument(doc);
       setError('');
 
-      // Start polling if document is processing
-      if (doc.status === 'PROCESSING' && !pollingInterval) {
-        startPolling(id);
-      } else if (doc.status !== 'PROCESSING' && pollingInterval) {
-        stopPolling();
+      // Follow progress while the document is processing
+      if (doc.status === 'PROCESSING') {
+        startProgressStream(id);
+      } else {
+        stopProgressStream();
+        if (pollingInterval) stopPolling();
       }
     } catch (err: any) {
       console.error('Error fetching document:', err);
@@ -99,6 +102,48 @@ const DocumentView: React.FC = () => {
     }
   };
 
+  // Progress is pushed by the server; polling is only the fallback if the stream fails
+  const startProgressStream = (id: string) => {
+    if (progressStream.current) return; // Already streaming
+
+    const controller = new AbortController();
+    progressStream.current = controller;
+    documentService
+      .streamProgress(
+        id,
+        async (event) => {
+          if (event.status === 'COMPLETED' || event.status === 'ERROR') {
+            // Final state: reload once to pick up results or the error
+            const doc = await documentService.getDocument(id);
+            setDocument(doc);
+          } else if (event.step) {
+            setDocument((prev) => (prev ? { ...prev, processing_step: event.step || prev.processing_step } : prev));
+          }
+        },
+        controller.signal
+      )
+      .then((finished) => {
+        if (finished || controller.signal.aborted) return;
+        console.warn('Progress stream ended before the document finished, falling back to polling');
+        startPolling(id);
+      })
+      .catch((err) => {
+        if (controller.signal.aborted) return;
+        console.error('Progress stream failed, falling back to polling:', err);
+        startPolling(id);
+      })
+      .finally(() => {
+        if (progressStream.current === controller) progressStream.current = null;
+      });
+  };
+
+  const stopProgressStream = () => {
+    if (progressStream.current) {
+      progressStream.current.abort();
+      progressStream.current = null;
+    }
+  };
+
   const startPolling = (id: string) => {
     if (pollingInterval) return; // Already polling
 
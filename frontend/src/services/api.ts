@@ -56,6 +56,14 @@ export interface Document {
   processing_step?: string;
 }
 
+export interface DocumentProgressEvent {
+  document_id: number;
+  status: string;
+  step: string | null;
+  error_message?: string | null;
+  timestamp: number;
+}
+
 export interface AnalysisResults {
   summary?: string;
   key_figures?: string; // JSON string that needs to be parsed
@@ -90,10 +98,16 @@ export const documentService = {
   getDocuments: async (): Promise<Document[]> => {
     console.log('Fetching documents from /documents/');
     try {
-      const response = await api.get('/documents/');
-      console.log('Documents response data:', response.data);
-      // Return the direct array from the backend
-      return response.data;
+      // The list is paginated; X-Next-Cursor points at the next page, if any
+      const documents: Document[] = [];
+      let cursor: string | undefined;
+      do {
+        const response = await api.get('/documents/', { params: cursor ? { cursor } : undefined });
+        documents.push(...response.data);
+        cursor = response.headers['x-next-cursor'];
+      } while (cursor);
+      console.log('Documents response data:', documents);
+      return documents;
     } catch (error) {
       console.error('Error fetching documents:', error);
       throw error;
@@ -133,6 +147,49 @@ export const documentService = {
     }
   },
 
+  // Stream processing progress (server-sent events). Resolves when the stream
+  // ends, with whether a final COMPLETED/ERROR event arrived; false means the
+  // connection closed early (e.g. a proxy timeout) and progress must be followed
+  // some other way.
+  streamProgress: async (
+    documentId: string,
+    onEvent: (event: DocumentProgressEvent) => void,
+    signal?: AbortSignal
+  ): Promise<boolean> => {
+    // EventSource can't send the Authorization header, so read the stream with fetch
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${API_URL}/documents/${documentId}/progress`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+      signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`Progress stream failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finished = false;
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) return finished;
+      buffer += decoder.decode(value, { stream: true });
+      const messages = buffer.split('\n\n');
+      buffer = messages.pop() || '';
+      for (const message of messages) {
+        const data = message
+          .split('\n')
+          .filter((line) => line.startsWith('data:'))
+          .map((line) => line.slice(5).trim())
+          .join('\n');
+        if (!data) continue;
+        const event: DocumentProgressEvent = JSON.parse(data);
+        if (event.status === 'COMPLETED' || event.status === 'ERROR') finished = true;
+        onEvent(event);
+      }
+    }
+  },
+
   // Download document
   downloadDocument: async (documentId: string, filename: string): Promise<void> => {
     console.log(`Downloading document ${documentId}`);
@@ -273,6 +330,8 @@ export const documentService = {
     status: string;
     is_processing: boolean;
     can_cancel: boolean;
+    queue_position: number | null;
+    eta_seconds: number | null;
   }> => {
     console.log(`Getting processing status for document ${documentId}`);
     try {
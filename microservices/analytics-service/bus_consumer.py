@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pika
+
+from ingest import INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, IsolatingWrite
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+ANALYTICS_EXCHANGE = os.getenv("ANALYTICS_EXCHANGE", "analytics")
+ANALYTICS_QUEUE = os.getenv("ANALYTICS_QUEUE", "analytics_ingest")
+# Messages the database rejects are nacked without requeue and routed here
+ANALYTICS_DEAD_LETTER_EXCHANGE = os.getenv("ANALYTICS_DEAD_LETTER_EXCHANGE", "analytics.dead")
+ANALYTICS_DEAD_LETTER_QUEUE = os.getenv("ANALYTICS_DEAD_LETTER_QUEUE", "analytics_dead")
+BUS_PREFETCH = int(os.getenv("ANALYTICS_BUS_PREFETCH", "500"))  # Unacked messages in flight
+BUS_RECONNECT_DELAY = float(os.getenv("ANALYTICS_BUS_RECONNECT_DELAY", "5"))  # Seconds
+
+def parse_message(body: bytes) -> List[Dict[str, Any]]:
+    """Entries of one bus message in write_events' format; malformed entries are skipped."""
+    try:
+        messages = json.loads(body).get("messages", [])
+    except (ValueError, AttributeError):
+        print("Dropping malformed analytics message")
+        return []
+    entries = []
+    for message in messages:
+        if not isinstance(message, dict) or not isinstance(message.get("user_id"), int):
+            continue
+        if message.get("kind") == "metric" and isinstance(message.get("metric"), dict):
+            entries.append({"kind": "metric", "user_id": message["user_id"], "metric": message["metric"]})
+        elif isinstance(message.get("event_type"), str) and isinstance(message.get("event_data"), dict):
+            entries.append({
+                "user_id": message["user_id"],
+                "event_type": message["event_type"],
+                "event_data": message["event_data"],
+            })
+    return entries
+
+class AnalyticsBusConsumer:
+    """
+    Consumes the analytics exchange and bulk-inserts what it receives.
+
+    Messages are collected until `batch_size` entries or `flush_interval`
+    seconds, written with write_events in one transaction, and only then
+    acknowledged (all at once). If the database rejects the batch, it is
+    split until the offending messages are isolated; those are nacked
+    without requeue and dead-lettered, the rest acknowledged. If the
+    connection fails, whatever wasn't written is requeued, so nothing is
+    lost while the database is unavailable.
+    """
+
+    def __init__(self, connect: Callable, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.messages = 0
+        self.written = 0
+        self.batches = 0
+        self.requeued = 0
+        self.dead_lettered = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="analytics-bus", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _write(self, job: IsolatingWrite):
+        if self._conn is None or self._conn.closed:
+            self._conn = self.connect()
+        try:
+            job.run(self._conn)
+        except Exception:
+            try:
+                self._conn.rollback()
+            except Exception:
+                self._conn = None
+            raise
+
+    def _consume(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, heartbeat=60))
+        try:
+            channel = connection.channel()
+            channel.exchange_declare(exchange=ANALYTICS_EXCHANGE, exchange_type="topic", durable=True)
+            channel.exchange_declare(exchange=ANALYTICS_DEAD_LETTER_EXCHANGE, exchange_type="fanout", durable=True)
+            channel.queue_declare(queue=ANALYTICS_DEAD_LETTER_QUEUE, durable=True)
+            channel.queue_bind(queue=ANALYTICS_DEAD_LETTER_QUEUE, exchange=ANALYTICS_DEAD_LETTER_EXCHANGE)
+            channel.queue_declare(queue=ANALYTICS_QUEUE, durable=True,
+                                  arguments={"x-dead-letter-exchange": ANALYTICS_DEAD_LETTER_EXCHANGE})
+            channel.queue_bind(queue=ANALYTICS_QUEUE, exchange=ANALYTICS_EXCHANGE, routing_key="#")
+            channel.basic_qos(prefetch_count=BUS_PREFETCH)
+
+            # (delivery tag, entries) per message, so rejected messages can be settled alone
+            batch: List[Tuple[int, List[Dict[str, Any]]]] = []
+            entries = 0
+            first_at = 0.0
+            for method, properties, body in channel.consume(ANALYTICS_QUEUE, inactivity_timeout=self.flush_interval):
+                if self._stop.is_set():
+                    # Unacked messages go back to the queue when the connection closes
+                    break
+                if method is not None:
+                    if not batch:
+                        first_at = time.monotonic()
+                    message_entries = parse_message(body)
+                    batch.append((method.delivery_tag, message_entries))
+                    entries += len(message_entries)
+                    self.messages += 1
+                if not batch:
+                    continue
+                if method is not None and entries < self.batch_size and time.monotonic() - first_at < self.flush_interval:
+                    continue
+
+                job = IsolatingWrite([message_entries for _, message_entries in batch])
+                try:
+                    self._write(job)
+                except Exception as e:
+                    print(f"Error writing {job.pending_count} analytics messages from the bus, requeueing: {e}")
+                    self._settle(channel, batch, job)
+                    batch, entries = [], 0
+                    time.sleep(BUS_RECONNECT_DELAY)
+                    continue
+                self._settle(channel, batch, job)
+                batch, entries = [], 0
+        finally:
+            if connection.is_open:
+                connection.close()
+
+    def _settle(self, channel, batch: List[Tuple[int, List[Dict[str, Any]]]], job: IsolatingWrite):
+        """Ack the written messages, dead-letter the rejected ones and requeue the rest."""
+        written = set(job.written)
+        self.written += sum(len(batch[index][1]) for index in written)
+        if written:
+            self.batches += 1
+        if len(written) == len(batch):
+            channel.basic_ack(delivery_tag=batch[-1][0], multiple=True)
+            return
+        rejected = set(job.rejected)
+        for index, (tag, _) in enumerate(batch):
+            if index in written:
+                channel.basic_ack(delivery_tag=tag)
+            elif index in rejected:
+                channel.basic_nack(delivery_tag=tag, requeue=False)
+                self.dead_lettered += 1
+            else:
+                channel.basic_nack(delivery_tag=tag, requeue=True)
+                self.requeued += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._consume()
+            except Exception as e:
+                print(f"Analytics bus consumer error: {e}")
+                time.sleep(BUS_RECONNECT_DELAY)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "messages": self.messages,
+            "written": self.written,
+            "batches": self.batches,
+            "requeued": self.requeued,
+            "dead_lettered": self.dead_lettered,
+        }
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from rollups import SERVICE_SOURCE, RollupBatch
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0"))  # Seconds
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "50000"))
+INGEST_MAX_RETRIES = 3
+
+# Failures of the connection rather than of the data; the same write can succeed later
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+class QueueFullError(Exception):
+    pass
+
+def _performance_row(user_id: int, data: Dict[str, Any]):
+    return (
+        user_id,
+        data.get("metric_type", "unknown"),
+        datetime.fromisoformat(data["start_time"]),
+        datetime.fromisoformat(data["end_time"]),
+        data.get("success", False),
+        data.get("error_message"),
+        data.get("document_id"),
+        data.get("question_id"),
+        data.get("file_size_bytes"),
+    )
+
+def write_events(conn, events: List[Dict[str, Any]]) -> None:
+    """
+    Insert a batch of events in one transaction: the raw events, the
+    performance_metrics and token_usage rows derived from them, and the
+    matching rollup increments. Entries with kind "metric" carry a bare
+    performance metric and only produce a performance_metrics row.
+    """
+    now = datetime.utcnow()
+    rollups = RollupBatch()
+    event_rows, metric_rows, usage_rows = [], [], []
+
+    def add_metric(user_id: int, data: Dict[str, Any]):
+        try:
+            row = _performance_row(user_id, data)
+        except Exception as e:
+            print(f"Error processing performance metric event: {e}")
+            return
+        metric_rows.append(row)
+        rollups.add_latency(now, SERVICE_SOURCE, row[1], (row[3] - row[2]).total_seconds() * 1000, row[4])
+
+    for event in events:
+        if event.get("kind") == "metric":
+            # A bare performance metric (from the event bus), stored without an analytics event
+            add_metric(event["user_id"], event["metric"])
+            continue
+
+        user_id, event_type, data = event["user_id"], event["event_type"], event["event_data"]
+        event_rows.append((user_id, event_type, json.dumps(data)))
+        rollups.add_event(now, user_id, event_type)
+
+        if event_type == "performance_metric":
+            add_metric(user_id, data)
+
+        usages = data.get("token_usage")
+        if usages:
+            for usage in [usages] if isinstance(usages, dict) else usages:
+                row = (
+                    user_id,
+                    usage.get("model_name", "gpt-3.5-turbo"),
+                    usage.get("prompt_tokens", 0),
+                    usage.get("completion_tokens", 0),
+                    usage.get("total_tokens", 0),
+                )
+                usage_rows.append(row)
+                rollups.add_token_usage(now, *row[1:])
+
+    with conn.cursor() as cursor:
+        if event_rows:
+            execute_values(cursor, "INSERT INTO analytics_events (user_id, event_type, event_data) VALUES %s",
+                           event_rows, page_size=len(event_rows))
+        if metric_rows:
+            execute_values(cursor, """
+                INSERT INTO performance_metrics
+                (user_id, metric_type, start_time, end_time, success, error_message, document_id, question_id, file_size_bytes)
+                VALUES %s
+            """, metric_rows, page_size=len(metric_rows))
+        if usage_rows:
+            execute_values(cursor, """
+                INSERT INTO token_usage (user_id, model_name, prompt_tokens, completion_tokens, total_tokens)
+                VALUES %s
+            """, usage_rows, page_size=len(usage_rows))
+        rollups.write(cursor)
+    conn.commit()
+
+class IsolatingWrite:
+    """
+    Writes groups of events (each group all or nothing) with write_events,
+    all in one transaction when possible. When the data is rejected, the
+    groups are split in halves until the ones that can't be written are
+    isolated; only those are lost. Connection errors propagate and leave
+    the unwritten groups pending, so run() can be called again without
+    writing anything twice.
+    """
+
+    def __init__(self, groups: List[List[Dict[str, Any]]]):
+        self.groups = groups
+        self.pending: List[Tuple[int, int]] = [(0, len(groups))] if groups else []
+        self.written: List[int] = []
+        self.rejected: List[int] = []
+
+    @property
+    def pending_count(self) -> int:
+        return sum(end - start for start, end in self.pending)
+
+    def run(self, conn):
+        while self.pending:
+            start, end = self.pending[-1]
+            events = [event for group in self.groups[start:end] for event in group]
+            try:
+                write_events(conn, events)
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                conn.rollback()
+                self.pending.pop()
+                if end - start == 1:
+                    print(f"Rejected {len(events)} analytics events: {e}")
+                    self.rejected.append(start)
+                else:
+                    middle = (start + end) // 2
+                    self.pending += [(middle, end), (start, middle)]
+                continue
+            self.pending.pop()
+            self.written.extend(range(start, end))
+
+class EventIngestQueue:
+    """
+    Stages incoming events in a bounded in-process queue and writes them from
+    one background thread in batches of up to `batch_size`, flushing at least
+    every `flush_interval` seconds. A full queue rejects new events so callers
+    can back off instead of the service running out of memory.
+    """
+
+    def __init__(self, connect: Callable, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL, max_queue: int = INGEST_QUEUE_SIZE):
+        self.connect = connect
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._conn = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.received = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_batch_seconds = 0.0
+        # (finished_at, events, seconds) of recent batches, for throughput
+        self._recent = deque(maxlen=200)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="event-ingest", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, events: List[Dict[str, Any]]) -> int:
+        """Queue events for writing; all or none are accepted."""
+        with self._lock:
+            if self._queue.maxsize and self._queue.qsize() + len(events) > self._queue.maxsize:
+                raise QueueFullError(f"Ingest queue full ({self._queue.qsize()} events pending)")
+            for event in events:
+                self._queue.put_nowait(event)
+            self.received += len(events)
+        return len(events)
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        job = IsolatingWrite([[event] for event in batch])
+        started = time.perf_counter()
+        for attempt in range(1, INGEST_MAX_RETRIES + 1):
+            try:
+                if self._conn is None or self._conn.closed:
+                    self._conn = self.connect()
+                job.run(self._conn)
+                break
+            except Exception as e:
+                print(f"Error writing batch of {job.pending_count} events (attempt {attempt}): {e}")
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    self._conn = None
+                time.sleep(0.5 * attempt)
+        elapsed = time.perf_counter() - started
+        # Rejected events, and whatever was still pending after the last attempt
+        self.failed += len(job.rejected) + job.pending_count
+        if job.written:
+            self.written += len(job.written)
+            self.batches += 1
+            self.last_batch_seconds = elapsed
+            self._recent.append((time.time(), len(job.written), elapsed))
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        recent = [(n, secs) for finished, n, secs in list(self._recent) if now - finished <= 60]
+        written_last_minute = sum(n for n, _ in recent)
+        write_seconds = sum(secs for _, secs in recent)
+        return {
+            "received": self.received,
+            "written": self.written,
+            "failed": self.failed,
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "avg_batch_size": round(self.written / self.batches, 1) if self.batches else 0,
+            "last_batch_seconds": round(self.last_batch_seconds, 4),
+            "events_per_second_last_minute": round(written_last_minute / 60, 2),
+            "events_per_write_second": round(written_last_minute / write_seconds, 1) if write_seconds else 0,
+        }
@@ -0,0 +1,217 @@
+import os
+import time
+from datetime import date, timedelta
+from typing import Callable, List, Optional
+
+PARTITION_INTERVAL = os.getenv("ANALYTICS_PARTITION_INTERVAL", "day")  # "day" or "month"
+PARTITION_PREMAKE_DAYS = int(os.getenv("ANALYTICS_PARTITION_PREMAKE_DAYS", "3"))  # Partitions created ahead of time
+RAW_RETENTION_DAYS = int(os.getenv("ANALYTICS_RAW_RETENTION_DAYS", "90"))
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv("ANALYTICS_HOURLY_ROLLUP_RETENTION_DAYS", "90"))
+MAINTENANCE_INTERVAL = float(os.getenv("ANALYTICS_MAINTENANCE_INTERVAL", "3600"))  # Seconds
+
+# Raw tables, range partitioned by created_at. The partition key has to be
+# part of the primary key, hence (id, created_at).
+PARTITIONED_TABLES = {
+    "analytics_events": """
+        id BIGSERIAL,
+        user_id INTEGER NOT NULL,
+        event_type TEXT NOT NULL,
+        event_data TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    """,
+    "performance_metrics": """
+        id BIGSERIAL,
+        user_id INTEGER NOT NULL,
+        metric_type TEXT NOT NULL,
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP NOT NULL,
+        success BOOLEAN NOT NULL,
+        error_message TEXT,
+        document_id INTEGER,
+        question_id INTEGER,
+        file_size_bytes INTEGER,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    """,
+    # Per-route request metrics aggregated by the gateway, one row per route per window
+    "route_metrics": """
+        id BIGSERIAL,
+        source TEXT NOT NULL,
+        metric_type TEXT NOT NULL,
+        window_start TIMESTAMP NOT NULL,
+        window_end TIMESTAMP NOT NULL,
+        request_count INTEGER NOT NULL,
+        success_count INTEGER NOT NULL,
+        total_ms DOUBLE PRECISION NOT NULL,
+        min_ms DOUBLE PRECISION,
+        max_ms DOUBLE PRECISION,
+        bucket_bounds_ms TEXT NOT NULL,
+        buckets TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        sketch TEXT,
+        PRIMARY KEY (id, created_at)
+    """,
+    "token_usage": """
+        id BIGSERIAL,
+        user_id INTEGER NOT NULL,
+        model_name TEXT NOT NULL,
+        prompt_tokens INTEGER DEFAULT 0,
+        completion_tokens INTEGER DEFAULT 0,
+        total_tokens INTEGER DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, created_at)
+    """,
+}
+
+UNPARTITIONED_SUFFIX = "_unpartitioned"
+
+def period_start(day: date) -> date:
+    return day.replace(day=1) if PARTITION_INTERVAL == "month" else day
+
+def next_period(start: date) -> date:
+    if PARTITION_INTERVAL == "month":
+        return (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+def partition_name(table: str, start: date) -> str:
+    return f"{table}_p{start.strftime('%Y%m' if PARTITION_INTERVAL == 'month' else '%Y%m%d')}"
+
+def partition_start(table: str, name: str) -> Optional[date]:
+    """Inverse of partition_name; None for tables not named by it."""
+    suffix = name[len(table) + 2:] if name.startswith(f"{table}_p") else ""
+    try:
+        if len(suffix) == 6:
+            return date(int(suffix[:4]), int(suffix[4:]), 1)
+        if len(suffix) == 8:
+            return date(int(suffix[:4]), int(suffix[4:6]), int(suffix[6:]))
+    except ValueError:
+        pass
+    return None
+
+def db_today(cursor) -> date:
+    """Today in the database's clock, which is what created_at defaults to."""
+    cursor.execute("SELECT CURRENT_TIMESTAMP::date AS today")
+    return cursor.fetchone()["today"]
+
+def ensure_partitions(cursor, table: str, first_day: date, last_day: date) -> List[str]:
+    """Create the partitions of `table` covering first_day..last_day (inclusive)."""
+    created = []
+    start = period_start(first_day)
+    while start <= last_day:
+        end = next_period(start)
+        name = partition_name(table, start)
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (name,))
+        if not cursor.fetchone()["exists"]:
+            cursor.execute(f"""
+                CREATE TABLE {name} PARTITION OF {table}
+                FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')
+            """)
+            created.append(name)
+        start = end
+    return created
+
+def _set_aside_unpartitioned(cursor, table: str):
+    """Rename a pre-partitioning table (and its indexes) out of the way."""
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    if not row or row["relkind"] != "r":
+        return
+    cursor.execute("""
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s
+    """, (table,))
+    for index in [r["indexname"] for r in cursor.fetchall()]:
+        cursor.execute(f"ALTER INDEX {index} RENAME TO {index}{UNPARTITIONED_SUFFIX}")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}{UNPARTITIONED_SUFFIX}")
+
+def _copy_unpartitioned(cursor, table: str):
+    """Move the rows of a set-aside table into the partitioned one and drop it."""
+    legacy = f"{table}{UNPARTITIONED_SUFFIX}"
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL AS exists", (legacy,))
+    if not cursor.fetchone()["exists"]:
+        return
+    cursor.execute(f"UPDATE {legacy} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+    cursor.execute(f"SELECT MIN(created_at)::date AS first_day, MAX(created_at)::date AS last_day FROM {legacy}")
+    bounds = cursor.fetchone()
+    if bounds["first_day"] is not None:
+        ensure_partitions(cursor, table, bounds["first_day"], bounds["last_day"])
+        cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT MAX(id) FROM {table}))", (table,))
+    cursor.execute(f"DROP TABLE {legacy}")
+    print(f"Migrated {table} to a partitioned table")
+
+def create_partitioned_tables(cursor):
+    """
+    Create the partitioned raw tables with partitions up to
+    PARTITION_PREMAKE_DAYS ahead. Tables from before partitioning are
+    migrated in place (in the caller's transaction).
+    """
+    today = db_today(cursor)
+    for table, columns in PARTITIONED_TABLES.items():
+        _set_aside_unpartitioned(cursor, table)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}) PARTITION BY RANGE (created_at)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table} (created_at)")
+        ensure_partitions(cursor, table, today, today + timedelta(days=PARTITION_PREMAKE_DAYS))
+        _copy_unpartitioned(cursor, table)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_route_metrics_window_end ON route_metrics (window_end)")
+    cursor.execute("ALTER TABLE route_metrics ADD COLUMN IF NOT EXISTS sketch TEXT")
+
+def list_partitions(cursor, table: str) -> List[str]:
+    cursor.execute("""
+        SELECT c.relname AS name
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    """, (table,))
+    return [row["name"] for row in cursor.fetchall()]
+
+def drop_expired_partitions(cursor, table: str, cutoff: date) -> List[str]:
+    """Drop partitions of `table` holding only rows from before `cutoff`."""
+    dropped = []
+    for name in list_partitions(cursor, table):
+        start = partition_start(table, name)
+        if start is not None and next_period(start) <= cutoff:
+            cursor.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+    return dropped
+
+def run_maintenance(conn):
+    """
+    Create upcoming partitions, drop raw partitions past RAW_RETENTION_DAYS
+    and hourly rollups past HOURLY_ROLLUP_RETENTION_DAYS. Raw rows are only
+    dropped once they are known to be in the rollups: rows ingested live are
+    rolled up on write, older ones once the rollup backfill has finished.
+    """
+    cursor = conn.cursor()
+    today = db_today(cursor)
+    for table in PARTITIONED_TABLES:
+        ensure_partitions(cursor, table, today, today + timedelta(days=PARTITION_PREMAKE_DAYS))
+
+    cursor.execute("SELECT 1 FROM rollup_state WHERE name = 'backfilled'")
+    if cursor.fetchone():
+        cutoff = today - timedelta(days=RAW_RETENTION_DAYS)
+        for table in PARTITIONED_TABLES:
+            dropped = drop_expired_partitions(cursor, table, cutoff)
+            if dropped:
+                print(f"Dropped expired partitions: {', '.join(dropped)}")
+    else:
+        print("Rollup backfill not finished yet, keeping raw partitions")
+
+    hourly_cutoff = today - timedelta(days=HOURLY_ROLLUP_RETENTION_DAYS)
+    for table in ("event_rollups", "token_rollups", "performance_rollups", "user_rollups"):
+        cursor.execute(f"DELETE FROM {table} WHERE granularity = 'hour' AND bucket_start < %s", (hourly_cutoff,))
+    conn.commit()
+
+def maintenance_loop(connect: Callable):
+    while True:
+        conn = None
+        try:
+            conn = connect()
+            run_maintenance(conn)
+        except Exception as e:
+            print(f"Error in analytics partition maintenance: {e}")
+        finally:
+            if conn is not None:
+                conn.close()
+        time.sleep(MAINTENANCE_INTERVAL)
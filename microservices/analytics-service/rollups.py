@@ -0,0 +1,453 @@
+import json
+import math
+import hashlib
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import execute_values
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is
+# open-ended. Same bounds as the gateway's metrics buffer.
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# Latency quantile sketch: log-spaced buckets as in DDSketch. Bucket i > 0
+# holds durations in (MIN * GAMMA^(i-1), MIN * GAMMA^i], so a quantile read
+# from a sketch is within LATENCY_SKETCH_ACCURACY of the true value, and
+# sketches merge by adding counts. The gateway's metrics buffer uses the same
+# parameters.
+LATENCY_SKETCH_ACCURACY = 0.02
+LATENCY_SKETCH_GAMMA = (1 + LATENCY_SKETCH_ACCURACY) / (1 - LATENCY_SKETCH_ACCURACY)
+LATENCY_SKETCH_MIN_MS = 0.1
+LATENCY_SKETCH_MAX_MS = 3600000.0
+LATENCY_SKETCH_SIZE = int(math.ceil(math.log(LATENCY_SKETCH_MAX_MS / LATENCY_SKETCH_MIN_MS, LATENCY_SKETCH_GAMMA))) + 1
+QUANTILES = (0.5, 0.9, 0.99)
+
+# HyperLogLog with 2^10 registers: ~3% standard error on distinct users
+SKETCH_PRECISION = 10
+SKETCH_REGISTERS = 1 << SKETCH_PRECISION
+
+# Source recorded for performance metrics reported by services (vs. gateway route windows)
+SERVICE_SOURCE = "services"
+
+ROLLUP_LOCK_ID = 7301  # pg advisory lock held while backfilling
+BACKFILL_CHUNK = 10000
+
+def create_rollup_tables(cursor):
+    """Create the rollup tables; the first run records when live rollups started."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS event_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            event_type TEXT NOT NULL,
+            event_count BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, event_type)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS token_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            model_name TEXT NOT NULL,
+            usage_count BIGINT NOT NULL DEFAULT 0,
+            prompt_tokens BIGINT NOT NULL DEFAULT 0,
+            completion_tokens BIGINT NOT NULL DEFAULT 0,
+            total_tokens BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket_start, model_name)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS performance_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            source TEXT NOT NULL,
+            metric_type TEXT NOT NULL,
+            call_count BIGINT NOT NULL DEFAULT 0,
+            success_count BIGINT NOT NULL DEFAULT 0,
+            total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+            min_ms DOUBLE PRECISION,
+            max_ms DOUBLE PRECISION,
+            buckets BIGINT[] NOT NULL,
+            sketch BIGINT[],
+            PRIMARY KEY (granularity, bucket_start, source, metric_type)
+        )
+    """)
+    cursor.execute("ALTER TABLE performance_rollups ADD COLUMN IF NOT EXISTS sketch BIGINT[]")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_rollups (
+            granularity TEXT NOT NULL,
+            bucket_start TIMESTAMP NOT NULL,
+            registers SMALLINT[] NOT NULL,
+            PRIMARY KEY (granularity, bucket_start)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name TEXT PRIMARY KEY,
+            value TIMESTAMP NOT NULL
+        )
+    """)
+    # Rows created from now on are rolled up as they are ingested; older rows by backfill_rollups
+    cursor.execute("""
+        INSERT INTO rollup_state (name, value) VALUES ('live_since', CURRENT_TIMESTAMP)
+        ON CONFLICT (name) DO NOTHING
+    """)
+
+def bucket_starts(at: datetime) -> List[Tuple[str, datetime]]:
+    hour = at.replace(minute=0, second=0, microsecond=0)
+    return [("hour", hour), ("day", hour.replace(hour=0))]
+
+def range_filter(start: datetime, end: Optional[datetime] = None) -> Tuple[str, tuple]:
+    """
+    WHERE clause selecting the rollup rows between `start` and `end` (now if
+    None) without double counting: daily rows for the whole days in the
+    range, hourly rows for the partial days at either end.
+    """
+    first_hour = start.replace(minute=0, second=0, microsecond=0)
+    first_day = first_hour if first_hour.hour == 0 else (first_hour + timedelta(days=1)).replace(hour=0)
+    if end is None:
+        return (
+            "((granularity = 'hour' AND bucket_start >= %s AND bucket_start < %s) OR (granularity = 'day' AND bucket_start >= %s))",
+            (first_hour, first_day, first_day),
+        )
+    end_hour = end.replace(minute=0, second=0, microsecond=0)
+    if end_hour < end:
+        end_hour += timedelta(hours=1)
+    last_day = max(first_day, end_hour.replace(hour=0))
+    if first_day >= end_hour:
+        return (
+            "(granularity = 'hour' AND bucket_start >= %s AND bucket_start < %s)",
+            (first_hour, end_hour),
+        )
+    return (
+        "((granularity = 'hour' AND ((bucket_start >= %s AND bucket_start < %s) OR (bucket_start >= %s AND bucket_start < %s)))"
+        " OR (granularity = 'day' AND bucket_start >= %s AND bucket_start < %s))",
+        (first_hour, first_day, last_day, end_hour, first_day, last_day),
+    )
+
+def rebin(buckets: Sequence[int], bounds: Sequence[float]) -> List[int]:
+    """Map a histogram with other bucket bounds onto LATENCY_BUCKETS_MS (by upper bound)."""
+    if list(bounds) == LATENCY_BUCKETS_MS:
+        return list(buckets)
+    result = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for i, count in enumerate(buckets):
+        upper = bounds[i] if i < len(bounds) else math.inf
+        result[bisect_left(LATENCY_BUCKETS_MS, upper)] += count
+    return result
+
+def sketch_index(duration_ms: float) -> int:
+    if duration_ms <= LATENCY_SKETCH_MIN_MS:
+        return 0
+    return min(LATENCY_SKETCH_SIZE - 1, int(math.ceil(math.log(duration_ms / LATENCY_SKETCH_MIN_MS, LATENCY_SKETCH_GAMMA))))
+
+def sketch_value(index: int) -> float:
+    """Representative duration of a sketch bucket."""
+    if index == 0:
+        return LATENCY_SKETCH_MIN_MS
+    return 2 * LATENCY_SKETCH_MIN_MS * LATENCY_SKETCH_GAMMA ** index / (LATENCY_SKETCH_GAMMA + 1)
+
+def sketch_quantiles(counts: Dict[int, int], quantiles: Sequence[float] = QUANTILES) -> Dict[str, Optional[float]]:
+    """Quantiles (as {"p50": ms, ...}) of a sparse sketch {bucket index: count}."""
+    total = sum(counts.values())
+    ordered = sorted(counts.items())
+    result = {}
+    for q in quantiles:
+        label = f"p{q * 100:g}"
+        result[label] = None
+        rank = q * (total - 1)
+        seen = 0
+        for index, count in ordered:
+            seen += count
+            if seen > rank:
+                result[label] = round(sketch_value(index), 3)
+                break
+    return result
+
+def route_sketch(sketch: Any, buckets: Sequence[int], bounds: Sequence[float],
+                 min_ms: Optional[float], max_ms: Optional[float]) -> Dict[int, int]:
+    """Sketch of a gateway route window: the one it was sent with ({"index": count}), else approximated."""
+    if isinstance(sketch, str):
+        sketch = json.loads(sketch)
+    if not sketch:
+        return coarse_sketch(buckets, bounds, min_ms, max_ms)
+    counts: Dict[int, int] = defaultdict(int)
+    for index, count in sketch.items():
+        counts[min(int(index), LATENCY_SKETCH_SIZE - 1)] += count
+    return dict(counts)
+
+def coarse_sketch(buckets: Sequence[int], bounds: Sequence[float], min_ms: Optional[float], max_ms: Optional[float]) -> Dict[int, int]:
+    """
+    Approximate sketch for a fixed-bucket histogram that has none: each
+    bucket's count is placed at its geometric midpoint, clamped to the
+    observed min/max.
+    """
+    counts: Dict[int, int] = defaultdict(int)
+    lower = LATENCY_SKETCH_MIN_MS
+    for i, count in enumerate(buckets):
+        upper = bounds[i] if i < len(bounds) else max(max_ms or 0, lower)
+        if count:
+            value = math.sqrt(max(lower, LATENCY_SKETCH_MIN_MS) * max(upper, LATENCY_SKETCH_MIN_MS))
+            if min_ms is not None:
+                value = max(value, min_ms)
+            if max_ms is not None:
+                value = min(value, max_ms)
+            counts[sketch_index(value)] += count
+        lower = upper
+    return dict(counts)
+
+def dense_sketch(counts: Dict[int, int]) -> List[int]:
+    dense = [0] * LATENCY_SKETCH_SIZE
+    for index, count in counts.items():
+        dense[index] += count
+    return dense
+
+class UserSketch:
+    """HyperLogLog sketch of distinct user ids; sketches merge by register-wise max."""
+
+    __slots__ = ("registers",)
+
+    def __init__(self, registers: Optional[Sequence[int]] = None):
+        self.registers = bytearray(registers) if registers is not None else bytearray(SKETCH_REGISTERS)
+
+    def add(self, user_id: Any):
+        h = int.from_bytes(hashlib.sha1(str(user_id).encode("utf-8")).digest()[:8], "big")
+        index = h >> (64 - SKETCH_PRECISION)
+        rest = h & ((1 << (64 - SKETCH_PRECISION)) - 1)
+        rank = (64 - SKETCH_PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, registers: Sequence[int]):
+        for i, rank in enumerate(registers):
+            if rank > self.registers[i]:
+                self.registers[i] = rank
+
+    def estimate(self) -> int:
+        m = SKETCH_REGISTERS
+        raw = (0.7213 / (1 + 1.079 / m)) * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+class RollupBatch:
+    """
+    Rollup deltas accumulated in memory and upserted in one go, so each
+    (granularity, bucket, key) row is touched once per batch.
+    """
+
+    def __init__(self):
+        self.events: Dict[tuple, int] = defaultdict(int)
+        self.tokens: Dict[tuple, List[int]] = {}
+        self.latency: Dict[tuple, List[Any]] = {}
+        self.users: Dict[tuple, UserSketch] = {}
+
+    def add_event(self, at: datetime, user_id: Any, event_type: str):
+        for granularity, bucket in bucket_starts(at):
+            self.events[(granularity, bucket, event_type)] += 1
+            sketch = self.users.get((granularity, bucket))
+            if sketch is None:
+                sketch = self.users[(granularity, bucket)] = UserSketch()
+            sketch.add(user_id)
+
+    def add_token_usage(self, at: datetime, model_name: str, prompt_tokens: int, completion_tokens: int, total_tokens: int):
+        for granularity, bucket in bucket_starts(at):
+            sums = self.tokens.setdefault((granularity, bucket, model_name), [0, 0, 0, 0])
+            sums[0] += 1
+            sums[1] += prompt_tokens or 0
+            sums[2] += completion_tokens or 0
+            sums[3] += total_tokens or 0
+
+    def add_latency(self, at: datetime, source: str, metric_type: str, duration_ms: float, success: bool):
+        buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        buckets[bisect_left(LATENCY_BUCKETS_MS, duration_ms)] = 1
+        self.add_latency_window(at, source, metric_type, 1, int(bool(success)), duration_ms, duration_ms, duration_ms,
+                                buckets, {sketch_index(duration_ms): 1})
+
+    def add_latency_window(self, at: datetime, source: str, metric_type: str, count: int, success_count: int,
+                           total_ms: float, min_ms: Optional[float], max_ms: Optional[float], buckets: Sequence[int],
+                           sketch: Dict[int, int]):
+        for granularity, bucket in bucket_starts(at):
+            key = (granularity, bucket, source, metric_type)
+            stats = self.latency.get(key)
+            if stats is None:
+                self.latency[key] = [count, success_count, total_ms, min_ms, max_ms, list(buckets), dict(sketch)]
+                continue
+            stats[0] += count
+            stats[1] += success_count
+            stats[2] += total_ms
+            if min_ms is not None:
+                stats[3] = min_ms if stats[3] is None else min(stats[3], min_ms)
+            if max_ms is not None:
+                stats[4] = max_ms if stats[4] is None else max(stats[4], max_ms)
+            stats[5] = [a + b for a, b in zip(stats[5], buckets)]
+            for index, n in sketch.items():
+                stats[6][index] = stats[6].get(index, 0) + n
+
+    def write(self, cursor):
+        """Upsert the deltas. Rows are sorted by key so concurrent writers lock them in the same order."""
+        if self.events:
+            execute_values(cursor, """
+                INSERT INTO event_rollups (granularity, bucket_start, event_type, event_count) VALUES %s
+                ON CONFLICT (granularity, bucket_start, event_type)
+                DO UPDATE SET event_count = event_rollups.event_count + EXCLUDED.event_count
+            """, [key + (count,) for key, count in sorted(self.events.items())])
+        if self.tokens:
+            execute_values(cursor, """
+                INSERT INTO token_rollups
+                (granularity, bucket_start, model_name, usage_count, prompt_tokens, completion_tokens, total_tokens)
+                VALUES %s
+                ON CONFLICT (granularity, bucket_start, model_name) DO UPDATE SET
+                    usage_count = token_rollups.usage_count + EXCLUDED.usage_count,
+                    prompt_tokens = token_rollups.prompt_tokens + EXCLUDED.prompt_tokens,
+                    completion_tokens = token_rollups.completion_tokens + EXCLUDED.completion_tokens,
+                    total_tokens = token_rollups.total_tokens + EXCLUDED.total_tokens
+            """, [key + tuple(sums) for key, sums in sorted(self.tokens.items())])
+        if self.latency:
+            execute_values(cursor, """
+                INSERT INTO performance_rollups
+                (granularity, bucket_start, source, metric_type, call_count, success_count, total_ms, min_ms, max_ms,
+                 buckets, sketch)
+                VALUES %s
+                ON CONFLICT (granularity, bucket_start, source, metric_type) DO UPDATE SET
+                    call_count = performance_rollups.call_count + EXCLUDED.call_count,
+                    success_count = performance_rollups.success_count + EXCLUDED.success_count,
+                    total_ms = performance_rollups.total_ms + EXCLUDED.total_ms,
+                    min_ms = LEAST(performance_rollups.min_ms, EXCLUDED.min_ms),
+                    max_ms = GREATEST(performance_rollups.max_ms, EXCLUDED.max_ms),
+                    buckets = ARRAY(
+                        SELECT a + b
+                        FROM unnest(performance_rollups.buckets, EXCLUDED.buckets) WITH ORDINALITY AS h(a, b, i)
+                        ORDER BY i
+                    ),
+                    sketch = ARRAY(
+                        SELECT COALESCE(a, 0) + COALESCE(b, 0)
+                        FROM unnest(performance_rollups.sketch, EXCLUDED.sketch) WITH ORDINALITY AS q(a, b, i)
+                        ORDER BY i
+                    )
+            """, [key + tuple(stats[:6]) + (dense_sketch(stats[6]),) for key, stats in sorted(self.latency.items())],
+                template="(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::bigint[], %s::bigint[])")
+        if self.users:
+            execute_values(cursor, """
+                INSERT INTO user_rollups (granularity, bucket_start, registers) VALUES %s
+                ON CONFLICT (granularity, bucket_start) DO UPDATE SET
+                    registers = ARRAY(
+                        SELECT GREATEST(a, b)
+                        FROM unnest(user_rollups.registers, EXCLUDED.registers) WITH ORDINALITY AS r(a, b, i)
+                        ORDER BY i
+                    )
+            """, [key + (list(sketch.registers),) for key, sketch in sorted(self.users.items())],
+                template="(%s, %s, %s::smallint[])")
+
+def distinct_users(cursor, start: Optional[datetime] = None) -> int:
+    """Estimated distinct users since `start` (all time if None), merged from the user sketches."""
+    if start is None:
+        cursor.execute("SELECT registers FROM user_rollups WHERE granularity = 'day'")
+    else:
+        condition, params = range_filter(start)
+        cursor.execute(f"SELECT registers FROM user_rollups WHERE {condition}", params)
+    sketch = UserSketch()
+    for row in cursor.fetchall():
+        sketch.merge(row["registers"] if isinstance(row, dict) else row[0])
+    return sketch.estimate()
+
+def latency_sketches(cursor, group: str, condition: str, params: tuple) -> Dict[Any, Dict[int, int]]:
+    """
+    Merge the latency sketches of the matching performance_rollups rows per
+    `group` expression. Summing happens in the database, so only the non-zero
+    buckets come back.
+    """
+    cursor.execute(f"""
+        SELECT {group} AS grp, s.i - 1 AS idx, SUM(s.c) AS count
+        FROM performance_rollups, unnest(sketch) WITH ORDINALITY AS s(c, i)
+        WHERE ({condition}) AND s.c > 0
+        GROUP BY 1, 2
+    """, params)
+    merged: Dict[Any, Dict[int, int]] = defaultdict(dict)
+    for row in cursor.fetchall():
+        merged[row["grp"]][int(row["idx"])] = int(row["count"])
+    return merged
+
+def fill_missing_sketches(cursor):
+    """Derive approximate sketches for rollup rows written before sketches existed."""
+    cursor.execute("""
+        SELECT granularity, bucket_start, source, metric_type, min_ms, max_ms, buckets
+        FROM performance_rollups WHERE sketch IS NULL
+    """)
+    rows = cursor.fetchall()
+    for row in rows:
+        cursor.execute("""
+            UPDATE performance_rollups SET sketch = %s::bigint[]
+            WHERE granularity = %s AND bucket_start = %s AND source = %s AND metric_type = %s
+        """, (
+            dense_sketch(coarse_sketch(row["buckets"], LATENCY_BUCKETS_MS, row["min_ms"], row["max_ms"])),
+            row["granularity"], row["bucket_start"], row["source"], row["metric_type"],
+        ))
+    if rows:
+        print(f"Added approximate latency sketches to {len(rows)} rollup rows")
+
+def _json_list(value: Any) -> List[Any]:
+    return json.loads(value) if isinstance(value, str) else list(value)
+
+def _stream(conn, name: str, query: str, params: tuple):
+    with conn.cursor(name=name) as cursor:
+        cursor.itersize = BACKFILL_CHUNK
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row
+
+def backfill_rollups(connect):
+    """
+    Roll up raw rows created before live rollups started. Runs once: the
+    result and the 'backfilled' marker are committed in one transaction, and
+    an advisory lock keeps concurrent replicas from doing it twice.
+    """
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (ROLLUP_LOCK_ID,))
+            if not cursor.fetchone()[0]:
+                return
+            cursor.execute("SELECT name, value FROM rollup_state")
+            state = dict(cursor.fetchall())
+        if "backfilled" in state or "live_since" not in state:
+            return
+        live_since = state["live_since"]
+
+        batch = RollupBatch()
+        for created_at, user_id, event_type in _stream(conn, "backfill_events", """
+            SELECT created_at, user_id, event_type FROM analytics_events WHERE created_at < %s
+        """, (live_since,)):
+            batch.add_event(created_at, user_id, event_type)
+        for created_at, model_name, prompt, completion, total in _stream(conn, "backfill_tokens", """
+            SELECT created_at, model_name, prompt_tokens, completion_tokens, total_tokens
+            FROM token_usage WHERE created_at < %s
+        """, (live_since,)):
+            batch.add_token_usage(created_at, model_name, prompt, completion, total)
+        for created_at, metric_type, duration_ms, success in _stream(conn, "backfill_performance", """
+            SELECT created_at, metric_type, EXTRACT(EPOCH FROM (end_time - start_time)) * 1000, success
+            FROM performance_metrics WHERE created_at < %s
+        """, (live_since,)):
+            batch.add_latency(created_at, SERVICE_SOURCE, metric_type, float(duration_ms), success)
+        for row in _stream(conn, "backfill_routes", """
+            SELECT created_at, source, metric_type, request_count, success_count, total_ms, min_ms, max_ms,
+                   bucket_bounds_ms, buckets, sketch
+            FROM route_metrics WHERE created_at < %s
+        """, (live_since,)):
+            created_at, source, metric_type, count, success_count, total_ms, min_ms, max_ms, bounds, buckets, sketch = row
+            bounds, buckets = _json_list(bounds), _json_list(buckets)
+            batch.add_latency_window(created_at, source, metric_type, count, success_count, total_ms, min_ms, max_ms,
+                                     rebin(buckets, bounds), route_sketch(sketch, buckets, bounds, min_ms, max_ms))
+
+        with conn.cursor() as cursor:
+            batch.write(cursor)
+            cursor.execute("INSERT INTO rollup_state (name, value) VALUES ('backfilled', CURRENT_TIMESTAMP)")
+        conn.commit()
+        print(f"Backfilled analytics rollups for rows before {live_since}")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error backfilling analytics rollups: {e}")
+    finally:
+        conn.close()
@@ -7,11 +7,14 @@ import os
 import jwt
 from datetime import datetime, timedelta
 import hashlib
+import time
+import uuid
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from passlib.context import CryptContext
 
 import redis
+from analytics_emitter import AnalyticsEmitter
 import json
 
 # Configure password hashing context
@@ -89,7 +92,6 @@ trace.get_tracer_provider().add_span_processor(span_processor)
 
 # Internal API Key configuration
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
-ANALYTICS_SERVICE_URL = os.getenv("ANALYTICS_SERVICE_URL", "http://analytics-service:8000")
 
 async def verify_internal_api_key(x_internal_api_key: str = Header(None)):
     if not INTERNAL_API_KEY:
@@ -98,27 +100,12 @@ async def verify_internal_api_key(x_internal_api_key: str = Header(None)):
     if x_internal_api_key != INTERNAL_API_KEY:
         raise HTTPException(status_code=403, detail="Invalid Internal API Key")
 
+# Analytics are published to RabbitMQ from a background thread and never block the caller
+analytics_emitter = AnalyticsEmitter(source="auth-service")
+
 def track_analytics_event(user_id: int, event_type: str, event_data: dict):
     """Helper to track analytics events asynchronously"""
-    try:
-        import requests
-        headers = {}
-        if INTERNAL_API_KEY:
-            headers["X-Internal-API-Key"] = INTERNAL_API_KEY
-            
-        requests.post(
-            f"{ANALYTICS_SERVICE_URL}/events",
-            json={
-                "user_id": user_id,
-                "event_type": event_type,
-                "event_data": event_data
-            },
-            headers=headers,
-            timeout=5
-        )
-    except Exception as e:
-        # Don't fail the request if analytics fails
-        print(f"Failed to track analytics event: {e}")
+    analytics_emitter.emit(user_id, event_type, event_data)
 
 # Initialize FastAPI app with global dependency
 app = FastAPI(
@@ -250,27 +237,84 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     
-    to_encode.update({"exp": expire})
+    # iat and jti let a single token, or all of a user's tokens, be revoked;
+    # iat_ms is compared against revocation times, which are finer than seconds
+    now = time.time()
+    to_encode.update({"exp": expire, "iat": int(now), "iat_ms": int(now * 1000), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
-    """Get current user from JWT token"""
-    token = credentials.credentials
+def revoke_token(payload: dict):
+    """Revoke a single token until it would have expired anyway"""
+    if not redis_client or not payload.get("jti"):
+        return
+    ttl = int(payload.get("exp", time.time()) - time.time())
+    if ttl > 0:
+        try:
+            redis_client.setex(f"revoked_token:{payload['jti']}", ttl, "1")
+        except Exception as e:
+            print(f"Redis revoke error: {e}")
+
+def revoke_user_tokens(email: str):
+    """Revoke every token issued to a user so far (e.g. after deactivation or a role change)"""
+    if not redis_client:
+        return
+    try:
+        redis_client.setex(f"revoked_user:{email}", ACCESS_TOKEN_EXPIRE_MINUTES * 60, str(time.time()))
+        redis_client.delete(f"user:{email}")
+    except Exception as e:
+        print(f"Redis revoke error: {e}")
+
+def issued_before(payload: dict, revoked_at: str) -> bool:
+    """Whether a token predates a user revocation, compared in milliseconds (iat for tokens without iat_ms)"""
+    issued_ms = payload.get("iat_ms", payload.get("iat", 0) * 1000)
+    return issued_ms < int(float(revoked_at) * 1000)
+
+def is_token_revoked(payload: dict) -> bool:
+    if not redis_client:
+        return False
+    try:
+        if payload.get("jti") and redis_client.exists(f"revoked_token:{payload['jti']}"):
+            return True
+        revoked_before = redis_client.get(f"revoked_user:{payload.get('sub')}")
+    except Exception as e:
+        print(f"Redis revocation check error: {e}")
+        return False
+    return bool(revoked_before) and issued_before(payload, revoked_before)
+
+def decode_token(token: str) -> dict:
+    """Decode and validate a JWT, including revocation"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
-        token_data = TokenData(email=email)
     except jwt.PyJWTError:
         raise credentials_exception
+    if payload.get("sub") is None or is_token_revoked(payload):
+        raise credentials_exception
+    return payload
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme),
+    x_user_email: Optional[str] = Header(None)
+):
+    """Get current user from JWT token"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    # The gateway has already verified the token and passes the subject along.
+    # The header is only trusted when the internal API key protects this service.
+    if x_user_email and INTERNAL_API_KEY:
+        email = x_user_email
+    else:
+        email = decode_token(credentials.credentials)["sub"]
+    token_data = TokenData(email=email)
 
     # Check Redis cache first
     if redis_client:
@@ -320,7 +364,7 @@ def root():
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "auth-service"}
+    return {"status": "healthy", "service": "auth-service", "analytics": analytics_emitter.stats()}
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), background_tasks: BackgroundTasks = BackgroundTasks()):
@@ -339,7 +383,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user["email"]}, expires_delta=access_token_expires
+        data={"sub": user["email"], "uid": user["id"], "admin": user["is_admin"]},
+        expires_delta=access_token_expires
     )
     
     # Track login event
@@ -387,6 +432,12 @@ async def create_user(user: UserCreate, background_tasks: BackgroundTasks):
         "is_admin": False
     }
 
+@app.post("/logout")
+def logout(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
+    """Revoke the caller's token"""
+    revoke_token(decode_token(credentials.credentials))
+    return {"message": "Logged out"}
+
 @app.get("/users/me", response_model=User)
 def read_users_me(current_user: User = Depends(get_current_user)):
     """Get current user information"""
@@ -576,7 +627,8 @@ def update_user_admin(user_id: int, user_update: UserUpdate, current_user: User
     
     # Check if user exists
     cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-    if not cursor.fetchone():
+    existing_user = cursor.fetchone()
+    if not existing_user:
         conn.close()
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -621,6 +673,9 @@ def update_user_admin(user_id: int, user_update: UserUpdate, current_user: User
     updated_user = cursor.fetchone()
     conn.close()
     
+    # Tokens carry the email and admin flag, so outstanding ones are revoked
+    revoke_user_tokens(existing_user["email"])
+    
     return UserInDB(
         id=updated_user["id"],
         email=updated_user["email"],
@@ -640,8 +695,9 @@ def delete_user_admin(user_id: int, current_user: User = Depends(get_current_use
     cursor = conn.cursor()
     
     # Check if user exists
-    cursor.execute("SELECT id FROM users WHERE id = %s", (user_id,))
-    if not cursor.fetchone():
+    cursor.execute("SELECT id, email FROM users WHERE id = %s", (user_id,))
+    existing_user = cursor.fetchone()
+    if not existing_user:
         conn.close()
         raise HTTPException(status_code=404, detail="User not found")
         
@@ -654,6 +710,8 @@ def delete_user_admin(user_id: int, current_user: User = Depends(get_current_use
     conn.commit()
     conn.close()
     
+    revoke_user_tokens(existing_user["email"])
+    
     return {"message": "User deleted successfully"}
 
 if __name__ == "__main__":
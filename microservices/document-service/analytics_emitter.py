@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq")
+ANALYTICS_EXCHANGE = os.getenv("ANALYTICS_EXCHANGE", "analytics")
+ANALYTICS_QUEUE = os.getenv("ANALYTICS_QUEUE", "analytics_ingest")
+# Messages analytics-service can't write are dead-lettered here; the queue
+# arguments must match analytics-service's declaration
+ANALYTICS_DEAD_LETTER_EXCHANGE = os.getenv("ANALYTICS_DEAD_LETTER_EXCHANGE", "analytics.dead")
+ANALYTICS_BUFFER_SIZE = int(os.getenv("ANALYTICS_BUFFER_SIZE", "10000"))  # Events held while RabbitMQ is unreachable
+ANALYTICS_PUBLISH_BATCH = int(os.getenv("ANALYTICS_PUBLISH_BATCH", "100"))  # Events per message
+ANALYTICS_RECONNECT_DELAY = float(os.getenv("ANALYTICS_RECONNECT_DELAY", "5"))  # Seconds
+
+class AnalyticsEmitter:
+    """
+    Fire-and-forget analytics publisher.
+
+    emit() only appends to a bounded in-memory buffer; a background thread
+    publishes the buffered events to the analytics topic exchange in batches
+    (routing key "event.<type>" or "metric.<type>"), with publisher confirms.
+    While RabbitMQ is unreachable the buffer fills up and new events are
+    dropped and counted, so callers never block on analytics.
+    """
+
+    def __init__(self, source: str, max_buffer: int = ANALYTICS_BUFFER_SIZE):
+        self.source = source
+        self._buffer: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=max_buffer)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._connection = None
+        self._channel = None
+        self.published = 0
+        self.dropped = 0
+
+    def _enqueue(self, message: Dict[str, Any]):
+        if self._thread is None:
+            self.start()
+        try:
+            self._buffer.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Analytics buffer full, {self.dropped} events dropped so far")
+
+    def emit(self, user_id: int, event_type: str, event_data: Dict[str, Any]):
+        self._enqueue({
+            "kind": "event",
+            "user_id": user_id,
+            "event_type": event_type,
+            "event_data": event_data,
+        })
+
+    def emit_metric(self, user_id: int, metric_type: str, start_time: datetime, end_time: datetime, success: bool,
+                    error_message: Optional[str] = None, document_id: Optional[int] = None):
+        self._enqueue({
+            "kind": "metric",
+            "user_id": user_id,
+            "metric": {
+                "metric_type": metric_type,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "success": success,
+                "error_message": error_message,
+                "document_id": document_id,
+            },
+        })
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="analytics-emitter", daemon=True)
+                self._thread.start()
+
+    def _connect(self):
+        self._connection = pika.BlockingConnection(pika.ConnectionParameters(host=RABBITMQ_HOST, heartbeat=60))
+        self._channel = self._connection.channel()
+        self._channel.exchange_declare(exchange=ANALYTICS_EXCHANGE, exchange_type="topic", durable=True)
+        # Declared here too so events published before analytics-service first starts are kept
+        self._channel.queue_declare(queue=ANALYTICS_QUEUE, durable=True,
+                                    arguments={"x-dead-letter-exchange": ANALYTICS_DEAD_LETTER_EXCHANGE})
+        self._channel.queue_bind(queue=ANALYTICS_QUEUE, exchange=ANALYTICS_EXCHANGE, routing_key="#")
+        self._channel.confirm_delivery()
+
+    def _disconnect(self):
+        try:
+            if self._connection and self._connection.is_open:
+                self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+        self._channel = None
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._buffer.get(timeout=1)]
+        except queue.Empty:
+            return []
+        while len(batch) < ANALYTICS_PUBLISH_BATCH:
+            try:
+                batch.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _group(self, batch: List[Dict[str, Any]]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """One message per routing key, so consumers can bind to what they need."""
+        by_key: Dict[str, List[Dict[str, Any]]] = {}
+        for message in batch:
+            name = message["event_type"] if message["kind"] == "event" else message["metric"]["metric_type"]
+            by_key.setdefault(f"{message['kind']}.{name}", []).append(message)
+        return list(by_key.items())
+
+    def _run(self):
+        pending: List[Tuple[str, List[Dict[str, Any]]]] = []  # Not yet confirmed by the broker
+        while True:
+            try:
+                if self._channel is None:
+                    self._connect()
+                if not pending:
+                    pending = self._group(self._next_batch())
+                if not pending:
+                    # Idle: keep the connection's heartbeats going
+                    self._connection.process_data_events(time_limit=0)
+                while pending:
+                    routing_key, messages = pending[0]
+                    self._channel.basic_publish(
+                        exchange=ANALYTICS_EXCHANGE,
+                        routing_key=routing_key,
+                        body=json.dumps({"source": self.source, "messages": messages}, default=str),
+                        properties=pika.BasicProperties(content_type="application/json", delivery_mode=2),
+                    )
+                    pending.pop(0)
+                    self.published += len(messages)
+            except Exception as e:
+                # Keep what is unsent and retry after reconnecting
+                logger.warning(f"Publishing analytics failed ({sum(len(m) for _, m in pending)} events pending): {e}")
+                self._disconnect()
+                time.sleep(ANALYTICS_RECONNECT_DELAY)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"buffered": self._buffer.qsize(), "published": self.published, "dropped": self.dropped}
@@ -1,4 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, BackgroundTasks, Header
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, BackgroundTasks, Header, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List
@@ -6,16 +9,22 @@ import os
 import shutil
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import re
+import time
+import base64
 import requests
 from io import BytesIO
+from email.utils import formatdate, parsedate_to_datetime
 import logging
 
 import redis
 import json
 import json
 from rabbitmq import publish_message, get_queue_depth
+from analytics_emitter import AnalyticsEmitter
+from storage_ledger import create_ledger_table, record_upload, record_delete, quota_status
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -54,6 +63,108 @@ trace.get_tracer_provider().add_span_processor(span_processor)
 # Internal API Key configuration
 INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
 
+# Per-owner version counter for the owner's documents (hash with "version" and
+# "modified"). Every change to any of the owner's documents bumps it; ETags on
+# document reads are derived from it, and the gateway answers If-None-Match
+# from it without calling this service.
+DOCUMENTS_VERSION_KEY = "documents_version:{owner_id}"
+
+def bump_documents_version(owner_id: int):
+    """
+    Record a change to an owner's documents. Cached list pages are keyed by
+    the version, so this invalidates them without deleting anything; the
+    old pages simply stop being read and expire.
+    """
+    if not redis_client:
+        return
+    try:
+        key = DOCUMENTS_VERSION_KEY.format(owner_id=owner_id)
+        pipe = redis_client.pipeline()
+        pipe.hincrby(key, "version", 1)
+        pipe.hset(key, "modified", time.time())
+        pipe.execute()
+    except Exception as e:
+        logger.error(f"Redis version bump error: {e}")
+
+def get_documents_version(owner_id: int):
+    """(version key, version, modified timestamp) for an owner, or None without Redis"""
+    if not redis_client:
+        return None
+    key = DOCUMENTS_VERSION_KEY.format(owner_id=owner_id)
+    try:
+        # Seed a missing counter from the clock so a lost key can't reissue old ETags
+        pipe = redis_client.pipeline()
+        pipe.hsetnx(key, "version", int(time.time() * 1000))
+        pipe.hsetnx(key, "modified", time.time())
+        pipe.hmget(key, "version", "modified")
+        version, modified = pipe.execute()[-1]
+        return key, int(version), float(modified)
+    except Exception as e:
+        logger.error(f"Redis version lookup error: {e}")
+        return None
+
+def conditional_response(request: Request, payload, owner_id: int, resource: str, current=None, extra_headers=None):
+    """
+    Return `payload` with ETag/Last-Modified derived from the owner's version
+    counter (looked up unless passed as `current`), or an empty 304 when the
+    client's copy is still current.
+    """
+    current = current or get_documents_version(owner_id)
+    if current is None:
+        return JSONResponse(content=jsonable_encoder(payload), headers=extra_headers) if extra_headers else payload
+    key, version, modified = current
+    etag = f'W/"{resource}-{version}"'
+    headers = {
+        **(extra_headers or {}),
+        "ETag": etag,
+        "Last-Modified": formatdate(modified, usegmt=True),
+        "Cache-Control": "private, no-cache",
+        # Lets the gateway revalidate this ETag on its own
+        "X-Version-Key": key,
+        "X-Version": str(version),
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    else:
+        not_modified = False
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                not_modified = int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                pass
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=jsonable_encoder(payload), headers=headers)
+
+def request_owner_id(request: Request) -> int:
+    """
+    Owner for the request: the user verified by the gateway (X-User-ID, only
+    trusted when the internal API key is enforced), else the demo user 1.
+    """
+    user_id = request.headers.get("x-user-id")
+    if user_id and INTERNAL_API_KEY:
+        try:
+            return int(user_id)
+        except ValueError:
+            pass
+    return 1
+
+def check_storage_quota(owner_id: int, incoming_bytes: int):
+    """Reject an upload that would take the owner past their storage quota"""
+    conn = get_db_connection()
+    try:
+        status = quota_status(conn.cursor(), owner_id, incoming_bytes)
+    finally:
+        conn.close()
+    if not status["allowed"]:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Storage quota exceeded: {status['used_bytes']} of {status['quota_bytes']} bytes used"
+        )
+
 async def verify_internal_api_key(x_internal_api_key: str = Header(None)):
     if not INTERNAL_API_KEY:
         return
@@ -98,58 +209,40 @@ minio_client = Minio(
 if not minio_client.bucket_exists(DOCUMENTS_BUCKET):
     minio_client.make_bucket(DOCUMENTS_BUCKET)
 
+# Downloads are streamed from MinIO through this service ("stream"), or the
+# client is redirected to a presigned MinIO URL ("presigned"), which has to be
+# signed for the endpoint browsers reach MinIO on.
+DOCUMENT_DOWNLOAD_MODE = os.getenv("DOCUMENT_DOWNLOAD_MODE", "stream")
+MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", MINIO_ENDPOINT)
+MINIO_PUBLIC_SECURE = os.getenv("MINIO_PUBLIC_SECURE", str(MINIO_SECURE)).lower() == "true"
+MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+PRESIGNED_URL_EXPIRY = int(os.getenv("PRESIGNED_URL_EXPIRY", "300"))  # Seconds
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Signing is local; the region is given so the client never asks MinIO for it
+presign_client = Minio(
+    MINIO_PUBLIC_ENDPOINT,
+    access_key=MINIO_ACCESS_KEY,
+    secret_key=MINIO_SECRET_KEY,
+    secure=MINIO_PUBLIC_SECURE,
+    region=MINIO_REGION
+) if DOCUMENT_DOWNLOAD_MODE == "presigned" else None
+
 # Service URLs
 LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://llm-service:8000")
-ANALYTICS_SERVICE_URL = os.getenv("ANALYTICS_SERVICE_URL", "http://analytics-service:8000")
 
 # ... (MinIO config) ...
 
+# Analytics are published to RabbitMQ from a background thread and never block the caller
+analytics_emitter = AnalyticsEmitter(source="document-service")
+
 def track_analytics_event(user_id: int, event_type: str, event_data: dict):
     """Helper to track analytics events asynchronously"""
-    print(f"DEBUG: Attempting to track event {event_type} to {ANALYTICS_SERVICE_URL}")
-    try:
-        headers = {}
-        if INTERNAL_API_KEY:
-            headers["X-Internal-API-Key"] = INTERNAL_API_KEY
-            
-        response = requests.post(
-            f"{ANALYTICS_SERVICE_URL}/events",
-            json={
-                "user_id": user_id,
-                "event_type": event_type,
-                "event_data": event_data
-            },
-            headers=headers,
-            timeout=5
-        )
-        print(f"DEBUG: Analytics response: {response.status_code} - {response.text}")
-    except Exception as e:
-        logger.error(f"Failed to track analytics event: {e}")
-        print(f"DEBUG: Failed to track analytics event: {e}")
+    analytics_emitter.emit(user_id, event_type, event_data)
 
 def track_performance_metric(user_id: int, metric_type: str, start_time: datetime, end_time: datetime, success: bool, error_message: str = None, document_id: int = None):
     """Helper to track performance metrics asynchronously"""
-    try:
-        headers = {}
-        if INTERNAL_API_KEY:
-            headers["X-Internal-API-Key"] = INTERNAL_API_KEY
-            
-        requests.post(
-            f"{ANALYTICS_SERVICE_URL}/metrics",
-            json={
-                "user_id": user_id,
-                "metric_type": metric_type,
-                "start_time": start_time.isoformat(),
-                "end_time": end_time.isoformat(),
-                "success": success,
-                "error_message": error_message,
-                "document_id": document_id
-            },
-            headers=headers,
-            timeout=5
-        )
-    except Exception as e:
-        print(f"Error tracking performance metric: {e}")
+    analytics_emitter.emit_metric(user_id, metric_type, start_time, end_time, success, error_message, document_id)
 
 class DocumentResponse(BaseModel):
     id: int
@@ -180,6 +273,7 @@ class QuestionResponse(BaseModel):
 
 class UpdateStepRequest(BaseModel):
     step: str
+    duration_seconds: Optional[float] = None  # Set when the LLM service reports a finished stage
 
 def get_db_connection():
     """Create a database connection"""
@@ -210,6 +304,15 @@ def migrate_database():
         if not cursor.fetchone():
             print("Migrating database: Adding processing_step column")
             cursor.execute("ALTER TABLE documents ADD COLUMN processing_step TEXT")
+        
+        # Supports the owner-scoped keyset pagination in list_documents
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_documents_owner_created
+            ON documents (owner_id, created_at DESC, id DESC)
+        """)
+
+        # Storage-service's reconciler matches bucket listings against file_path
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_file_path ON documents (file_path)")
             
         conn.commit()
         conn.close()
@@ -270,36 +373,56 @@ def create_tables():
                 FOREIGN KEY (qa_session_id) REFERENCES qa_sessions (id)
             )
         """)
+
+        create_ledger_table(cursor)
         
         conn.commit()
         conn.close()
     except Exception as e:
         print(f"Error creating tables: {e}")
 
-def update_document_step(document_id: int, step: str):
-    """Update the processing step for a document"""
+# Processing progress is pushed, not persisted: each step is published on a
+# Redis channel and the latest event is kept under a key for late subscribers.
+# Only the final state (COMPLETED/ERROR) is written to Postgres.
+PROGRESS_CHANNEL = "document_progress:{document_id}"
+PROGRESS_STATE_KEY = "document_progress_state:{document_id}"
+PROGRESS_STATE_TTL = 6 * 3600
+PROGRESS_HEARTBEAT_SECONDS = 15
+FINAL_STATUSES = {"COMPLETED", "ERROR"}
+
+def publish_progress(document_id: int, step: str, status: str = "PROCESSING", error_message: Optional[str] = None):
+    """Publish a progress event for a document and remember it as the latest one"""
+    if not redis_client:
+        return
+    event = json.dumps({
+        "document_id": document_id,
+        "status": status,
+        "step": step,
+        "error_message": error_message,
+        "timestamp": time.time()
+    })
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE documents SET processing_step = %s WHERE id = %s",
-            (step, document_id)
-        )
-        conn.commit()
-        conn.close()
+        pipe = redis_client.pipeline()
+        pipe.setex(PROGRESS_STATE_KEY.format(document_id=document_id), PROGRESS_STATE_TTL, event)
+        pipe.publish(PROGRESS_CHANNEL.format(document_id=document_id), event)
+        pipe.execute()
     except Exception as e:
-        print(f"Error updating document step: {e}")
+        logger.error(f"Redis progress publish error: {e}")
 
-    # Invalidate cache so dashboard updates step
-    if redis_client:
-        try:
-            # We don't have owner_id easily here without a DB lookup, 
-            # but for demo we know it's likely 1. 
-            # To be safe and efficient, we might skip this for every step 
-            # OR do a quick lookup. For now, let's invalidate the demo key.
-            redis_client.delete("documents_list:1")
-        except Exception as e:
-            logger.error(f"Redis delete error: {e}")
+def get_progress(document_id: int) -> Optional[dict]:
+    """Latest published progress event for a document, if any"""
+    if not redis_client:
+        return None
+    try:
+        state = redis_client.get(PROGRESS_STATE_KEY.format(document_id=document_id))
+        return json.loads(state) if state else None
+    except Exception as e:
+        logger.error(f"Redis progress lookup error: {e}")
+        return None
+
+def update_document_step(document_id: int, step: str):
+    """Update the processing step for a document (published, not stored)"""
+    publish_progress(document_id, step)
 
 def process_document_task(document_id: int):
     """Background task to process a document and extract analysis"""
@@ -377,6 +500,10 @@ def process_document_task(document_id: int):
 
         conn.commit()
         conn.close()
+        # Invalidate cached pages before announcing the final state, since
+        # clients reload the document as soon as they get it
+        bump_documents_version(document["owner_id"])
+        publish_progress(document_id, "Completed", "COMPLETED")
 
         # Track analysis event
         token_usage = result.get("token_usage", {})
@@ -404,15 +531,6 @@ def process_document_task(document_id: int):
         )
 
         print(f"Document {document_id} processed successfully")
-        
-        # Invalidate cache so dashboard updates status
-        if redis_client:
-            try:
-                redis_client.delete(f"documents_list:{document['owner_id']}")
-                # Also delete the generic one for demo if used
-                redis_client.delete("documents_list:1")
-            except Exception as e:
-                logger.error(f"Redis delete error: {e}")
     except Exception as e:
         print(f"Error processing document {document_id}: {e}")
         
@@ -448,19 +566,13 @@ def process_document_task(document_id: int):
             conn.close()
         except Exception as update_error:
             print(f"Error updating document status: {update_error}")
-            
-        # Invalidate cache so dashboard updates status
-        if redis_client:
-            try:
-                # Try to get owner_id if possible
-                owner_id = 1
-                if 'document' in locals() and document:
-                    owner_id = document["owner_id"]
-                
-                redis_client.delete(f"documents_list:{owner_id}")
-                redis_client.delete("documents_list:1")
-            except Exception as e:
-                logger.error(f"Redis delete error: {e}")
+
+        # Invalidate cache so dashboard updates status, before the final event
+        owner_id = 1
+        if 'document' in locals() and document:
+            owner_id = document["owner_id"]
+        bump_documents_version(owner_id)
+        publish_progress(document_id, "Failed", "ERROR", error_message=str(e))
 
 @app.on_event("startup")
 def startup_event():
@@ -475,16 +587,24 @@ def root():
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "document-service", "dependencies": ["llm-service"]}
+    return {
+        "status": "healthy",
+        "service": "document-service",
+        "dependencies": ["llm-service"],
+        "analytics": analytics_emitter.stats()
+    }
 
 @app.post("/documents")
-async def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_document(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+    owner_id = request_owner_id(request)
+
     # Reset file pointer to beginning
     await file.seek(0)
 
     # Read file content
     file_content = await file.read()
     file_size = len(file_content)
+    await run_in_threadpool(check_storage_quota, owner_id, file_size)
 
     # Generate a unique object name for MinIO
     import uuid
@@ -511,9 +631,10 @@ async def upload_document(background_tasks: BackgroundTasks, file: UploadFile =
     cursor.execute("""
         INSERT INTO documents (filename, file_path, file_size, mime_type, owner_id)
         VALUES (%s, %s, %s, %s, %s) RETURNING id
-    """, (file.filename, object_name, file_size, file.content_type, 1))  # Assuming owner_id = 1 for demo
+    """, (file.filename, object_name, file_size, file.content_type, owner_id))
 
     document_id = cursor.fetchone()['id']
+    record_upload(cursor, owner_id, DOCUMENTS_BUCKET, object_name, file_size)
     conn.commit()
     conn.close()
 
@@ -535,7 +656,7 @@ async def upload_document(background_tasks: BackgroundTasks, file: UploadFile =
     # Track upload event
     background_tasks.add_task(
         track_analytics_event,
-        user_id=1, # TODO: Get from auth context
+        user_id=owner_id,
         event_type="document_uploaded",
         event_data={
             "document_id": document_id,
@@ -546,11 +667,7 @@ async def upload_document(background_tasks: BackgroundTasks, file: UploadFile =
 
     # Return document info
     # Invalidate cache
-    if redis_client:
-        try:
-            redis_client.delete("documents_list:1")
-        except Exception as e:
-            logger.error(f"Redis delete error: {e}")
+    bump_documents_version(owner_id)
 
     return {
         "id": document_id,
@@ -558,13 +675,18 @@ async def upload_document(background_tasks: BackgroundTasks, file: UploadFile =
         "file_path": object_name,  # This is now the MinIO object name
         "file_size": file_size,
         "mime_type": file.content_type,
-        "owner_id": 1,
+        "owner_id": owner_id,
         "status": "PROCESSING"
     }
 
 @app.patch("/documents/{document_id}/step")
 def update_document_step_endpoint(document_id: int, request: UpdateStepRequest):
     """Update the processing step of a document (called by LLM service)"""
+    if request.duration_seconds is not None:
+        # Stage completion report: the step was already set when the stage started,
+        # and concurrent stages must not overwrite each other's progress text
+        logger.info(f"Document {document_id} stage '{request.step}' took {request.duration_seconds:.2f}s")
+        return {"message": "Stage timing recorded"}
     update_document_step(document_id, request.step)
     return {"message": "Step updated successfully"}
 
@@ -575,7 +697,8 @@ class UploadUrlRequest(BaseModel):
 @app.post("/documents/upload-url", response_model=DocumentResponse)
 async def upload_document_from_url(
     request: UploadUrlRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    http_request: Request
 ):
     """
     Upload a document from a URL.
@@ -636,6 +759,8 @@ async def upload_document_from_url(
 
         # 3. Upload to MinIO
         file_size = len(file_content)
+        owner_id = request_owner_id(http_request) if http_request.headers.get("x-user-id") else request.owner_id
+        check_storage_quota(owner_id, file_size)
         import uuid
         unique_id = str(uuid.uuid4())
         file_path = f"{unique_id}/{final_filename}"
@@ -660,9 +785,10 @@ async def upload_document_from_url(
         cursor.execute("""
             INSERT INTO documents (filename, file_path, file_size, mime_type, owner_id, status)
             VALUES (%s, %s, %s, %s, %s, %s) RETURNING id
-        """, (final_filename, file_path, file_size, content_type, request.owner_id, "UPLOADED"))
+        """, (final_filename, file_path, file_size, content_type, owner_id, "UPLOADED"))
         
         document_id = cursor.fetchone()['id']
+        record_upload(cursor, owner_id, DOCUMENTS_BUCKET, file_path, file_size)
         conn.commit()
         
         # Fetch the created document to return it
@@ -680,11 +806,7 @@ async def upload_document_from_url(
             background_tasks.add_task(process_document_task, document_id)
         
         # Invalidate cache
-        if redis_client:
-            try:
-                redis_client.delete("documents_list:1")
-            except Exception as e:
-                logger.error(f"Redis delete error: {e}")
+        bump_documents_version(db_document["owner_id"])
 
         return {
             "id": db_document["id"],
@@ -698,6 +820,8 @@ async def upload_document_from_url(
             "status": db_document["status"]
         }
         
+    except HTTPException:
+        raise
     except requests.RequestException as e:
         logger.error(f"Failed to fetch URL: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {e}")
@@ -755,26 +879,75 @@ def get_queue_status():
         "recent_documents": recent_docs
     }
 
+DOCUMENTS_PAGE_SIZE = int(os.getenv("DOCUMENTS_PAGE_SIZE", "100"))
+DOCUMENTS_MAX_PAGE_SIZE = 500
+DOCUMENTS_LIST_CACHE_TTL = 300  # Seconds; pages of superseded versions just expire
+
+def encode_cursor(created_at: datetime, document_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{document_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, document_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(document_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/documents")
-def list_documents():
-    # Check Redis cache first
-    # Since we don't have user_id in context yet (demo mode), we'll use a global key or hardcoded user_id=1
-    # In a real app, we would use `documents_list:{user_id}`
-    cache_key = "documents_list:1" 
-    
-    if redis_client:
+def list_documents(request: Request, limit: int = DOCUMENTS_PAGE_SIZE, cursor: Optional[str] = None):
+    """
+    The caller's documents, newest first, one page at a time. Pagination is
+    keyset-based on (owner_id, created_at, id); when more documents exist the
+    X-Next-Cursor header holds the `cursor` for the next page.
+    """
+    owner_id = request_owner_id(request)
+    limit = max(1, min(limit, DOCUMENTS_MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+
+    # Pages are cached per owner and per version: a change bumps the version
+    # instead of deleting keys, so there is no window where every poller misses at once
+    current = get_documents_version(owner_id)
+    cache_key = None
+    if current:
+        cache_key = f"documents_list:{owner_id}:v{current[1]}:{cursor or 'first'}:{limit}"
         try:
-            cached_docs = redis_client.get(cache_key)
-            if cached_docs:
-                return json.loads(cached_docs)
+            cached_page = redis_client.get(cache_key)
+            if cached_page:
+                page = json.loads(cached_page)
+                return conditional_response(
+                    request, page["documents"], owner_id, f"documents-{cursor or 'first'}-{limit}",
+                    current=current, extra_headers=page_headers(page["next_cursor"])
+                )
         except Exception as e:
             logger.error(f"Redis error: {e}")
 
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM documents")
-    documents = cursor.fetchall()
+    db_cursor = conn.cursor()
+    columns = "id, filename, file_path, file_size, mime_type, owner_id, status, created_at, updated_at"
+    if after:
+        db_cursor.execute(f"""
+            SELECT {columns} FROM documents
+            WHERE owner_id = %s AND (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (owner_id, after[0], after[1], limit + 1))
+    else:
+        db_cursor.execute(f"""
+            SELECT {columns} FROM documents
+            WHERE owner_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (owner_id, limit + 1))
+    documents = db_cursor.fetchall()
     conn.close()
+
+    # One extra row tells whether another page exists
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1]["created_at"], documents[-1]["id"])
     
     result = []
     for doc in documents:
@@ -791,20 +964,26 @@ def list_documents():
         })
     
     # Cache result
-    if redis_client:
+    if cache_key:
         try:
             redis_client.setex(
                 cache_key,
-                300,  # 5 minutes TTL
-                json.dumps(result)
+                DOCUMENTS_LIST_CACHE_TTL,
+                json.dumps({"documents": result, "next_cursor": next_cursor})
             )
         except Exception as e:
             logger.error(f"Redis set error: {e}")
 
-    return result
+    return conditional_response(
+        request, result, owner_id, f"documents-{cursor or 'first'}-{limit}",
+        current=current, extra_headers=page_headers(next_cursor)
+    )
+
+def page_headers(next_cursor: Optional[str]) -> dict:
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
 
 @app.get("/documents/{document_id}")
-def get_document(document_id: int):
+def get_document(document_id: int, request: Request):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM documents WHERE id = %s", (document_id,))
@@ -837,7 +1016,82 @@ def get_document(document_id: int):
             "key_figures": analysis["key_figures"]
         }
     
-    return response
+    # While processing, the current step lives in Redis only. Such responses
+    # change without a version bump, so they are not made revalidatable.
+    if response["status"] not in FINAL_STATUSES:
+        progress = get_progress(document_id)
+        if progress:
+            response["processing_step"] = progress["step"]
+            return response
+    
+    return conditional_response(request, response, document["owner_id"], f"document-{document_id}")
+
+def _document_state(document_id: int) -> Optional[dict]:
+    """Progress event shaped snapshot of a document's stored state"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT status, processing_step, error_message FROM documents WHERE id = %s",
+        (document_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return None
+    return {
+        "document_id": document_id,
+        "status": row["status"],
+        "step": row["processing_step"],
+        "error_message": row["error_message"],
+        "timestamp": time.time()
+    }
+
+@app.get("/documents/{document_id}/progress")
+async def stream_document_progress(document_id: int):
+    """
+    Server-sent events with the document's processing progress. The current
+    state is sent first, then every published step until a final status.
+    A comment line is sent periodically to keep idle connections open.
+    """
+    if not redis_client:
+        raise HTTPException(status_code=503, detail="Progress streaming unavailable")
+
+    import redis.asyncio as aioredis
+    subscriber = aioredis.from_url(REDIS_URL, decode_responses=True)
+    pubsub = subscriber.pubsub()
+    # Subscribe before reading the current state so no event falls in between
+    await pubsub.subscribe(PROGRESS_CHANNEL.format(document_id=document_id))
+
+    stored = await run_in_threadpool(_document_state, document_id)
+    if stored is None:
+        await pubsub.close()
+        await subscriber.close()
+        raise HTTPException(status_code=404, detail="Document not found")
+    if stored["status"] not in FINAL_STATUSES:
+        stored = await run_in_threadpool(get_progress, document_id) or stored
+
+    async def events():
+        try:
+            yield f"data: {json.dumps(stored)}\n\n"
+            if stored["status"] in FINAL_STATUSES:
+                return
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=PROGRESS_HEARTBEAT_SECONDS)
+                if message is None:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {message['data']}\n\n"
+                if json.loads(message["data"]).get("status") in FINAL_STATUSES:
+                    return
+        finally:
+            await pubsub.close()
+            await subscriber.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.delete("/documents/{document_id}")
 def delete_document(document_id: int, background_tasks: BackgroundTasks):
@@ -845,7 +1099,7 @@ def delete_document(document_id: int, background_tasks: BackgroundTasks):
     cursor = conn.cursor()
 
     # Get file path (which is now the MinIO object name) to delete the actual file
-    cursor.execute("SELECT file_path FROM documents WHERE id = %s", (document_id,))
+    cursor.execute("SELECT file_path, file_size, owner_id FROM documents WHERE id = %s", (document_id,))
     result = cursor.fetchone()
 
     if not result:
@@ -855,6 +1109,7 @@ def delete_document(document_id: int, background_tasks: BackgroundTasks):
 
     # Delete from database
     cursor.execute("DELETE FROM documents WHERE id = %s", (document_id,))
+    record_delete(cursor, result["owner_id"], DOCUMENTS_BUCKET, minio_object_name, result["file_size"])
     conn.commit()
     conn.close()
 
@@ -876,19 +1131,19 @@ def delete_document(document_id: int, background_tasks: BackgroundTasks):
     )
 
     # Invalidate cache
-    if redis_client:
-        try:
-            redis_client.delete("documents_list:1")
-        except Exception as e:
-            logger.error(f"Redis delete error: {e}")
+    bump_documents_version(result["owner_id"])
 
     return {"message": "Document deleted successfully"}
 
 @app.get("/documents/{document_id}/analysis")
-def get_document_analysis(document_id: int):
+def get_document_analysis(document_id: int, request: Request):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM analysis_results WHERE document_id = ?", (document_id,))
+    cursor.execute("""
+        SELECT ar.*, d.owner_id FROM analysis_results ar
+        JOIN documents d ON d.id = ar.document_id
+        WHERE ar.document_id = %s
+    """, (document_id,))
     analysis_result = cursor.fetchone()
     conn.close()
     
@@ -900,12 +1155,12 @@ def get_document_analysis(document_id: int):
     except:
         key_figures = []
     
-    return {
+    return conditional_response(request, {
         "id": analysis_result["id"],
         "summary": analysis_result["summary"],
         "key_figures": key_figures,
         "created_at": analysis_result["created_at"]
-    }
+    }, analysis_result["owner_id"], f"analysis-{document_id}")
 
 @app.post("/documents/{document_id}/ask")
 def ask_document_question(document_id: int, question_request: QuestionRequest, background_tasks: BackgroundTasks):
@@ -1040,11 +1295,50 @@ def list_document_questions(document_id: int):
     
     return result
 
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)$")
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    (start, end) of a single-range Range header, inclusive, or None to send
+    the whole object. Multiple ranges are not supported and get the whole
+    object, which the spec allows. Raises 416 for unsatisfiable ranges.
+    """
+    match = RANGE_PATTERN.match((range_header or "").strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None  # Syntactically invalid, so the header is ignored
+    else:
+        # Suffix range: the last N bytes
+        start, end = max(size - int(last), 0), size - 1
+        if int(last) == 0:
+            start = size
+    if start >= size:
+        raise HTTPException(
+            status_code=416,
+            detail="Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, end
+
+def stream_object(response):
+    """Yield a MinIO object response in chunks and release its connection afterwards"""
+    try:
+        for chunk in response.stream(DOWNLOAD_CHUNK_SIZE):
+            yield chunk
+    finally:
+        response.close()
+        response.release_conn()
+
 @app.get("/documents/{document_id}/download")
-def download_document(document_id: int):
+def download_document(document_id: int, request: Request, inline: bool = False):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM documents WHERE id = ?", (document_id,))
+    cursor.execute("SELECT * FROM documents WHERE id = %s", (document_id,))
     document = cursor.fetchone()
     conn.close()
 
@@ -1060,28 +1354,62 @@ def download_document(document_id: int):
         filename = filename.split("/")[-1]
     if "\\" in filename:
         filename = filename.split("\\")[-1]
+    filename = filename.replace('"', "")
 
-    # Download from MinIO to a temporary location and return
-    import tempfile
-    import os
-    from fastapi.responses import FileResponse
+    media_type = document["mime_type"] or "application/pdf"
+    disposition = f'{"inline" if inline else "attachment"}; filename="{filename}"'
+
+    if presign_client is not None:
+        # The client fetches (and range-requests) the object from MinIO directly
+        try:
+            url = presign_client.presigned_get_object(
+                DOCUMENTS_BUCKET,
+                minio_object_name,
+                expires=timedelta(seconds=PRESIGNED_URL_EXPIRY),
+                response_headers={
+                    "response-content-disposition": disposition,
+                    "response-content-type": media_type
+                }
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Could not sign download URL: {str(e)}")
+        return Response(status_code=307, headers={"Location": url, "Cache-Control": "no-store"})
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as tmp_file:
-            minio_client.fget_object(DOCUMENTS_BUCKET, minio_object_name, tmp_file.name)
-            temp_file_path = tmp_file.name
-
-        return FileResponse(
-            temp_file_path,
-            filename=filename,
-            media_type='application/pdf',
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
-            }
-        )
+        stat = minio_client.stat_object(DOCUMENTS_BUCKET, minio_object_name)
+    except Exception as e:
+        raise HTTPException(status_code=404, detail=f"Document file not found in storage: {str(e)}")
+
+    etag = f'"{stat.etag}"'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": disposition
+    }
+    if stat.last_modified:
+        headers["Last-Modified"] = formatdate(stat.last_modified.timestamp(), usegmt=True)
+
+    byte_range = parse_range(request.headers.get("range"), stat.size)
+    if_range = request.headers.get("if-range")
+    if byte_range and if_range and if_range not in (etag, headers.get("Last-Modified")):
+        byte_range = None  # The client's copy is outdated; send the current object whole
+
+    try:
+        if byte_range:
+            start, end = byte_range
+            response = minio_client.get_object(DOCUMENTS_BUCKET, minio_object_name, offset=start, length=end - start + 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.size}"
+            headers["Content-Length"] = str(end - start + 1)
+            status_code = 206
+        else:
+            response = minio_client.get_object(DOCUMENTS_BUCKET, minio_object_name)
+            headers["Content-Length"] = str(stat.size)
+            status_code = 200
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not download file from MinIO: {str(e)}")
 
+    return StreamingResponse(stream_object(response), status_code=status_code, media_type=media_type, headers=headers)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
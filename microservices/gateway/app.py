@@ -11,6 +11,9 @@ from fastapi import FastAPI, Request, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.background import BackgroundTask
+
+from auth import TokenVerifier, InvalidTokenError, identity_headers, IDENTITY_HEADERS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -87,20 +90,28 @@ class ServiceRouter:
 router = ServiceRouter()
 
 
+# Tokens are verified locally (signature, expiry, revocation) with cached claims
+token_verifier = TokenVerifier()
+
+
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict[str, Any]:
-    """Verify JWT token with user service."""
+    """Verify JWT token locally and return its claims."""
     try:
-        response = await client.get(
-            f"{SERVICE_URLS['user']}/verify-token",
-            headers={"Authorization": f"Bearer {credentials.credentials}"}
-        )
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(status_code=401, detail="Invalid token")
-    except Exception as e:
-        logger.error(f"Token verification failed: {e}")
-        raise HTTPException(status_code=401, detail="Token verification failed")
+        return await token_verifier.verify(credentials.credentials)
+    except InvalidTokenError as e:
+        logger.info(f"Rejected token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+
+# Hop-by-hop headers are per connection and must not be relayed
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade", "proxy-connection"}
+
+
+async def stream_request_body(request: Request):
+    """Relay the client body upstream chunk by chunk, without buffering it."""
+    async for chunk in request.stream():
+        if chunk:
+            yield chunk
 
 
 async def forward_request(request: Request, service: str) -> StreamingResponse:
@@ -114,29 +125,34 @@ async def forward_request(request: Request, service: str) -> StreamingResponse:
     if request.url.query:
         target_url += f"?{request.url.query}"
     
-    # Prepare headers (exclude host header)
-    headers = dict(request.headers)
+    # Prepare headers (exclude host and hop-by-hop headers)
+    headers = {k: v for k, v in dict(request.headers).items() if k.lower() not in HOP_BY_HOP_HEADERS}
     headers.pop("host", None)
     
-    # Get request body
-    body = await request.body()
+    # Stream the request body through; the original Content-Length is kept
+    has_body = request.headers.get("content-length", "0") != "0" or "chunked" in request.headers.get("transfer-encoding", "").lower()
+    body = stream_request_body(request) if has_body else None
     
     try:
         # Forward request to microservice
-        response = await client.request(
+        upstream_request = client.build_request(
             method=request.method,
             url=target_url,
             headers=headers,
-            content=body,
-            follow_redirects=True
+            content=body
         )
+        # A streamed body can't be replayed, so only body-less requests follow redirects
+        response = await client.send(upstream_request, stream=True, follow_redirects=not has_body)
         
-        # Return response
+        # Relay the raw (still encoded) bytes as they arrive, so the upstream's
+        # Content-Encoding and Content-Length stay valid
+        response_headers = {k: v for k, v in response.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
         return StreamingResponse(
-            iter([response.content]),
+            response.aiter_raw(),
             status_code=response.status_code,
-            headers=dict(response.headers),
-            media_type=response.headers.get("content-type")
+            headers=response_headers,
+            media_type=response.headers.get("content-type"),
+            background=BackgroundTask(response.aclose)
         )
         
     except Exception as e:
@@ -197,11 +213,9 @@ async def route_request(request: Request, path: str, user: Dict[str, Any] = Depe
     """Route authenticated requests to appropriate services."""
     service = router.get_service_for_path(f"/{path}")
     
-    # Add user info to headers for downstream services
-    headers = dict(request.headers)
-    headers["X-User-ID"] = str(user.get("id"))
-    headers["X-User-Email"] = user.get("email", "")
-    headers["X-User-Admin"] = str(user.get("is_admin", False))
+    # Add user info to headers for downstream services (never trust client-sent ones)
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in IDENTITY_HEADERS}
+    headers.update(identity_headers(user))
     
     # Update request headers
     request._headers = headers
@@ -0,0 +1,124 @@
+import os
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from jose import jwt, JWTError
+
+logger = logging.getLogger(__name__)
+
+# Tokens are signed by auth-service with the shared secret (HS256). If a
+# public key is published instead, tokens are verified against it (RS256).
+JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
+JWT_PUBLIC_KEY = os.getenv("JWT_PUBLIC_KEY")
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "RS256" if JWT_PUBLIC_KEY else "HS256")
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))  # Seconds; also bounds how late a revocation is noticed
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Headers carrying the verified identity to downstream services. Anything a
+# client sends under these names is dropped before forwarding.
+USER_ID_HEADER = "X-User-ID"
+USER_EMAIL_HEADER = "X-User-Email"
+USER_ADMIN_HEADER = "X-User-Admin"
+IDENTITY_HEADERS = {USER_ID_HEADER.lower(), USER_EMAIL_HEADER.lower(), USER_ADMIN_HEADER.lower()}
+
+def issued_before(claims: Dict[str, Any], revoked_at: str) -> bool:
+    """
+    Whether a token predates a user revocation. Both sides are compared in
+    milliseconds, so a token issued in the same second right after the
+    revocation stays valid; tokens without iat_ms fall back to iat.
+    """
+    issued_ms = claims.get("iat_ms", claims.get("iat", 0) * 1000)
+    return issued_ms < int(float(revoked_at) * 1000)
+
+class InvalidTokenError(Exception):
+    pass
+
+class TokenVerifier:
+    """
+    Verifies bearer tokens locally instead of asking the auth service.
+
+    Verified claims are kept in a bounded LRU cache keyed by a hash of the
+    token, for at most AUTH_CACHE_TTL seconds (never past the token's own
+    expiry). Revocations are looked up in Redis when a token is (re)verified:
+    `revoked_token:<jti>` for a single token, `revoked_user:<email>` holding a
+    timestamp before which all of the user's tokens are void.
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.key = JWT_PUBLIC_KEY or JWT_SECRET
+        self._cache: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        try:
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+        except Exception as e:
+            logger.warning(f"Redis not available for token revocation checks: {e}")
+            self.redis = None
+
+    async def _is_revoked(self, claims: Dict[str, Any]) -> bool:
+        if not self.redis:
+            return False
+        keys = [f"revoked_user:{claims['sub']}"]
+        if claims.get("jti"):
+            keys.append(f"revoked_token:{claims['jti']}")
+        try:
+            values = await self.redis.mget(keys)
+        except Exception as e:
+            # Revocation is best effort: signature and expiry are still enforced
+            logger.warning(f"Token revocation check failed: {e}")
+            return False
+        revoked_before = values[0]
+        if len(values) > 1 and values[1]:
+            return True
+        return bool(revoked_before) and issued_before(claims, revoked_before)
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        cache_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        now = time.time()
+        cached = self._cache.get(cache_key)
+        if cached and cached[1] > now:
+            self._cache.move_to_end(cache_key)
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+
+        try:
+            claims = jwt.decode(token, self.key, algorithms=[JWT_ALGORITHM])
+        except JWTError as e:
+            self._cache.pop(cache_key, None)
+            raise InvalidTokenError(str(e))
+        if not claims.get("sub"):
+            raise InvalidTokenError("Token has no subject")
+        if await self._is_revoked(claims):
+            self._cache.pop(cache_key, None)
+            raise InvalidTokenError("Token has been revoked")
+
+        self._cache[cache_key] = (claims, min(now + self.ttl, claims.get("exp", now + self.ttl)))
+        self._cache.move_to_end(cache_key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return claims
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cached_tokens": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+def bearer_token(authorization: Optional[str]) -> Optional[str]:
+    if authorization and authorization.lower().startswith("bearer "):
+        return authorization[7:].strip() or None
+    return None
+
+def identity_headers(claims: Dict[str, Any]) -> Dict[str, str]:
+    """Downstream headers for verified claims (uid/admin are absent on older tokens)."""
+    headers = {USER_EMAIL_HEADER: claims["sub"]}
+    if claims.get("uid") is not None:
+        headers[USER_ID_HEADER] = str(claims["uid"])
+    if "admin" in claims:
+        headers[USER_ADMIN_HEADER] = str(bool(claims["admin"]))
+    return headers
@@ -0,0 +1,90 @@
+"""
+Large-file upload benchmark for the gateway.
+
+Streams a generated multipart upload of --size-mb through the gateway and
+reports throughput. With --pid, the gateway process's resident memory is
+sampled while the upload is in flight, to check that it stays flat instead of
+growing with the file size.
+
+    python benchmark_upload.py --url http://localhost:8000 --token <jwt> --size-mb 1024 --pid <gateway pid>
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import argparse
+
+import httpx
+
+CHUNK_SIZE = 1024 * 1024
+
+def read_rss_kb(pid: int) -> int:
+    """Resident set size of a process in KB (Linux only)."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+async def multipart_body(head: bytes, tail: bytes, size: int):
+    """Yield a multipart/form-data body with `size` bytes of file content, one chunk at a time."""
+    yield head
+    block = os.urandom(CHUNK_SIZE)
+    remaining = size
+    while remaining > 0:
+        n = min(CHUNK_SIZE, remaining)
+        yield block[:n]
+        remaining -= n
+    yield tail
+
+async def sample_rss(pid: int, samples: list, stop: asyncio.Event):
+    while not stop.is_set():
+        samples.append(read_rss_kb(pid))
+        await asyncio.sleep(0.1)
+
+async def run(args):
+    size = args.size_mb * 1024 * 1024
+    boundary = uuid.uuid4().hex
+    filename = f"benchmark-{boundary[:8]}.pdf"
+    head = (f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f"Content-Type: application/pdf\r\n\r\n").encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    }
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+
+    samples, stop = [], asyncio.Event()
+    sampler = asyncio.create_task(sample_rss(args.pid, samples, stop)) if args.pid else None
+    baseline_kb = read_rss_kb(args.pid) if args.pid else 0
+
+    async with httpx.AsyncClient(timeout=None) as client:
+        started = time.perf_counter()
+        response = await client.post(f"{args.url.rstrip('/')}{args.path}", headers=headers,
+                                     content=multipart_body(head, tail, size))
+        elapsed = time.perf_counter() - started
+
+    stop.set()
+    if sampler:
+        await sampler
+
+    print(f"Status:     {response.status_code}")
+    print(f"Uploaded:   {args.size_mb} MB in {elapsed:.2f}s ({args.size_mb / elapsed:.1f} MB/s)")
+    if samples:
+        peak_kb = max(samples)
+        print(f"Gateway RSS: baseline {baseline_kb / 1024:.1f} MB, peak {peak_kb / 1024:.1f} MB "
+              f"(+{(peak_kb - baseline_kb) / 1024:.1f} MB during the upload)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark large uploads through the gateway")
+    parser.add_argument("--url", default=os.getenv("GATEWAY_URL", "http://localhost:8000"))
+    parser.add_argument("--path", default="/documents/upload")
+    parser.add_argument("--token", default=os.getenv("BENCHMARK_TOKEN"))
+    parser.add_argument("--size-mb", type=int, default=512)
+    parser.add_argument("--pid", type=int, help="Gateway process id to sample memory from")
+    asyncio.run(run(parser.parse_args()))
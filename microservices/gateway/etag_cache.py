@@ -0,0 +1,81 @@
+import os
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ETAG_CACHE_SIZE = int(os.getenv("ETAG_CACHE_SIZE", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379/0")
+
+# Headers a service sets to make a response revalidatable here; never sent to clients
+VERSION_KEY_HEADER = "x-version-key"
+VERSION_HEADER = "x-version"
+
+class ConditionalCache:
+    """
+    Answers conditional GETs with 304 without calling the upstream.
+
+    When a service response carries an ETag plus X-Version-Key/X-Version (the
+    Redis counter the ETag was derived from), the validators are remembered
+    per (user, URL). A later request whose If-None-Match names that ETag is
+    answered with 304 as long as the counter in Redis is unchanged; anything
+    else is forwarded as usual. Only validators are stored, never bodies.
+    """
+
+    def __init__(self, max_entries: int = ETAG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Dict[str, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        try:
+            import redis.asyncio as aioredis
+            self.redis = aioredis.from_url(REDIS_URL, decode_responses=True)
+        except Exception as e:
+            logger.warning(f"Redis not available for conditional GETs: {e}")
+            self.redis = None
+
+    async def not_modified_headers(self, identity: str, url: str, if_none_match: Optional[str]) -> Optional[Dict[str, str]]:
+        """Headers for a 304 if the client's ETag is still current, else None."""
+        if not self.redis or not if_none_match:
+            return None
+        entry = self._entries.get((identity, url))
+        if not entry or entry["etag"] not in [tag.strip() for tag in if_none_match.split(",")]:
+            return None
+        try:
+            version = await self.redis.hget(entry["version_key"], "version")
+        except Exception as e:
+            logger.warning(f"Version lookup failed, forwarding conditional request: {e}")
+            return None
+        if version != entry["version"]:
+            self.misses += 1
+            self._entries.pop((identity, url), None)
+            return None
+        self.hits += 1
+        self._entries.move_to_end((identity, url))
+        return {
+            "ETag": entry["etag"],
+            "Last-Modified": entry["last_modified"],
+            "Cache-Control": entry["cache_control"],
+        }
+
+    def remember(self, identity: str, url: str, headers) -> None:
+        """Store the validators of an upstream response that supports revalidation."""
+        etag = headers.get("etag")
+        version_key = headers.get(VERSION_KEY_HEADER)
+        version = headers.get(VERSION_HEADER)
+        if not (etag and version_key and version):
+            return
+        self._entries[(identity, url)] = {
+            "etag": etag,
+            "version_key": version_key,
+            "version": version,
+            "last_modified": headers.get("last-modified", ""),
+            "cache_control": headers.get("cache-control", "private, no-cache"),
+        }
+        self._entries.move_to_end((identity, url))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -1,11 +1,14 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import os
-import asyncio
 import logging
 import time
-from datetime import datetime
+
+from metrics_buffer import MetricsBuffer
+from auth import TokenVerifier, InvalidTokenError, bearer_token, identity_headers, IDENTITY_HEADERS
+from etag_cache import ConditionalCache, VERSION_KEY_HEADER, VERSION_HEADER
+from upstreams import Upstream, HealthCache, CircuitOpenError, IDEMPOTENT_METHODS
 
 # OpenTelemetry tracing setup
 from opentelemetry import trace
@@ -54,62 +57,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-async def send_analytics_event(user_id: int, path: str, method: str, start_time: str, end_time: str, status_code: int):
-    try:
-        analytics_url = SERVICE_ENDPOINTS.get("analytics")
-        if not analytics_url:
-            return
-            
-        success = status_code < 400
-        
-        # Use http_client to send event
-        # Note: http_client might be closed if app is shutting down, but for active requests it should be fine.
-        # We create a new client if needed or use the global one.
-        # Using global http_client is risky in background task if loop closes? 
-        # Actually, asyncio.create_task schedules it on the loop.
-        
-        await http_client.post(
-            f"{analytics_url}/events",
-            json={
-                "user_id": user_id,
-                "event_type": "performance_metric",
-                "event_data": {
-                    "metric_type": f"{method} {path}",
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "success": success,
-                    "error_message": str(status_code) if not success else None
-                }
-            },
-            headers={"X-Internal-API-Key": INTERNAL_API_KEY} if INTERNAL_API_KEY else {}
-        )
-    except Exception as e:
-        # Fail silently to not impact gateway performance
-        pass
+async def send_metrics_batch(batch: dict):
+    """Ship a batch of aggregated request-metric windows to the analytics service."""
+    analytics = upstreams.get("analytics")
+    if not analytics:
+        return
+    response = await analytics.client.post(
+        f"{analytics.base_url}/metrics/batch",
+        json=batch,
+        headers={"X-Internal-API-Key": INTERNAL_API_KEY} if INTERNAL_API_KEY else {},
+        timeout=5.0
+    )
+    response.raise_for_status()
+
+# Request metrics are aggregated per route and flushed in batches
+metrics_buffer = MetricsBuffer(send_metrics_batch)
 
 @app.middleware("http")
 async def track_request_metrics(request: Request, call_next):
-    start_time = time.time()
-    start_dt = datetime.utcnow()
+    start_time = time.perf_counter()
     
     response = await call_next(request)
     
-    process_time = time.time() - start_time
-    end_dt = datetime.utcnow()
-    
     # Skip tracking for health checks, analytics events, and static files
     if any(p in request.url.path for p in ["/health", "/events", "/static", "favicon.ico"]):
         return response
-        
-    # Track metrics asynchronously
-    asyncio.create_task(send_analytics_event(
-        1, # Default user_id
-        request.url.path,
+    
+    # Aggregate by route template (e.g. /documents/{document_id}) so ids don't create new series
+    route = request.scope.get("route")
+    metrics_buffer.record(
         request.method,
-        start_dt.isoformat(),
-        end_dt.isoformat(),
+        getattr(route, "path", request.url.path),
+        (time.perf_counter() - start_time) * 1000,
         response.status_code
-    ))
+    )
     
     return response
 
@@ -127,8 +108,16 @@ INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")
 if not INTERNAL_API_KEY:
     logger.warning("INTERNAL_API_KEY not set! Service-to-service authentication may fail.")
 
-# HTTP client for service calls
-http_client = httpx.AsyncClient(timeout=30.0)
+# One connection pool and circuit breaker per service, so a slow service can't
+# starve requests to the others
+upstreams = {name: Upstream(name, url) for name, url in SERVICE_ENDPOINTS.items()}
+health_cache = HealthCache(upstreams)
+
+# Bearer tokens are verified here once; services get the identity in headers
+token_verifier = TokenVerifier()
+
+# Validators of versioned responses, so unchanged polls get a 304 from here
+conditional_cache = ConditionalCache()
 
 @app.get("/")
 async def root():
@@ -136,22 +125,15 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Health check for the gateway and downstream services"""
+    """Health check for the gateway and downstream services (probed concurrently, cached briefly)"""
     try:
-        # Check that service endpoints are configured
-        for service_name, service_url in SERVICE_ENDPOINTS.items():
-            try:
-                # Make a simple request to each service's health endpoint
-                health_url = f"{service_url}/health"
-                response = await http_client.get(health_url)
-                if response.status_code != 200:
-                    logger.warning(f"Health check failed for {service_name} at {health_url}")
-            except Exception as e:
-                logger.error(f"Could not reach {service_name} at {service_url}: {e}")
-        
+        services = await health_cache.get()
         return {
-            "status": "healthy",
-            "services": {name: "available" for name in SERVICE_ENDPOINTS.keys()}
+            "status": "healthy" if all(s["status"] == "available" for s in services.values()) else "degraded",
+            "services": services,
+            "metrics_buffer": metrics_buffer.stats(),
+            "token_cache": token_verifier.stats(),
+            "conditional_cache": conditional_cache.stats()
         }
     except Exception as e:
         logger.error(f"Health check failed: {e}")
@@ -162,6 +144,10 @@ async def health_check():
 async def token(request: Request):
     return await forward_request("auth", "/token", request)
 
+@app.post("/logout")
+async def logout(request: Request):
+    return await forward_request("auth", "/logout", request)
+
 @app.post("/users")
 async def register_user(request: Request):
     return await forward_request("auth", "/users", request)
@@ -203,6 +189,11 @@ async def delete_document(document_id: int, request: Request):
 async def download_document(document_id: int, request: Request):
     return await forward_request("document", f"/documents/{document_id}/download", request)
 
+@app.get("/documents/{document_id}/progress")
+async def stream_document_progress(document_id: int, request: Request):
+    # Server-sent events; streamed through like any other response
+    return await forward_request("document", f"/documents/{document_id}/progress", request)
+
 @app.get("/documents/{document_id}/analysis")
 async def get_document_analysis(document_id: int, request: Request):
     return await forward_request("document", f"/documents/{document_id}/analysis", request)
@@ -322,6 +313,18 @@ async def cleanup_orphaned_files_admin(request: Request):
 async def sync_storage_admin(request: Request):
     return await forward_request("storage", "/admin/sync", request)
 
+@app.get("/admin/storage/maintenance/progress")
+async def get_storage_maintenance_progress_admin(request: Request):
+    return await forward_request("storage", "/admin/maintenance/progress", request)
+
+@app.post("/admin/storage/reconcile")
+async def reconcile_storage_admin(request: Request):
+    return await forward_request("storage", "/admin/reconcile", request)
+
+@app.get("/admin/storage/quota/{user_id}")
+async def get_storage_quota_admin(user_id: int, request: Request):
+    return await forward_request("storage", f"/quota/{user_id}", request)
+
 # Avatar endpoints
 @app.post("/storage/avatars/upload")
 async def upload_avatar(request: Request):
@@ -360,37 +363,78 @@ async def submit_feedback(request: Request):
 async def clear_all_cache_admin(request: Request):
     return await forward_request("llm", "/admin/clear-all-cache", request)
 
+def has_request_body(request: Request) -> bool:
+    """Whether the client sent a body (fixed length or chunked)."""
+    if request.headers.get("content-length", "0") != "0":
+        return True
+    return "chunked" in request.headers.get("transfer-encoding", "").lower()
+
+async def stream_request_body(request: Request):
+    """
+    Relay the client body to the upstream as it arrives. Only one chunk is held
+    at a time: the next one is read from the client after the previous one has
+    been written upstream, so memory per upload stays bounded.
+    """
+    async for chunk in request.stream():
+        if chunk:
+            yield chunk
+
 async def forward_request(service_name: str, path: str, original_request: Request):
     """
     Forward the request to the appropriate microservice
     """
-    service_url = SERVICE_ENDPOINTS.get(service_name)
-    if not service_url:
+    upstream = upstreams.get(service_name)
+    if not upstream:
         raise HTTPException(status_code=502, detail=f"Service {service_name} not available")
     
-    target_url = f"{service_url}{path}"
+    target_url = f"{upstream.base_url}{path}"
     logger.info(f"Forwarding request to: {target_url}")
     
-    # Extract headers and body from the original request
-    headers = dict(original_request.headers)
+    # Extract headers and body from the original request; identity headers are
+    # only ever set by the gateway
+    headers = {k: v for k, v in original_request.headers.items() if k.lower() not in IDENTITY_HEADERS}
     
     # Remove hop-by-hop headers that shouldn't be forwarded
     headers.pop('host', None)
     headers.pop('connection', None)
+    headers.pop('transfer-encoding', None)
     
     # Add Internal API Key
     if INTERNAL_API_KEY:
         headers['X-Internal-API-Key'] = INTERNAL_API_KEY
     
-    # Get the body content
-    body = await original_request.body()
+    # Pass the verified user downstream so services don't decode the token again.
+    # Invalid tokens are forwarded untouched; the service decides whether auth is required.
+    identity = "anonymous"
+    token = bearer_token(original_request.headers.get("authorization"))
+    if token:
+        try:
+            claims = await token_verifier.verify(token)
+            headers.update(identity_headers(claims))
+            identity = claims["sub"]
+        except InvalidTokenError as e:
+            logger.debug(f"Not passing identity for invalid token: {e}")
+    
+    # Conditional GETs whose ETag is still current never reach the service
+    cache_url = f"{path}?{original_request.url.query}"
+    if original_request.method == "GET":
+        not_modified = await conditional_cache.not_modified_headers(
+            identity, cache_url, original_request.headers.get("if-none-match")
+        )
+        if not_modified is not None:
+            return Response(status_code=304, headers=not_modified)
+    
+    # Stream the body through instead of buffering it (uploads can be large);
+    # the original Content-Length is kept so the upstream sees a fixed-length body
+    has_body = has_request_body(original_request)
+    body = stream_request_body(original_request) if has_body else None
     
     # Get query parameters
     params = dict(original_request.query_params)
     
     try:
         # Create a client request
-        req = http_client.build_request(
+        req = upstream.client.build_request(
             method=original_request.method,
             url=target_url,
             headers=headers,
@@ -398,25 +442,36 @@ async def forward_request(service_name: str, path: str, original_request: Reques
             content=body
         )
         
-        # Send the request and stream the response
-        r = await http_client.send(req, stream=True)
+        # Send the request and stream the response; only idempotent requests
+        # without a body (which can't be replayed) are retried
+        r = await upstream.send(req, stream=True, retry=original_request.method in IDEMPOTENT_METHODS and not has_body)
         
         # Check if the response is a file download or binary content
         content_type = r.headers.get("content-type", "")
         
+        if original_request.method == "GET" and r.status_code in (200, 304):
+            conditional_cache.remember(identity, cache_url, r.headers)
+        
         # Filter headers to avoid duplicates and issues
         excluded_headers = {
             "content-encoding", "content-length", "transfer-encoding", 
-            "connection", "date", "server", "host", "access-control-allow-origin", "access-control-expose-headers"
+            "connection", "date", "server", "host", "access-control-allow-origin", "access-control-expose-headers",
+            VERSION_KEY_HEADER, VERSION_HEADER
         }
         filtered_headers = {
             k: v for k, v in r.headers.items() 
             if k.lower() not in excluded_headers
         }
+        # Unencoded bodies are passed through byte for byte, so their length
+        # still holds; downloads and range responses need it
+        if "content-length" in r.headers and "content-encoding" not in r.headers:
+            filtered_headers["Content-Length"] = r.headers["content-length"]
         
         # Explicitly add CORS headers
         filtered_headers["Access-Control-Allow-Origin"] = "*"
-        filtered_headers["Access-Control-Expose-Headers"] = "Content-Disposition"
+        filtered_headers["Access-Control-Expose-Headers"] = (
+            "Content-Disposition, X-Next-Cursor, Content-Length, Content-Range, Accept-Ranges"
+        )
 
         from fastapi.responses import StreamingResponse
         from starlette.background import BackgroundTask
@@ -429,6 +484,13 @@ async def forward_request(service_name: str, path: str, original_request: Reques
             background=BackgroundTask(r.aclose)
         )
 
+    except CircuitOpenError as e:
+        logger.warning(f"Not forwarding to {target_url}: circuit for {service_name} is open")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service {service_name} unavailable",
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
     except httpx.RequestError as e:
         logger.error(f"Request to {target_url} failed: {e}")
         raise HTTPException(status_code=502, detail=f"Service {service_name} unavailable")
@@ -436,10 +498,16 @@ async def forward_request(service_name: str, path: str, original_request: Reques
         logger.error(f"Unexpected error forwarding to {target_url}: {e}")
         raise HTTPException(status_code=500, detail="Gateway error")
 
+@app.on_event("startup")
+async def startup_event():
+    metrics_buffer.start()
+
 # Graceful shutdown
 @app.on_event("shutdown")
 async def shutdown_event():
-    await http_client.aclose()
+    await metrics_buffer.stop()
+    for upstream in upstreams.values():
+        await upstream.client.aclose()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,170 @@
+import os
+import math
+import asyncio
+import logging
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))  # Seconds
+METRICS_FLUSH_SIZE = int(os.getenv("METRICS_FLUSH_SIZE", "1000"))  # Requests per window
+METRICS_MAX_ROUTES = int(os.getenv("METRICS_MAX_ROUTES", "500"))  # Distinct routes per window
+METRICS_MAX_PENDING = int(os.getenv("METRICS_MAX_PENDING", "60"))  # Unsent windows kept while analytics is down
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000]
+
+# Log-spaced latency sketch for percentiles (2% relative accuracy). Must match
+# the sketch parameters in analytics-service rollups.py.
+LATENCY_SKETCH_ACCURACY = 0.02
+LATENCY_SKETCH_GAMMA = (1 + LATENCY_SKETCH_ACCURACY) / (1 - LATENCY_SKETCH_ACCURACY)
+LATENCY_SKETCH_MIN_MS = 0.1
+LATENCY_SKETCH_MAX_MS = 3600000.0
+LATENCY_SKETCH_SIZE = int(math.ceil(math.log(LATENCY_SKETCH_MAX_MS / LATENCY_SKETCH_MIN_MS, LATENCY_SKETCH_GAMMA))) + 1
+
+def sketch_index(duration_ms: float) -> int:
+    if duration_ms <= LATENCY_SKETCH_MIN_MS:
+        return 0
+    return min(LATENCY_SKETCH_SIZE - 1, int(math.ceil(math.log(duration_ms / LATENCY_SKETCH_MIN_MS, LATENCY_SKETCH_GAMMA))))
+
+class RouteStats:
+    """Request count, latency sum/min/max, latency histogram and sparse latency sketch for one route."""
+
+    __slots__ = ("count", "success_count", "total_ms", "min_ms", "max_ms", "buckets", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.success_count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.sketch: Dict[int, int] = {}
+
+    def add(self, duration_ms: float, success: bool):
+        self.count += 1
+        self.success_count += success
+        self.total_ms += duration_ms
+        self.min_ms = duration_ms if self.min_ms is None else min(self.min_ms, duration_ms)
+        self.max_ms = duration_ms if self.max_ms is None else max(self.max_ms, duration_ms)
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, duration_ms)] += 1
+        index = sketch_index(duration_ms)
+        self.sketch[index] = self.sketch.get(index, 0) + 1
+
+    def to_dict(self, metric_type: str) -> Dict[str, Any]:
+        return {
+            "metric_type": metric_type,
+            "count": self.count,
+            "success_count": self.success_count,
+            "total_ms": round(self.total_ms, 3),
+            "min_ms": round(self.min_ms, 3),
+            "max_ms": round(self.max_ms, 3),
+            "buckets": self.buckets,
+            "sketch": {str(index): count for index, count in self.sketch.items()},
+        }
+
+class MetricsBuffer:
+    """
+    Aggregates per-route request metrics in memory and ships them in batches.
+
+    Requests are folded into the current window (one RouteStats per route), so
+    memory depends on the number of routes, not on traffic. A window is closed
+    every `flush_interval` seconds or after `flush_size` requests and sent as
+    one call to `send`. Windows that fail to send are retried on the next
+    flush; at most `max_pending` are kept, dropping the oldest first.
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], Awaitable[None]],
+                 flush_interval: float = METRICS_FLUSH_INTERVAL, flush_size: int = METRICS_FLUSH_SIZE,
+                 max_routes: int = METRICS_MAX_ROUTES, max_pending: int = METRICS_MAX_PENDING):
+        self.send = send
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_routes = max_routes
+        self.pending: deque = deque(maxlen=max_pending)
+        self.dropped_windows = 0
+        self.sent_windows = 0
+        self._routes: Dict[str, RouteStats] = {}
+        self._window_count = 0
+        self._window_start = datetime.utcnow()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, method: str, route: str, duration_ms: float, status_code: int):
+        key = f"{method} {route}"
+        stats = self._routes.get(key)
+        if stats is None:
+            if len(self._routes) >= self.max_routes:
+                key = f"{method} (other)"
+                stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats()
+        stats.add(duration_ms, status_code < 400)
+        self._window_count += 1
+
+        if self._window_count >= self.flush_size and not self._flush_lock.locked():
+            asyncio.create_task(self.flush())
+
+    def _close_window(self):
+        """Move the current window to the pending queue and start a new one."""
+        if not self._routes:
+            return
+        now = datetime.utcnow()
+        window = {
+            "window_start": self._window_start.isoformat(),
+            "window_end": now.isoformat(),
+            "bucket_bounds_ms": LATENCY_BUCKETS_MS,
+            "routes": [stats.to_dict(key) for key, stats in self._routes.items()],
+        }
+        if len(self.pending) == self.pending.maxlen:
+            self.dropped_windows += 1
+            logger.warning(f"Metrics buffer full, dropping oldest window ({self.dropped_windows} dropped so far)")
+        self.pending.append(window)
+        self._routes = {}
+        self._window_count = 0
+        self._window_start = now
+
+    async def flush(self):
+        async with self._flush_lock:
+            self._close_window()
+            if not self.pending:
+                return
+            batch = list(self.pending)
+            try:
+                await self.send({"source": "gateway", "windows": batch})
+            except Exception as e:
+                logger.debug(f"Metrics flush failed, keeping {len(batch)} windows: {e}")
+                return
+            # Only flush() closes windows, and it holds the lock, so nothing was added meanwhile
+            self.pending.clear()
+            self.sent_windows += len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Metrics flush loop error: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes_in_window": len(self._routes),
+            "requests_in_window": self._window_count,
+            "pending_windows": len(self.pending),
+            "sent_windows": self.sent_windows,
+            "dropped_windows": self.dropped_windows,
+        }
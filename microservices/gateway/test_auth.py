@@ -0,0 +1,51 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from jose import jwt
+
+# Add the current directory to the path so we can import auth
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from auth import JWT_ALGORITHM, JWT_SECRET, InvalidTokenError, TokenVerifier
+
+class FakeRedis:
+    def __init__(self, values):
+        self.values = values
+
+    async def mget(self, keys):
+        return [self.values.get(key) for key in keys]
+
+def make_token(issued_at: float, **claims) -> str:
+    payload = {"sub": "user@example.com", "exp": int(issued_at) + 900, "iat": int(issued_at), **claims}
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def verifier_revoked_at(revoked_at: float) -> TokenVerifier:
+    verifier = TokenVerifier()
+    verifier.redis = FakeRedis({"revoked_user:user@example.com": str(revoked_at)})
+    return verifier
+
+def test_token_issued_in_the_same_second_after_revocation_is_valid():
+    revoked_at = int(time.time()) + 0.25
+    issued_at = revoked_at + 0.5  # Same whole second as the revocation
+    token = make_token(issued_at, iat_ms=int(issued_at * 1000))
+
+    claims = asyncio.run(verifier_revoked_at(revoked_at).verify(token))
+    assert claims["sub"] == "user@example.com"
+
+def test_token_issued_before_revocation_is_rejected():
+    revoked_at = int(time.time()) + 0.75
+    issued_at = revoked_at - 0.5
+    token = make_token(issued_at, iat_ms=int(issued_at * 1000))
+
+    with pytest.raises(InvalidTokenError):
+        asyncio.run(verifier_revoked_at(revoked_at).verify(token))
+
+def test_token_without_iat_ms_falls_back_to_iat():
+    revoked_at = int(time.time()) + 0.5
+    token = make_token(revoked_at)  # iat is the revocation's whole second, so it predates it
+
+    with pytest.raises(InvalidTokenError):
+        asyncio.run(verifier_revoked_at(revoked_at).verify(token))
@@ -0,0 +1,60 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+# Add the current directory to the path so we can import upstreams
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from upstreams import CircuitBreaker, CircuitOpenError, Upstream
+
+def half_open_upstream() -> Upstream:
+    """An upstream whose breaker has opened and whose reset timeout has elapsed"""
+    upstream = Upstream("test", "http://upstream.test")
+    upstream.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    upstream.breaker.record_failure()
+    return upstream
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_trial_success_closes_breaker():
+    upstream = half_open_upstream()
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+
+    response = run(upstream.send(httpx.Request("GET", "http://upstream.test/")))
+    assert response.status_code == 200
+    assert upstream.breaker.state == "closed"
+
+def test_cancelled_trial_releases_breaker():
+    """A trial request that is cancelled must not leave the breaker stuck half-open"""
+    upstream = half_open_upstream()
+
+    async def hang(request):
+        await asyncio.sleep(60)
+
+    upstream.client = httpx.AsyncClient(transport=httpx.MockTransport(hang))
+
+    async def cancel_trial():
+        task = asyncio.create_task(upstream.send(httpx.Request("GET", "http://upstream.test/")))
+        await asyncio.sleep(0.05)
+        assert upstream.breaker.trial_in_flight
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    run(cancel_trial())
+    assert not upstream.breaker.trial_in_flight
+    assert upstream.breaker.state == "open"
+    # Once the reset timeout has passed the next trial goes through again
+    assert upstream.breaker.allow()
+
+def test_open_breaker_fails_fast():
+    upstream = Upstream("test", "http://upstream.test")
+    upstream.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    upstream.breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        run(upstream.send(httpx.Request("GET", "http://upstream.test/")))
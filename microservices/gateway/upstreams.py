@@ -0,0 +1,182 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))  # Extra attempts for idempotent requests
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.1"))  # Seconds
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "2.0"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))  # Seconds open before a trial request
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", "10"))  # Seconds
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+
+# Statuses that mean the upstream itself is unavailable (not an application error)
+UNAVAILABLE_STATUSES = {502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"Circuit open for {service}")
+        self.service = service
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` failures in a row the circuit opens and calls
+    fail fast for `reset_timeout` seconds. Then one trial call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.retry_after() > 0:
+            return False
+        # Reset timeout elapsed: let a single trial request through
+        if self.trial_in_flight:
+            return False
+        self.state = "half_open"
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """
+        A call ended without reporting a result (e.g. it was cancelled). A
+        half-open trial counts as failed so the breaker can't stay half-open
+        with a trial that will never finish.
+        """
+        if self.state == "half_open" and self.trial_in_flight:
+            self.record_failure()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1) if self.state == "open" else 0,
+        }
+
+def _service_setting(service: str, name: str, default: str) -> str:
+    """Per-service override (e.g. LLM_UPSTREAM_TIMEOUT), falling back to UPSTREAM_<NAME>."""
+    return os.getenv(f"{service.upper()}_UPSTREAM_{name}", os.getenv(f"UPSTREAM_{name}", default))
+
+class Upstream:
+    """One backend service: its own connection pool, timeouts and circuit breaker."""
+
+    def __init__(self, name: str, base_url: str):
+        self.name = name
+        self.base_url = base_url
+        timeout = float(_service_setting(name, "TIMEOUT", "30"))
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=float(_service_setting(name, "CONNECT_TIMEOUT", "5"))),
+            limits=httpx.Limits(
+                max_connections=int(_service_setting(name, "MAX_CONNECTIONS", "50")),
+                max_keepalive_connections=int(_service_setting(name, "MAX_KEEPALIVE", "10")),
+            ),
+        )
+        self.breaker = CircuitBreaker()
+
+    async def send(self, request: httpx.Request, stream: bool = False, retry: bool = False) -> httpx.Response:
+        """
+        Send a request through the breaker. With retry=True (idempotent requests
+        without a body) connection errors and 502/503/504 are retried with
+        full-jitter exponential backoff.
+        """
+        attempts = 1 + (UPSTREAM_RETRIES if retry else 0)
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(self.name, self.breaker.retry_after())
+            try:
+                response = await self.client.send(request, stream=stream)
+            except (httpx.TransportError, httpx.TimeoutException) as e:
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+                logger.warning(f"{self.name} request failed ({e!r}), retrying")
+            except BaseException:
+                # Cancelled (client went away) or an unexpected error: no result to record
+                self.breaker.release_trial()
+                raise
+            else:
+                if response.status_code not in UNAVAILABLE_STATUSES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    return response
+                await response.aclose()
+                logger.warning(f"{self.name} returned {response.status_code}, retrying")
+            delay = min(UPSTREAM_RETRY_MAX_DELAY, UPSTREAM_RETRY_BASE_DELAY * (2 ** attempt))
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def probe(self) -> Dict[str, Any]:
+        """Hit the service's /health endpoint (outside the breaker)."""
+        started = time.perf_counter()
+        try:
+            response = await self.client.get(f"{self.base_url}/health", timeout=HEALTH_PROBE_TIMEOUT)
+            status = "available" if response.status_code == 200 else "unhealthy"
+        except Exception as e:
+            logger.error(f"Could not reach {self.name} at {self.base_url}: {e}")
+            status = "unavailable"
+        return {
+            "status": status,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "circuit": self.breaker.to_dict(),
+        }
+
+class HealthCache:
+    """Probes all upstreams concurrently and serves the result for HEALTH_CACHE_TTL seconds."""
+
+    def __init__(self, upstreams: Dict[str, Upstream], ttl: float = HEALTH_CACHE_TTL):
+        self.upstreams = upstreams
+        self.ttl = ttl
+        self._result: Optional[Dict[str, Any]] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> Dict[str, Any]:
+        if self._result is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._result
+        # Concurrent callers share one probe round instead of each probing
+        async with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.ttl:
+                names = list(self.upstreams)
+                results = await asyncio.gather(*(self.upstreams[n].probe() for n in names))
+                self._result = dict(zip(names, results))
+                self._checked_at = time.monotonic()
+        return self._result
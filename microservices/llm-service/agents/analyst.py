@@ -1,14 +1,21 @@
+import os
+import hashlib
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 
 logger = logging.getLogger(__name__)
 
+# How many table summaries run against the LLM at once
+TABLE_SUMMARY_CONCURRENCY = int(os.getenv("TABLE_SUMMARY_CONCURRENCY", "4"))
+TABLE_SUMMARY_CACHE_TTL = int(os.getenv("TABLE_SUMMARY_CACHE_TTL", str(30 * 86400)))  # Seconds
+
 class FinancialAnalystAgent:
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, model_name: str = "unknown"):
         self.llm_client = llm_client
-        
+        self.model_name = model_name
+
         # Define the prompt for table summarization
         self.prompt = PromptTemplate(
             input_variables=["table_content", "section_name", "ticker", "fiscal_year"],
@@ -33,25 +40,92 @@ class FinancialAnalystAgent:
             """
         )
 
+        # We need to access the underlying LangChain LLM object from the client
+        # Assuming llm_client has a 'client' attribute which is the LangChain LLM
+        # The chain is built once and reused for every table
+        self.chain = LLMChain(llm=self.llm_client.client, prompt=self.prompt)
+
+        # Summaries are cached in Redis by table content hash, in memory if Redis is down
+        redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+        try:
+            import redis
+            self.kv_store = redis.from_url(redis_url)
+            self.kv_store.ping()
+        except Exception as e:
+            logger.warning(f"Redis not available for table summary cache, using memory: {e}")
+            self.kv_store = None
+        self._memory_cache: Dict[str, str] = {}
+
+    def _cache_key(self, table_content: str) -> str:
+        digest = hashlib.sha256(f"{self.model_name}\x00{table_content}".encode("utf-8")).hexdigest()
+        return f"table_summary:{digest}"
+
+    def _cache_get(self, key: str):
+        if self.kv_store:
+            try:
+                value = self.kv_store.get(key)
+                return value.decode("utf-8") if value is not None else None
+            except Exception as e:
+                logger.warning(f"Table summary cache lookup failed: {e}")
+        return self._memory_cache.get(key)
+
+    def _cache_set(self, key: str, summary: str):
+        if self.kv_store:
+            try:
+                self.kv_store.setex(key, TABLE_SUMMARY_CACHE_TTL, summary)
+                return
+            except Exception as e:
+                logger.warning(f"Table summary cache update failed: {e}")
+        self._memory_cache[key] = summary
+
+    def _inputs(self, table_content: str, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "table_content": table_content,
+            "section_name": metadata.get("section_name", "Unknown"),
+            "ticker": metadata.get("ticker", "Unknown"),
+            "fiscal_year": metadata.get("fiscal_year", "Unknown")
+        }
+
     def summarize_table(self, table_content: str, metadata: Dict[str, Any]) -> str:
         """
         Summarizes a financial table or section.
         """
-        try:
-            # We need to access the underlying LangChain LLM object from the client
-            # Assuming llm_client has a 'client' attribute which is the LangChain LLM
-            llm = self.llm_client.client
-            
-            chain = LLMChain(llm=llm, prompt=self.prompt)
-            
-            summary = chain.run({
-                "table_content": table_content,
-                "section_name": metadata.get("section_name", "Unknown"),
-                "ticker": metadata.get("ticker", "Unknown"),
-                "fiscal_year": metadata.get("fiscal_year", "Unknown")
-            })
-            
-            return summary.strip()
-        except Exception as e:
-            logger.error(f"Error summarizing table: {e}")
-            return "Error generating summary."
+        summaries = self.summarize_tables([{"id": "table", "content": table_content, **metadata}])
+        return summaries.get("table", "Error generating summary.")
+
+    def summarize_tables(self, tables: List[Dict[str, Any]]) -> Dict[str, str]:
+        """
+        Summarizes many tables, keyed by table id.
+
+        Cached summaries are reused; the rest go through the shared chain with at
+        most TABLE_SUMMARY_CONCURRENCY calls in flight. Tables that fail are left
+        out of the result rather than cached as errors.
+        """
+        summaries = {}
+        pending = []
+        for table in tables:
+            key = self._cache_key(table["content"])
+            cached = self._cache_get(key)
+            if cached is not None:
+                summaries[table["id"]] = cached
+            else:
+                pending.append((table, key))
+
+        logger.info(f"Table summaries: {len(summaries)} cached, {len(pending)} to generate")
+        if not pending:
+            return summaries
+
+        results = self.chain.batch(
+            [self._inputs(table["content"], table) for table, _ in pending],
+            config={"max_concurrency": TABLE_SUMMARY_CONCURRENCY},
+            return_exceptions=True
+        )
+        for (table, key), result in zip(pending, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error summarizing table {table['id']}: {result}")
+                continue
+            summary = (result.get("text", "") if isinstance(result, dict) else str(result)).strip()
+            if summary:
+                summaries[table["id"]] = summary
+                self._cache_set(key, summary)
+        return summaries
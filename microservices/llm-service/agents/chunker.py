@@ -77,6 +77,10 @@ class ParentChildSplitter:
                     "parent_id": parent_id,
                     "chunk_index": i,
                     "section_name": section['title'],
+                    "section_key": section.get('key'),
+                    "item": section.get('item'),
+                    "form_type": structured_doc.get('form_type'),
+                    "page": section.get('start_page'),
                     "ticker": structured_doc.get('ticker', 'UNKNOWN'),
                     "fiscal_year": structured_doc.get('fiscal_year', 'UNKNOWN'),
                     "source_filename": structured_doc.get('filename', 'unknown'),
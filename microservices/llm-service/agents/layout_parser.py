@@ -1,7 +1,10 @@
 import os
+import re
 import logging
+from collections import Counter
 from typing import Dict, List, Any, Optional
-from langchain_community.document_loaders import PyMuPDFLoader
+
+from agents.sections import ITEM_HEADING_PATTERN, PART_HEADING_PATTERN, TOC_ENTRY_PATTERN, resolve_item
 
 logger = logging.getLogger(__name__)
 
@@ -36,31 +39,34 @@ class LayoutParserAgent:
 
     def _parse_with_pymupdf(self, file_path: str) -> Dict[str, Any]:
         """
-        Fallback parser using PyMuPDF.
-        Attempts to identify sections based on simple heuristics (font size, bold text - hard with just PyMuPDFLoader).
-        For this MVP, we will treat pages as sections if no better structure is found,
-        but we will try to group them.
+        Parser using PyMuPDF span data.
+        Detects 10-K/10-Q "Item" headings from heading patterns plus font size and
+        weight, and returns one section per item. Documents without recognisable
+        items fall back to grouping every 5 pages into a section.
         """
+        import fitz
+
         logger.info(f"Parsing {file_path} with PyMuPDF")
-        loader = PyMuPDFLoader(file_path)
-        pages = loader.load()
-        
-        sections = []
-        current_section = {"title": "Introduction", "content": ""}
-        
-        # Simple heuristic: Group every 5 pages into a "section" to simulate parent blocks
-        # In a real implementation, we would use layout analysis to find "Item 1.", "Item 7.", etc.
-        pages_per_section = 5
-        
-        for i, page in enumerate(pages):
-            if i > 0 and i % pages_per_section == 0:
-                sections.append(current_section)
-                current_section = {"title": f"Section {i // pages_per_section + 1}", "content": ""}
-            
-            current_section["content"] += page.page_content + "\n\n"
-            
-        sections.append(current_section)
-        
+        with fitz.open(file_path) as pdf:
+            page_count = len(pdf)
+            lines = self._extract_lines(pdf)
+            tables = self._extract_tables(pdf)
+
+        form_type = self._detect_form_type(lines)
+        sections = self._split_into_item_sections(lines, form_type)
+        if sections:
+            logger.info(f"Detected {len(sections)} {form_type} sections: {[s['item'] for s in sections if s.get('item')]}")
+        else:
+            logger.info("No 10-K/10-Q item headings found, grouping pages into sections")
+            sections = self._group_pages(lines, page_count)
+
+        # Tag each table with the section its page falls in
+        for table in tables:
+            section = next((s for s in sections if s["start_page"] and s["start_page"] <= table["page"] <= s["end_page"]), None)
+            table["section_name"] = section["title"] if section else "Unknown"
+            table["section_key"] = section["key"] if section else None
+            table["item"] = section["item"] if section else None
+
         # Extract basic metadata
         filename = os.path.basename(file_path)
         ticker = "UNKNOWN"
@@ -76,6 +82,157 @@ class LayoutParserAgent:
             "filename": filename,
             "ticker": ticker,
             "fiscal_year": year,
+            "form_type": form_type,
             "sections": sections,
-            "page_count": len(pages)
+            "tables": tables,
+            "page_count": page_count
         }
+
+    def _extract_lines(self, pdf) -> List[Dict[str, Any]]:
+        """Text lines with their page, largest font size and whether every span is bold."""
+        lines = []
+        for page_number, page in enumerate(pdf, start=1):
+            for block in page.get_text("dict")["blocks"]:
+                if block.get("type") != 0:  # Skip image blocks
+                    continue
+                for line in block["lines"]:
+                    spans = [span for span in line["spans"] if span["text"].strip()]
+                    if not spans:
+                        continue
+                    lines.append({
+                        "text": "".join(span["text"] for span in line["spans"]).strip(),
+                        "size": max(span["size"] for span in spans),
+                        # Flag bit 4 is bold; some PDFs only encode it in the font name
+                        "bold": all(span["flags"] & 16 or "bold" in span["font"].lower() for span in spans),
+                        "page": page_number,
+                        "chars": sum(len(span["text"]) for span in spans)
+                    })
+        return lines
+
+    def _extract_tables(self, pdf) -> List[Dict[str, Any]]:
+        """Tables found by PyMuPDF, rendered as pipe-separated rows."""
+        tables = []
+        for page_number, page in enumerate(pdf, start=1):
+            try:
+                found = page.find_tables()
+            except Exception as e:
+                logger.warning(f"Table detection failed on page {page_number}: {e}")
+                continue
+            for index, table in enumerate(found.tables):
+                rows = [[(cell or "").replace("\n", " ").strip() for cell in row] for row in table.extract()]
+                rows = [row for row in rows if any(row)]
+                # A single row or column is a layout artefact, not a financial table
+                if len(rows) < 2 or max(len(row) for row in rows) < 2:
+                    continue
+                tables.append({
+                    "id": f"p{page_number}_t{index}",
+                    "page": page_number,
+                    "content": "\n".join(" | ".join(row) for row in rows)
+                })
+        logger.info(f"Extracted {len(tables)} tables")
+        return tables
+
+    def _detect_form_type(self, lines: List[Dict[str, Any]]) -> str:
+        cover = " ".join(line["text"] for line in lines if line["page"] <= 3).upper()
+        if re.search(r"FORM\s+10-?Q", cover):
+            return "10-Q"
+        return "10-K"
+
+    def _body_font_size(self, lines: List[Dict[str, Any]]) -> float:
+        """The font size carrying the most characters."""
+        sizes = Counter()
+        for line in lines:
+            sizes[round(line["size"], 1)] += line["chars"]
+        return sizes.most_common(1)[0][0] if sizes else 0.0
+
+    def _is_heading_style(self, line: Dict[str, Any], body_size: float) -> bool:
+        letters = [c for c in line["text"] if c.isalpha()]
+        is_upper = bool(letters) and all(c.isupper() for c in letters)
+        return line["bold"] or line["size"] >= body_size + 0.5 or is_upper
+
+    def _split_into_item_sections(self, lines: List[Dict[str, Any]], form_type: str) -> List[Dict[str, Any]]:
+        body_size = self._body_font_size(lines)
+
+        # Find item headings; unstyled standalone lines only count if no styled ones exist
+        candidates = []
+        current_part = None
+        for index, line in enumerate(lines):
+            text = line["text"]
+            if len(text) > 150:
+                continue
+            part_match = PART_HEADING_PATTERN.match(text)
+            if part_match and not TOC_ENTRY_PATTERN.search(part_match.group(2)):
+                current_part = part_match.group(1).upper()
+                continue
+            item_match = ITEM_HEADING_PATTERN.match(text)
+            if not item_match or TOC_ENTRY_PATTERN.search(" " + item_match.group(2)):
+                continue
+            candidates.append({
+                "index": index,
+                "item": item_match.group(1).upper(),
+                "part": current_part,
+                "styled": self._is_heading_style(line, body_size)
+            })
+
+        headings = [c for c in candidates if c["styled"]] or [c for c in candidates if len(lines[c["index"]]["text"]) <= 100]
+        if not headings:
+            return []
+
+        sections = [self._make_section(lines, 0, headings[0]["index"], None, form_type)]
+        for position, heading in enumerate(headings):
+            end = headings[position + 1]["index"] if position + 1 < len(headings) else len(lines)
+            sections.append(self._make_section(lines, heading["index"], end, heading, form_type))
+
+        # An item seen more than once (table of contents, running headers) keeps its
+        # longest occurrence; the other occurrences are folded into the previous section
+        longest = {}
+        for section in sections:
+            key = section["key"]
+            if key not in longest or len(section["content"]) > len(longest[key]["content"]):
+                longest[key] = section
+
+        merged = []
+        for section in sections:
+            if longest[section["key"]] is section or not merged:
+                merged.append(section)
+            else:
+                merged[-1]["content"] += section["content"]
+                merged[-1]["end_page"] = section["end_page"]
+        return [s for s in merged if s["content"].strip()]
+
+    def _make_section(self, lines: List[Dict[str, Any]], start: int, end: int, heading: Optional[Dict[str, Any]], form_type: str) -> Dict[str, Any]:
+        chunk = lines[start:end]
+        if heading is None:
+            key, title, item, part = "cover", "Introduction", None, None
+        else:
+            key, canonical = resolve_item(form_type, heading["part"], heading["item"])
+            item, part = heading["item"], heading["part"]
+            title = f"Item {item}. {canonical}"
+        return {
+            "title": title,
+            "key": key,
+            "item": item,
+            "part": part,
+            "content": "\n".join(line["text"] for line in chunk) + "\n\n",
+            "start_page": chunk[0]["page"] if chunk else None,
+            "end_page": chunk[-1]["page"] if chunk else None
+        }
+
+    def _group_pages(self, lines: List[Dict[str, Any]], page_count: int) -> List[Dict[str, Any]]:
+        """Fallback: every 5 pages become a section, as parent blocks for non-SEC documents."""
+        pages_per_section = 5
+        sections = []
+        for first_page in range(1, page_count + 1, pages_per_section):
+            last_page = min(first_page + pages_per_section - 1, page_count)
+            text = "\n".join(line["text"] for line in lines if first_page <= line["page"] <= last_page)
+            number = (first_page - 1) // pages_per_section + 1
+            sections.append({
+                "title": "Introduction" if number == 1 else f"Section {number}",
+                "key": f"pages_{first_page}_{last_page}",
+                "item": None,
+                "part": None,
+                "content": text + "\n\n",
+                "start_page": first_page,
+                "end_page": last_page
+            })
+        return sections
@@ -0,0 +1,108 @@
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Canonical section keys for 10-K items
+FORM_10K_ITEMS: Dict[str, Tuple[str, str]] = {
+    "1": ("business", "Business"),
+    "1A": ("risk_factors", "Risk Factors"),
+    "1B": ("unresolved_staff_comments", "Unresolved Staff Comments"),
+    "1C": ("cybersecurity", "Cybersecurity"),
+    "2": ("properties", "Properties"),
+    "3": ("legal_proceedings", "Legal Proceedings"),
+    "4": ("mine_safety", "Mine Safety Disclosures"),
+    "5": ("market_for_equity", "Market for Registrant's Common Equity"),
+    "6": ("reserved", "[Reserved]"),
+    "7": ("mda", "Management's Discussion and Analysis"),
+    "7A": ("market_risk", "Quantitative and Qualitative Disclosures About Market Risk"),
+    "8": ("financial_statements", "Financial Statements and Supplementary Data"),
+    "9": ("accountant_changes", "Changes in and Disagreements with Accountants"),
+    "9A": ("controls", "Controls and Procedures"),
+    "9B": ("other_information", "Other Information"),
+    "9C": ("foreign_inspections", "Disclosure Regarding Foreign Jurisdictions that Prevent Inspections"),
+    "10": ("governance", "Directors, Executive Officers and Corporate Governance"),
+    "11": ("executive_compensation", "Executive Compensation"),
+    "12": ("security_ownership", "Security Ownership of Certain Beneficial Owners and Management"),
+    "13": ("relationships", "Certain Relationships and Related Transactions"),
+    "14": ("accountant_fees", "Principal Accountant Fees and Services"),
+    "15": ("exhibits", "Exhibits and Financial Statement Schedules"),
+    "16": ("form_summary", "Form 10-K Summary"),
+}
+
+# 10-Q item numbers repeat across Part I and Part II, so they are keyed by (part, item)
+FORM_10Q_ITEMS: Dict[Tuple[str, str], Tuple[str, str]] = {
+    ("I", "1"): ("financial_statements", "Financial Statements"),
+    ("I", "2"): ("mda", "Management's Discussion and Analysis"),
+    ("I", "3"): ("market_risk", "Quantitative and Qualitative Disclosures About Market Risk"),
+    ("I", "4"): ("controls", "Controls and Procedures"),
+    ("II", "1"): ("legal_proceedings", "Legal Proceedings"),
+    ("II", "1A"): ("risk_factors", "Risk Factors"),
+    ("II", "2"): ("equity_sales", "Unregistered Sales of Equity Securities and Use of Proceeds"),
+    ("II", "3"): ("defaults", "Defaults Upon Senior Securities"),
+    ("II", "4"): ("mine_safety", "Mine Safety Disclosures"),
+    ("II", "5"): ("other_information", "Other Information"),
+    ("II", "6"): ("exhibits", "Exhibits"),
+}
+
+ITEM_HEADING_PATTERN = re.compile(r"^\s*item\s+(\d{1,2}[a-c]?)\s*[\.:\-–—]?\s*(.*)$", re.IGNORECASE)
+PART_HEADING_PATTERN = re.compile(r"^\s*part\s+(iv|iii|ii|i)\b\.?\s*(.*)$", re.IGNORECASE)
+# Table-of-contents entries end in a page number, often after dot leaders
+TOC_ENTRY_PATTERN = re.compile(r"(\.{3,}|\s)\d{1,3}\s*$")
+
+def resolve_item(form_type: str, part: Optional[str], item: str) -> Tuple[str, str]:
+    """Map an item number to its (section_key, canonical title) for the form type."""
+    item = item.upper()
+    if form_type == "10-Q":
+        mapped = FORM_10Q_ITEMS.get((part or "I", item))
+        if mapped:
+            return mapped
+    mapped = FORM_10K_ITEMS.get(item)
+    if mapped and form_type != "10-Q":
+        return mapped
+    return f"item_{item.lower()}", f"Item {item}"
+
+# Query routing: phrases that point a question at particular sections
+SECTION_KEYWORDS: Dict[str, List[str]] = {
+    "risk_factors": ["risk factor", "risk", "uncertaint", "threat"],
+    "mda": ["management's discussion", "md&a", "results of operations", "liquidity", "capital resources",
+            "outlook", "guidance", "trend", "revenue", "sales", "margin", "operating income", "growth"],
+    "market_risk": ["market risk", "interest rate", "foreign currency", "exchange rate", "hedg", "commodity price"],
+    "financial_statements": ["balance sheet", "income statement", "cash flow", "statement of operations",
+                             "net income", "earnings per share", "eps", "total assets", "liabilities",
+                             "stockholders' equity", "shareholders' equity", "debt", "notes to", "revenue"],
+    "business": ["business model", "products", "competition", "competitor", "customers", "employees",
+                 "segment", "strategy", "what does the company do"],
+    "legal_proceedings": ["lawsuit", "litigation", "legal proceeding", "settlement", "regulatory action"],
+    "controls": ["internal control", "disclosure controls", "material weakness"],
+    "executive_compensation": ["executive compensation", "salary", "ceo pay", "bonus"],
+    "properties": ["properties", "facilities", "headquarters", "real estate"],
+    "cybersecurity": ["cybersecurity", "cyber", "data breach"],
+    "governance": ["board of directors", "directors", "governance"],
+}
+
+QUESTION_ITEM_PATTERN = re.compile(r"\bitem\s+(\d{1,2}[a-c]?)\b", re.IGNORECASE)
+
+def route_question(question: str, form_type: str = "10-K") -> List[str]:
+    """
+    Section keys a question is about, or an empty list to search the whole
+    document. An explicit "Item 7A" reference wins over keyword matches.
+    """
+    explicit = QUESTION_ITEM_PATTERN.findall(question)
+    if explicit:
+        keys = []
+        for item in explicit:
+            item = item.upper()
+            if form_type == "10-Q":
+                # 10-Q item numbers repeat across parts; accept either
+                keys.extend(v[0] for (_, i), v in FORM_10Q_ITEMS.items() if i == item)
+            elif item in FORM_10K_ITEMS:
+                keys.append(FORM_10K_ITEMS[item][0])
+        return sorted(set(keys))
+
+    text = question.lower()
+    # Phrases match at word starts, so "eps" doesn't match "steps"
+    keys = [key for key, phrases in SECTION_KEYWORDS.items()
+            if any(re.search(r"\b" + re.escape(p), text) for p in phrases)]
+    return sorted(keys)
@@ -0,0 +1,213 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Passive health: eject an endpoint after this many consecutive failures ...
+ENDPOINT_MAX_FAILURES = int(os.getenv("LLM_ENDPOINT_MAX_FAILURES", "3"))
+# ... for this many seconds (doubled on every re-ejection, capped at 10x)
+ENDPOINT_EJECT_SECONDS = float(os.getenv("LLM_ENDPOINT_EJECT_SECONDS", "30"))
+# Window for the requests-per-minute throughput figure
+THROUGHPUT_WINDOW_SECONDS = 60
+
+@dataclass
+class Endpoint:
+    url: str
+    outstanding: int = 0
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    ejections: int = 0
+    ejected_until: float = 0.0
+    total_latency: float = 0.0
+    ewma_latency: Optional[float] = None
+    recent: Deque[float] = field(default_factory=deque)
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+class EndpointPool:
+    """
+    Pool of model endpoints routed by least outstanding requests.
+
+    Health is tracked passively from real traffic: every tracked call records
+    its latency and outcome, and an endpoint that fails ENDPOINT_MAX_FAILURES
+    times in a row is ejected for a cool-down period. When every endpoint is
+    ejected the one that comes back soonest is used, so traffic never stops.
+    """
+
+    def __init__(self, name: str, urls: List[str]):
+        self.name = name
+        self._lock = threading.Lock()
+        self.endpoints: List[Endpoint] = []
+        self.set_endpoints(urls)
+
+    def set_endpoints(self, urls: List[str]):
+        """Replace the endpoint list, keeping stats for URLs that stay in the pool."""
+        with self._lock:
+            existing = {e.url: e for e in self.endpoints}
+            self.endpoints = [existing.get(u) or Endpoint(url=u) for u in _normalize(urls)]
+        logger.info(f"Endpoint pool '{self.name}' configured with {[e.url for e in self.endpoints]}")
+
+    @property
+    def primary_url(self) -> Optional[str]:
+        return self.endpoints[0].url if self.endpoints else None
+
+    def select(self) -> Endpoint:
+        """Pick the available endpoint with the fewest outstanding requests."""
+        now = time.time()
+        with self._lock:
+            if not self.endpoints:
+                raise RuntimeError(f"Endpoint pool '{self.name}' is empty")
+            candidates = [e for e in self.endpoints if e.is_available(now)]
+            if not candidates:
+                return min(self.endpoints, key=lambda e: e.ejected_until)
+            fewest = min(e.outstanding for e in candidates)
+            tied = [e for e in candidates if e.outstanding == fewest]
+            # Among equally loaded endpoints prefer the faster one, untried ones first
+            tied.sort(key=lambda e: e.ewma_latency if e.ewma_latency is not None else 0.0)
+            best = [e for e in tied if e.ewma_latency == tied[0].ewma_latency]
+            return random.choice(best)
+
+    def begin(self, endpoint: Endpoint):
+        with self._lock:
+            endpoint.outstanding += 1
+
+    def finish(self, endpoint: Endpoint, success: bool, latency: float):
+        now = time.time()
+        with self._lock:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.requests += 1
+            endpoint.total_latency += latency
+            endpoint.ewma_latency = latency if endpoint.ewma_latency is None else 0.8 * endpoint.ewma_latency + 0.2 * latency
+            endpoint.recent.append(now)
+            while endpoint.recent and now - endpoint.recent[0] > THROUGHPUT_WINDOW_SECONDS:
+                endpoint.recent.popleft()
+
+            if success:
+                endpoint.consecutive_failures = 0
+                return
+
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= ENDPOINT_MAX_FAILURES:
+                backoff = min(ENDPOINT_EJECT_SECONDS * (2 ** endpoint.ejections), ENDPOINT_EJECT_SECONDS * 10)
+                endpoint.ejected_until = now + backoff
+                endpoint.ejections += 1
+                endpoint.consecutive_failures = 0
+                logger.warning(f"Ejecting {self.name} endpoint {endpoint.url} for {backoff:.0f}s after repeated failures")
+
+    @contextmanager
+    def track(self, endpoint: Optional[Endpoint] = None) -> Iterator[Endpoint]:
+        """Count a call against an endpoint (selected if not given) and record its outcome."""
+        endpoint = endpoint or self.select()
+        self.begin(endpoint)
+        started = time.perf_counter()
+        success = False
+        try:
+            yield endpoint
+            success = True
+        finally:
+            self.finish(endpoint, success, time.perf_counter() - started)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            return [{
+                "url": e.url,
+                "outstanding": e.outstanding,
+                "requests": e.requests,
+                "failures": e.failures,
+                "ejected": not e.is_available(now),
+                "ejected_for_seconds": max(0.0, round(e.ejected_until - now, 1)),
+                "avg_latency_ms": round(1000 * e.total_latency / e.requests, 1) if e.requests else None,
+                "ewma_latency_ms": round(1000 * e.ewma_latency, 1) if e.ewma_latency is not None else None,
+                "requests_per_minute": len([t for t in e.recent if now - t <= THROUGHPUT_WINDOW_SECONDS])
+            } for e in self.endpoints]
+
+def _normalize(urls: List[str]) -> List[str]:
+    """Strip trailing slashes and drop empty and duplicate URLs, keeping order."""
+    return list(dict.fromkeys(u.rstrip('/') for u in urls if u))
+
+def _rebase(url: str, from_base: str, to_base: str) -> str:
+    """Move a request URL built against from_base onto to_base, keeping the API path."""
+    if url.startswith(from_base):
+        return to_base + url[len(from_base):]
+    return url
+
+def build_httpx_client(pool: EndpointPool, timeout: Optional[float] = None):
+    """
+    httpx client for OpenAI-compatible SDK clients (ChatOpenAI, OpenAIEmbeddings).
+
+    The SDK is configured with the pool's primary URL; the transport re-targets
+    every HTTP request to the least loaded endpoint, so routing and passive
+    health apply per call rather than per client.
+    """
+    import httpx
+
+    class PooledTransport(httpx.HTTPTransport):
+        def handle_request(self, request: httpx.Request) -> httpx.Response:
+            endpoint = pool.select()
+            request.url = httpx.URL(_rebase(str(request.url), pool.primary_url, endpoint.url))
+            # The Host header was fixed when the SDK built the request
+            request.headers["Host"] = request.url.netloc.decode("ascii")
+            pool.begin(endpoint)
+            started = time.perf_counter()
+            success = False
+            try:
+                response = super().handle_request(request)
+                success = response.status_code < 500
+                return response
+            finally:
+                pool.finish(endpoint, success, time.perf_counter() - started)
+
+    return httpx.Client(transport=PooledTransport(), timeout=timeout)
+
+def build_requests_session(pool: EndpointPool):
+    """requests.Session that routes through the pool, for the raw-HTTP embedding client."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PooledAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            endpoint = pool.select()
+            request.url = _rebase(request.url, pool.primary_url, endpoint.url)
+            pool.begin(endpoint)
+            started = time.perf_counter()
+            success = False
+            try:
+                response = super().send(request, **kwargs)
+                success = response.status_code < 500
+                return response
+            finally:
+                pool.finish(endpoint, success, time.perf_counter() - started)
+
+    session = requests.Session()
+    adapter = PooledAdapter()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+_pools: Dict[str, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+def get_endpoint_pool(name: str, urls: List[str]) -> EndpointPool:
+    """Shared pool per role ("chat", "embeddings"), resynced with the configured URLs."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = EndpointPool(name, urls)
+        elif [e.url for e in pool.endpoints] != _normalize(urls):
+            pool.set_endpoints(urls)
+        return pool
+
+def get_all_pool_stats() -> Dict[str, List[Dict[str, Any]]]:
+    with _pools_lock:
+        return {name: pool.stats() for name, pool in _pools.items()}
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_WORKERS = int(os.getenv("AGENTIC_PIPELINE_WORKERS", "2"))
+PIPELINE_CHECKPOINT_DIR = os.getenv("PIPELINE_CHECKPOINT_DIR", "/data/pipeline_jobs")
+
+@dataclass
+class PipelineStage:
+    name: str
+    label: str
+    func: Callable[["PipelineJob"], Optional[Dict[str, Any]]]
+    # Files (relative to the job directory) the stage leaves for later stages
+    artifacts: Tuple[str, ...] = ()
+
+@dataclass
+class PipelineJob:
+    job_id: str
+    workdir: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    status: str = "queued"  # queued, running, completed, failed
+    completed_stages: List[str] = field(default_factory=list)
+    stage_timings: Dict[str, float] = field(default_factory=dict)
+    outputs: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.workdir, name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+class PipelineJobRunner:
+    """
+    Runs multi-stage pipelines on a worker thread pool, off the event loop.
+
+    Every job has a directory under `checkpoint_dir` holding a `job.json`
+    manifest and the artifacts its stages produce. The manifest is rewritten
+    after each stage, so a retried or crash-interrupted job skips the stages
+    it already completed (as long as their artifacts are still on disk).
+
+    `on_step(job, label, duration)` is called with duration=None when a stage
+    starts and with the elapsed seconds when it finishes, like StageGraph.
+    """
+
+    def __init__(self, stages: List[PipelineStage], checkpoint_dir: str = PIPELINE_CHECKPOINT_DIR,
+                 max_workers: int = PIPELINE_WORKERS, on_step: Optional[Callable[[PipelineJob, str, Optional[float]], None]] = None):
+        self.stages = stages
+        self.checkpoint_dir = checkpoint_dir
+        self.on_step = on_step
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self._active: Dict[str, PipelineJob] = {}
+        self._lock = threading.Lock()
+
+    def _manifest_path(self, job_id: str) -> str:
+        return os.path.join(self.checkpoint_dir, job_id, "job.json")
+
+    def _save(self, job: PipelineJob):
+        job.updated_at = time.time()
+        path = self._manifest_path(job.job_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def _load(self, job_id: str) -> Optional[PipelineJob]:
+        try:
+            with open(self._manifest_path(job_id), "r") as f:
+                return PipelineJob(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable manifest for job {job_id}: {e}")
+            return None
+
+    def get(self, job_id: str) -> Optional[PipelineJob]:
+        with self._lock:
+            job = self._active.get(job_id)
+        return job or self._load(job_id)
+
+    def submit(self, job_id: str, params: Dict[str, Any]) -> PipelineJob:
+        """
+        Queue a job. An unfinished job with the same id resumes from its last
+        checkpoint; a completed one is started over.
+        """
+        with self._lock:
+            active = self._active.get(job_id)
+            if active and active.status in ("queued", "running"):
+                return active
+
+            job = self._load(job_id)
+            if job is None or job.status == "completed":
+                job = PipelineJob(job_id=job_id, workdir=os.path.join(self.checkpoint_dir, job_id))
+            job.params = params
+            job.status = "queued"
+            job.error = None
+            os.makedirs(job.workdir, exist_ok=True)
+            self._save(job)
+            self._active[job_id] = job
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def resume_incomplete(self) -> List[str]:
+        """Re-queue jobs left queued or running by a previous process."""
+        resumed = []
+        if not os.path.isdir(self.checkpoint_dir):
+            return resumed
+        for job_id in os.listdir(self.checkpoint_dir):
+            job = self._load(job_id)
+            if job and job.status in ("queued", "running"):
+                logger.info(f"Resuming pipeline job {job_id} after {job.completed_stages}")
+                self.submit(job_id, job.params)
+                resumed.append(job_id)
+        return resumed
+
+    def _notify(self, job: PipelineJob, label: str, duration: Optional[float]):
+        if not self.on_step:
+            return
+        try:
+            self.on_step(job, label, duration)
+        except Exception as e:
+            logger.warning(f"Step callback failed for job {job.job_id}: {e}")
+
+    def _first_pending_stage(self, job: PipelineJob) -> int:
+        """Index of the first stage to run: the first one not completed or whose artifacts are gone."""
+        for i, stage in enumerate(self.stages):
+            if stage.name not in job.completed_stages:
+                return i
+            if any(not os.path.exists(job.path(a)) for a in stage.artifacts):
+                logger.info(f"Job {job.job_id}: artifacts of '{stage.name}' are missing, re-running from there")
+                return i
+        return len(self.stages)
+
+    def _run(self, job: PipelineJob):
+        job.status = "running"
+        job.attempts += 1
+        start_index = self._first_pending_stage(job)
+        job.completed_stages = [s.name for s in self.stages[:start_index]]
+        self._save(job)
+        if start_index:
+            logger.info(f"Job {job.job_id}: resuming after '{self.stages[start_index - 1].name}'")
+
+        try:
+            for stage in self.stages[start_index:]:
+                self._notify(job, stage.label, None)
+                started = time.perf_counter()
+                outputs = stage.func(job)
+                elapsed = time.perf_counter() - started
+
+                if outputs:
+                    job.outputs.update(outputs)
+                job.stage_timings[stage.name] = round(elapsed, 3)
+                job.completed_stages.append(stage.name)
+                self._save(job)
+                logger.info(f"Job {job.job_id}: stage '{stage.name}' finished in {elapsed:.2f}s")
+                self._notify(job, stage.label, elapsed)
+
+            job.status = "completed"
+            self._save(job)
+            self._notify(job, "Completed", None)
+            logger.info(f"Job {job.job_id} completed, stage timings: {job.stage_timings}")
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+            self._save(job)
+            self._notify(job, "Failed", None)
+        finally:
+            with self._lock:
+                if self._active.get(job.job_id) is job:
+                    del self._active[job.job_id]
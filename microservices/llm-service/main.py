@@ -12,6 +12,11 @@ import logging
 import tempfile
 import requests
 
+from stage_graph import StageGraph
+from job_runner import PipelineJob, PipelineJobRunner, PipelineStage
+from response_cache import get_response_cache
+from endpoint_pool import get_endpoint_pool, get_all_pool_stats, build_httpx_client, build_requests_session
+
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -27,6 +32,8 @@ class LLMConfig(BaseModel):
     model: Optional[str] = None
     embedding_model: Optional[str] = None  # Model for embeddings (e.g., text-embedding-ada-002, or local equivalent)
     embedding_base_url: Optional[str] = None  # Base URL for embedding service if different from LLM
+    base_urls: Optional[List[str]] = None  # Additional chat endpoints load-balanced with base_url
+    embedding_base_urls: Optional[List[str]] = None  # Additional embedding endpoints load-balanced with embedding_base_url
     temperature: Optional[float] = 0.3
     max_tokens: Optional[int] = 2000
     timeout: Optional[int] = 300
@@ -50,6 +57,7 @@ class DocumentAnalysisRequest(BaseModel):
     document_type: str = "financial"
     document_id: Optional[int] = None
     callback_url: Optional[str] = None
+    bypass_cache: bool = False  # Skip the LLM response cache for this request
 
 class KeyFigure(BaseModel):
     name: str
@@ -62,11 +70,13 @@ class DocumentAnalysisResponse(BaseModel):
     key_figures: List[KeyFigure]
     vector_db_path: str
     token_usage: Optional[Union[Dict[str, Any], List[Dict[str, Any]]]] = None
+    stage_timings: Optional[Dict[str, float]] = None  # Seconds spent in each analysis stage
 
 class QuestionRequest(BaseModel):
     document_path: str
     question: str
     vector_db_path: Optional[str] = None
+    bypass_cache: bool = False  # Skip the LLM response cache for this request
 
 class SourceReference(BaseModel):
     page: Optional[int] = None
@@ -178,6 +188,8 @@ def load_config():
             "model": os.getenv("OPENAI_MODEL", "mistralai/magistral-small-2509"),
             "embedding_model": os.getenv("EMBEDDING_MODEL", "text-embedding-mxbai-embed-large-v1"),
             "embedding_base_url": os.getenv("EMBEDDING_BASE_URL", os.getenv("OPENAI_BASE_URL", "http://host.docker.internal:1234")),
+            "base_urls": [u.strip() for u in os.getenv("OPENAI_BASE_URLS", "").split(",") if u.strip()],
+            "embedding_base_urls": [u.strip() for u in os.getenv("EMBEDDING_BASE_URLS", "").split(",") if u.strip()],
             "temperature": float(os.getenv("LLM_TEMPERATURE", "0.3")),
             "max_tokens": int(os.getenv("LLM_MAX_TOKENS", "2000")),
             "timeout": int(os.getenv("LLM_TIMEOUT", "300"))
@@ -197,6 +209,15 @@ def save_config(config_data):
 # Configuration - load from persistent storage
 CURRENT_CONFIG = load_config()
 
+def get_chat_pool():
+    """Chat endpoint pool: base_url first, then any extra base_urls."""
+    return get_endpoint_pool("chat", [CURRENT_CONFIG["base_url"]] + (CURRENT_CONFIG.get("base_urls") or []))
+
+def get_embedding_pool(default_url: str = None):
+    """Embedding endpoint pool: embedding_base_url first, then any extra embedding_base_urls."""
+    primary = CURRENT_CONFIG.get("embedding_base_url") or default_url or CURRENT_CONFIG["base_url"]
+    return get_endpoint_pool("embeddings", [primary] + (CURRENT_CONFIG.get("embedding_base_urls") or []))
+
 def process_financial_document_mock(document_path: str) -> Dict[str, Any]:
     """Process a financial document using mock data."""
     # Simulate processing time
@@ -362,7 +383,7 @@ def answer_question_mock(document_path: str, question: str) -> Dict[str, Any]:
     }
 
 class MockLLMClient:
-    def analyze_document(self, document_path: str) -> Dict[str, Any]:
+    def analyze_document(self, document_path: str, document_id: int = None, callback_url: str = None) -> Dict[str, Any]:
         # If this is a MinIO object path, we may want to download it first for mock processing
         if '/' in document_path and len(document_path.split('/')[0]) == 36:  # UUID length
             # For mock processing, we just pass the path as is, but in a real implementation
@@ -377,7 +398,45 @@ class MockLLMClient:
             pass
         return answer_question_mock(document_path, question)
 
-def get_llm_client():
+def _post_step(callback_url: Optional[str], step_name: str, duration: Optional[float] = None):
+    """PATCH a processing step to the document-service callback; finished stages also report their duration."""
+    if not callback_url:
+        return
+    try:
+        headers = {}
+        if INTERNAL_API_KEY:
+            headers["X-Internal-API-Key"] = INTERNAL_API_KEY
+        payload = {"step": step_name}
+        if duration is not None:
+            payload["duration_seconds"] = round(duration, 3)
+        requests.patch(callback_url, json=payload, headers=headers, timeout=5)
+    except Exception as e:
+        print(f"Failed to update step: {e}")
+
+def section_retriever(vector_store, question: str, k: int = 4):
+    """
+    Retriever scoped to the filing sections a question is about (e.g. Item 1A
+    for "risk factors"). Indexes without section metadata, and questions that
+    don't route to a section present in the index, search the whole document.
+    """
+    from agents.sections import route_question
+
+    docs = list(getattr(vector_store.docstore, "_dict", {}).values())
+    if not docs or not docs[0].metadata.get("section_key"):
+        return vector_store.as_retriever(search_kwargs={"k": k})
+
+    available = {doc.metadata.get("section_key") for doc in docs}
+    keys = [key for key in route_question(question, docs[0].metadata.get("form_type") or "10-K") if key in available]
+    if not keys:
+        return vector_store.as_retriever(search_kwargs={"k": k})
+
+    logger.info(f"Routing question to sections {keys}")
+    # FAISS filters only after picking the fetch_k nearest chunks, so a bounded
+    # fetch_k can miss the routed section entirely; the flat index scores every
+    # vector anyway, so fetching all of them costs no extra search
+    return vector_store.as_retriever(search_kwargs={"k": k, "filter": {"section_key": keys}, "fetch_k": len(docs)})
+
+def get_llm_client(bypass_cache: bool = False):
     """Get appropriate LLM client based on current configuration."""
     mode = CURRENT_CONFIG["mode"]
     
@@ -386,14 +445,14 @@ def get_llm_client():
     elif mode in ["openai", "lmstudio"]:
         try:
             from openai import OpenAI
-            return OpenAILLMClient()
+            return OpenAILLMClient(bypass_cache=bypass_cache)
         except ImportError:
             logger.warning(f"OpenAI module not available, falling back to mock mode")
             return MockLLMClient()
     elif mode == "ollama":
         try:
             from langchain_community.llms import Ollama
-            return OllamaLLMClient()
+            return OllamaLLMClient(bypass_cache=bypass_cache)
         except ImportError:
             logger.warning(f"Ollama module not available, falling back to mock mode")
             return MockLLMClient()
@@ -402,21 +461,26 @@ def get_llm_client():
         return MockLLMClient()
 
 class OpenAILLMClient:
-    def __init__(self):
+    def __init__(self, bypass_cache: bool = False):
         from langchain_openai import ChatOpenAI
 
+        # Requests are routed across the chat endpoint pool by the http client
+        chat_pool = get_chat_pool()
         self.client = ChatOpenAI(
-            base_url=CURRENT_CONFIG["base_url"],
+            base_url=chat_pool.primary_url,
             api_key=CURRENT_CONFIG["api_key"],
             model=CURRENT_CONFIG["model"],
             temperature=CURRENT_CONFIG["temperature"],
             max_tokens=CURRENT_CONFIG["max_tokens"],
-            timeout=CURRENT_CONFIG["timeout"]
+            timeout=CURRENT_CONFIG["timeout"],
+            cache=get_response_cache(CURRENT_CONFIG["temperature"], bypass=bypass_cache),
+            http_client=build_httpx_client(chat_pool, timeout=CURRENT_CONFIG["timeout"])
         )
 
         # Initialize embedding client based on configuration
         embedding_model = CURRENT_CONFIG.get("embedding_model", "text-embedding-ada-002")
-        embedding_base_url = CURRENT_CONFIG.get("embedding_base_url", CURRENT_CONFIG["base_url"])
+        embedding_pool = get_embedding_pool()
+        embedding_base_url = embedding_pool.primary_url
         api_key = CURRENT_CONFIG["api_key"]
 
         # Determine which embedding class to use based on the service
@@ -427,10 +491,11 @@ class OpenAILLMClient:
             import requests
 
             class CustomLMStudioEmbeddings(Embeddings):
-                def __init__(self, base_url, api_key, model):
+                def __init__(self, base_url, api_key, model, session=None):
                     self.base_url = base_url
                     self.api_key = api_key
                     self.model = model
+                    self.session = session or requests.Session()
                     self.last_usage = {}
 
                 def embed_documents(self, texts: List[str]) -> List[List[float]]:
@@ -445,7 +510,7 @@ class OpenAILLMClient:
                         "input": texts,
                         "model": self.model
                     }
-                    response = requests.post(url, json=payload, headers=headers)
+                    response = self.session.post(url, json=payload, headers=headers)
                     response.raise_for_status()
                     data = response.json()
                     
@@ -477,7 +542,7 @@ class OpenAILLMClient:
                         "input": text,
                         "model": self.model
                     }
-                    response = requests.post(url, json=payload, headers=headers)
+                    response = self.session.post(url, json=payload, headers=headers)
                     response.raise_for_status()
                     data = response.json()
                     return data['data'][0]['embedding']
@@ -489,7 +554,8 @@ class OpenAILLMClient:
             self.embeddings = CustomLMStudioEmbeddings(
                 base_url=embedding_base_url.rstrip('/'), # Ensure no trailing slash for appending /embeddings
                 api_key=api_key or "lm-studio",
-                model=embedding_model
+                model=embedding_model,
+                session=build_requests_session(embedding_pool)
             )
         elif "ollama" in CURRENT_CONFIG["mode"].lower():
             # For Ollama, use Ollama embeddings if available
@@ -513,28 +579,21 @@ class OpenAILLMClient:
             self.embeddings = OpenAIEmbeddings(
                 openai_api_base=embedding_base_url,
                 openai_api_key=api_key,
-                model=embedding_model
+                model=embedding_model,
+                http_client=build_httpx_client(embedding_pool)
             )
     
     def analyze_document(self, document_path: str, document_id: int = None, callback_url: str = None) -> Dict[str, Any]:
         from langchain_community.document_loaders import PyMuPDFLoader
         from langchain.text_splitter import RecursiveCharacterTextSplitter
-        from langchain_openai import OpenAIEmbeddings
         from langchain_community.vectorstores import FAISS
+        from langchain_community.callbacks import get_openai_callback
 
         # Helper to update progress
-        def _update_step(step_name):
-            if callback_url:
-                try:
-                    import requests
-                    headers = {}
-                    if INTERNAL_API_KEY:
-                        headers["X-Internal-API-Key"] = INTERNAL_API_KEY
-                    requests.patch(callback_url, json={"step": step_name}, headers=headers, timeout=5)
-                except Exception as e:
-                    print(f"Failed to update step: {e}")
+        def _update_step(step_name, duration=None):
+            _post_step(callback_url, step_name, duration)
 
-        _update_step("Parsing the PDF into text")
+        logger.info(f"Analyzing {document_path}")
 
         # Determine if document_path is a local file or MinIO object
         if '/' in document_path and len(document_path.split('/')[0]) == 36:  # UUID length
@@ -546,15 +605,14 @@ class OpenAILLMClient:
             # This is a local file path
             temp_path = document_path
 
-        try:
-            # Load document
+        # Stage: parse the PDF once; both branches below only depend on this
+        def parse_stage(_):
             loader = PyMuPDFLoader(temp_path)
-            pages = loader.load()
+            return loader.load()
 
-             # Log for debugging to see what URL is actually used
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.info(f"Analyzing {document_path}")
+        # Branch 1 - summary (LLM call) followed by key figure extraction from its output
+        def summary_stage(inputs):
+            pages = inputs["parse"]
 
             # Combine all text (up to a reasonable limit to avoid context overflow)
             full_text = "\n\n".join([page.page_content for page in pages])
@@ -562,8 +620,6 @@ class OpenAILLMClient:
             if len(full_text) > max_chars:
                 full_text = full_text[:max_chars]
 
-            # Create a prompt for financial analysis
-            _update_step("Generating the Summary")
             prompt = f"""
             You are a seasoned Financial Analyst with over 15 years of experience specializing in 10-K and 10-Q filings. Your expertise lies in extracting critical financial intelligence and identifying subtle cues that inform investment decisions for both individual and institutional portfolios.
 
@@ -586,10 +642,6 @@ class OpenAILLMClient:
             {full_text}
             """
 
-            # Get analysis from LLM
-            from langchain_community.callbacks import get_openai_callback
-            token_usage = {}
-            
             try:
                 with get_openai_callback() as cb:
                     response = self.client.invoke(prompt)
@@ -606,28 +658,30 @@ class OpenAILLMClient:
                 analysis_text = response.content if hasattr(response, 'content') else str(response)
             except Exception as e:
                 logger.error(f"Error calling LLM for document analysis: {e}")
-                # Fall back to mock data if API call fails
-                return process_financial_document_mock(document_path)
+                # Signal the caller to fall back to mock data
+                return None
 
-            # Extract key figures (simplified parsing for now)
-            _update_step("Calculating the Key Figures")
-            
-            # In a real implementation, we would parse the LLM response for structured data
-            # For now, we'll try to extract JSON if present, otherwise use mock data
+            return {"analysis_text": analysis_text, "token_usage": token_usage}
+
+        def key_figures_stage(inputs):
+            summary = inputs["summary"]
+            if summary is None:
+                return None
+
+            analysis_text = summary["analysis_text"]
             key_figures = []
             try:
+                import re
                 if "---KEY_FIGURES_START---" in analysis_text:
                     parts = analysis_text.split("---KEY_FIGURES_START---")
                     analysis_text = parts[0].strip()
                     json_part = parts[1].strip()
-                    
-                    import re
+
                     json_match = re.search(r'\[.*\]', json_part, re.DOTALL)
                     if json_match:
                         key_figures = json.loads(json_match.group(0))
                 else:
                     # Fallback to regex search if delimiter is missing
-                    import re
                     json_match = re.search(r'\[.*\]', analysis_text, re.DOTALL)
                     if json_match:
                         key_figures = json.loads(json_match.group(0))
@@ -635,29 +689,32 @@ class OpenAILLMClient:
                         analysis_text = analysis_text.replace(json_match.group(0), "").strip()
             except:
                 pass
-                
+
             if not key_figures:
                 key_figures = [
                     {"name": "Revenue", "value": "Refer to summary", "source_page": 1},
                     {"name": "Net Income", "value": "Refer to summary", "source_page": 1},
                 ]
 
-            # Create vector database for Q&A
-            _update_step("Processing for the Q&A")
-            
+            return {"summary": analysis_text, "key_figures": key_figures}
+
+        # Branch 2 - chunking and vector indexing for Q&A, independent of the summary
+        def split_stage(inputs):
+            pages = inputs["parse"]
+
             # Combine all pages for vector DB to ensure cross-page context is preserved
             all_text = "\n\n".join([page.page_content for page in pages])
-            
+
             text_splitter = RecursiveCharacterTextSplitter(
                 chunk_size=1000,
                 chunk_overlap=100,
                 separators=["\n\n", "\n", ".", " ", ""]
             )
             # Create documents from the single merged text, preserving the source metadata
-            docs = text_splitter.create_documents([all_text], metadatas=[{"source": document_path}])
+            return text_splitter.create_documents([all_text], metadatas=[{"source": document_path}])
 
-            # Use the configured embeddings from init
-            embeddings = self.embeddings
+        def index_stage(inputs):
+            docs = inputs["split"]
 
             # Generate unique vector store path
             unique_id = str(uuid.uuid4())
@@ -668,16 +725,15 @@ class OpenAILLMClient:
                 filename = os.path.basename(document_path)
             vector_db_path = f"/data/vector_dbs/{unique_id}_{filename.replace('.pdf', '')}.faiss"
 
-            # Create and save vector store
             embedding_usage = {}
             try:
                 with get_openai_callback() as cb_embed:
-                    vector_store = FAISS.from_documents(docs, embeddings)
+                    vector_store = FAISS.from_documents(docs, self.embeddings)
                     vector_store.save_local(vector_db_path)
-                
+
                 # Try to get usage from custom embeddings class first
                 custom_usage = getattr(self.embeddings, "last_usage", {})
-                
+
                 if custom_usage:
                     embedding_usage = {
                         "total_tokens": custom_usage.get("total_tokens", 0),
@@ -697,27 +753,46 @@ class OpenAILLMClient:
                         "total_cost": cb_embed.total_cost,
                         "model_name": CURRENT_CONFIG.get("embedding_model", "text-embedding-mxbai-embed-large-v1")
                     }
-                
+
                 print(f"DEBUG: Embedding callback state: {cb_embed}")
                 print(f"DEBUG: Custom embedding usage: {custom_usage}")
             except Exception as e:
                 logger.error(f"Error creating vector store: {e}")
                 vector_db_path = ""  # Set to empty if vector store creation fails
 
+            return {"vector_db_path": vector_db_path, "embedding_usage": embedding_usage}
+
+        graph = StageGraph(on_step=_update_step)
+        graph.add("parse", parse_stage, label="Parsing the PDF into text")
+        graph.add("summary", summary_stage, depends_on=("parse",), label="Generating the Summary")
+        graph.add("key_figures", key_figures_stage, depends_on=("summary",), label="Calculating the Key Figures")
+        graph.add("split", split_stage, depends_on=("parse",))
+        graph.add("index", index_stage, depends_on=("split",), label="Processing for the Q&A")
+
+        try:
+            started = time.perf_counter()
+            results = graph.run()
+            logger.info(f"Analysis of {document_path} finished in {time.perf_counter() - started:.2f}s, stage timings: {graph.timings}")
+
+            if results["key_figures"] is None:
+                # Fall back to mock data if API call fails
+                return process_financial_document_mock(document_path)
+
             _update_step("Completed")
 
             # Combine usages into a list
             all_token_usages = []
-            if token_usage:
-                all_token_usages.append(token_usage)
-            if embedding_usage:
-                all_token_usages.append(embedding_usage)
+            if results["summary"]["token_usage"]:
+                all_token_usages.append(results["summary"]["token_usage"])
+            if results["index"]["embedding_usage"]:
+                all_token_usages.append(results["index"]["embedding_usage"])
 
             return {
-                "summary": analysis_text,
-                "key_figures": key_figures,
-                "vector_db_path": vector_db_path,
-                "token_usage": all_token_usages
+                "summary": results["key_figures"]["summary"],
+                "key_figures": results["key_figures"]["key_figures"],
+                "vector_db_path": results["index"]["vector_db_path"],
+                "token_usage": all_token_usages,
+                "stage_timings": graph.timings
             }
         finally:
             # Clean up temporary file if we created one
@@ -811,7 +886,7 @@ class OpenAILLMClient:
             qa = RetrievalQA.from_chain_type(
                 llm=self.client,
                 chain_type="stuff",
-                retriever=vector_store.as_retriever(),
+                retriever=section_retriever(vector_store, question),
                 chain_type_kwargs={"prompt": QA_CHAIN_PROMPT},
                 return_source_documents=True
             )
@@ -842,6 +917,7 @@ class OpenAILLMClient:
                 source_info = {
                     "source": doc.metadata.get("source", "unknown"),
                     "page": doc.metadata.get("page", 0),
+                    "section": doc.metadata.get("section_name"),
                     "snippet": doc.page_content[:200]
                 }
                 sources.append(source_info)
@@ -862,28 +938,39 @@ class OpenAILLMClient:
             }
 
 class OllamaLLMClient:
-    def __init__(self):
+    def __init__(self, bypass_cache: bool = False):
         from langchain_community.llms import Ollama
         from langchain_community.embeddings import OllamaEmbeddings
 
+        # The Ollama clients use plain requests calls, so the endpoint is picked
+        # once per client and each LLM/embedding call is tracked against it
+        self.chat_pool = get_chat_pool()
+        self.chat_endpoint = self.chat_pool.select()
         self.client = Ollama(
-            base_url=CURRENT_CONFIG.get("base_url", "http://host.docker.internal:11434"),
+            base_url=self.chat_endpoint.url,
             model=CURRENT_CONFIG["model"],
             temperature=CURRENT_CONFIG["temperature"],
             num_predict=CURRENT_CONFIG["max_tokens"],
+            cache=get_response_cache(CURRENT_CONFIG["temperature"], bypass=bypass_cache)
         )
 
         # Initialize Ollama embeddings
+        self.embedding_pool = get_embedding_pool("http://host.docker.internal:11434")
+        self.embedding_endpoint = self.embedding_pool.select()
         self.embeddings = OllamaEmbeddings(
-            base_url=CURRENT_CONFIG.get("embedding_base_url", "http://host.docker.internal:11434"),
+            base_url=self.embedding_endpoint.url,
             model=CURRENT_CONFIG.get("embedding_model", CURRENT_CONFIG["model"])  # Use same model for embeddings if not specified
         )
 
-    def analyze_document(self, document_path: str) -> Dict[str, Any]:
+    def analyze_document(self, document_path: str, document_id: int = None, callback_url: str = None) -> Dict[str, Any]:
         from langchain_community.document_loaders import PyMuPDFLoader
         from langchain.text_splitter import RecursiveCharacterTextSplitter
         from langchain_community.vectorstores import FAISS
 
+        # Helper to update progress
+        def _update_step(step_name, duration=None):
+            _post_step(callback_url, step_name, duration)
+
         # Determine if document_path is a local file or MinIO object
         if '/' in document_path and len(document_path.split('/')[0]) == 36:  # UUID length
             # This appears to be a MinIO object name, download it temporarily
@@ -894,10 +981,12 @@ class OllamaLLMClient:
             # This is a local file path
             temp_path = document_path
 
-        try:
-            # Load document
+        def parse_stage(_):
             loader = PyMuPDFLoader(temp_path)
-            pages = loader.load()
+            return loader.load()
+
+        def summary_stage(inputs):
+            pages = inputs["parse"]
 
             # Combine all text (up to a reasonable limit to avoid context overflow)
             full_text = "\n\n".join([page.page_content for page in pages])
@@ -925,27 +1014,25 @@ class OllamaLLMClient:
             {full_text}
             """
 
-            # Get analysis from LLM
             try:
                 # Using the Ollama client directly
-                response = self.client.invoke(prompt)
-                analysis_text = str(response)
+                with self.chat_pool.track(self.chat_endpoint):
+                    response = self.client.invoke(prompt)
+                return str(response)
             except Exception as e:
                 logger.error(f"Error calling Ollama for document analysis: {e}")
-                # Fall back to mock data if API call fails
-                return process_financial_document_mock(document_path)
+                # Signal the caller to fall back to mock data
+                return None
 
-            # Create vector database for Q&A
+        def split_stage(inputs):
             text_splitter = RecursiveCharacterTextSplitter(
                 chunk_size=1000,
                 chunk_overlap=100,
                 separators=["\n\n", "\n", ".", " ", ""]
             )
-            docs = text_splitter.split_documents(pages)
-
-            # Use the configured embeddings from init
-            embeddings = self.embeddings
+            return text_splitter.split_documents(inputs["parse"])
 
+        def index_stage(inputs):
             # Generate unique vector store path
             unique_id = str(uuid.uuid4())
             # Extract filename from MinIO object path for vector store name
@@ -957,11 +1044,29 @@ class OllamaLLMClient:
 
             try:
                 # Create and save vector store
-                vector_store = FAISS.from_documents(docs, embeddings)
+                with self.embedding_pool.track(self.embedding_endpoint):
+                    vector_store = FAISS.from_documents(inputs["split"], self.embeddings)
                 vector_store.save_local(vector_db_path)
             except Exception as e:
                 logger.error(f"Error creating vector store: {e}")
                 vector_db_path = ""  # Set to empty if vector store creation fails
+            return vector_db_path
+
+        graph = StageGraph(on_step=_update_step)
+        graph.add("parse", parse_stage, label="Parsing the PDF into text")
+        graph.add("summary", summary_stage, depends_on=("parse",), label="Generating the Summary")
+        graph.add("split", split_stage, depends_on=("parse",))
+        graph.add("index", index_stage, depends_on=("split",), label="Processing for the Q&A")
+
+        try:
+            results = graph.run()
+            logger.info(f"Ollama analysis stage timings for {document_path}: {graph.timings}")
+
+            if results["summary"] is None:
+                # Fall back to mock data if API call fails
+                return process_financial_document_mock(document_path)
+
+            _update_step("Completed")
 
             # For this simplified implementation, return analysis text and key figures
             # In a real implementation, we would parse the LLM response for structured data
@@ -972,9 +1077,10 @@ class OllamaLLMClient:
             ]
 
             return {
-                "summary": analysis_text,
+                "summary": results["summary"],
                 "key_figures": key_figures,
-                "vector_db_path": vector_db_path
+                "vector_db_path": results["index"],
+                "stage_timings": graph.timings
             }
         finally:
             # Clean up temporary file if we created one
@@ -1029,7 +1135,8 @@ class OllamaLLMClient:
                     docs = text_splitter.split_documents(pages)
 
                     # Create and save vector store
-                    vector_store = FAISS.from_documents(docs, embeddings)
+                    with self.embedding_pool.track(self.embedding_endpoint):
+                        vector_store = FAISS.from_documents(docs, embeddings)
                     vector_store.save_local(vector_db_path)
                 finally:
                     # Clean up temporary file if we created one
@@ -1047,12 +1154,13 @@ class OllamaLLMClient:
             qa = RetrievalQA.from_chain_type(
                 llm=self.client,
                 chain_type="stuff",
-                retriever=vector_store.as_retriever()
+                retriever=section_retriever(vector_store, question)
             )
 
             # Get answer with token tracking
             with get_openai_callback() as cb:
-                result = qa({"query": question})
+                with self.chat_pool.track(self.chat_endpoint):
+                    result = qa({"query": question})
                 print(f"DEBUG: Callback state: {cb}")
                 print(f"DEBUG: Result keys: {result.keys()}")
                 if "source_documents" in result:
@@ -1112,7 +1220,7 @@ def update_llm_config(config: LLMModeRequest):
 
 @app.post("/analyze", response_model=DocumentAnalysisResponse)
 def analyze_document(request: DocumentAnalysisRequest):
-    llm_client = get_llm_client()
+    llm_client = get_llm_client(bypass_cache=request.bypass_cache)
     results = llm_client.analyze_document(request.document_path, request.document_id, request.callback_url)
     
     # Convert dictionaries to KeyFigure objects
@@ -1122,20 +1230,169 @@ def analyze_document(request: DocumentAnalysisRequest):
         summary=results["summary"],
         key_figures=key_figures,
         vector_db_path=results["vector_db_path"],
-        token_usage=results.get("token_usage")
+        token_usage=results.get("token_usage"),
+        stage_timings=results.get("stage_timings")
     )
 
-from fastapi import BackgroundTasks, HTTPException
 import tempfile
 import uuid
+import hashlib
 import os # Ensure os is imported at a higher scope if not already
 
 from agents.layout_parser import LayoutParserAgent
 from agents.chunker import ParentChildSplitter
 from agents.analyst import FinancialAnalystAgent
 
+# Agentic pipeline stages. Each one reads the previous stage's artifacts from the
+# job directory and writes its own, so the job runner can resume from any of them.
+AGENTIC_VECTOR_DB_DIR = "/data/vector_dbs"
+
+def _agentic_download(job: PipelineJob) -> Dict[str, Any]:
+    document_path = job.params["document_path"]
+    source_dir = job.path("source")
+    os.makedirs(source_dir, exist_ok=True)
+    # Keep the original filename; the layout parser reads ticker/year from it
+    local_path = os.path.join(source_dir, os.path.basename(document_path))
+    minio_client.fget_object(DOCUMENTS_BUCKET, document_path, local_path)
+    return {"source_file": local_path, "file_size": os.path.getsize(local_path)}
+
+def _agentic_parse(job: PipelineJob) -> Dict[str, Any]:
+    structured_doc = LayoutParserAgent().parse_document(job.outputs["source_file"])
+    with open(job.path("parsed.json"), "w") as f:
+        json.dump(structured_doc, f)
+    return {"page_count": structured_doc.get("page_count"), "section_count": len(structured_doc.get("sections", []))}
+
+def _agentic_chunk(job: PipelineJob) -> Dict[str, Any]:
+    with open(job.path("parsed.json"), "r") as f:
+        structured_doc = json.load(f)
+    child_chunks = ParentChildSplitter().process_document(structured_doc)
+
+    chunks = []
+    for chunk in child_chunks:
+        if chunk.content and isinstance(chunk.content, str) and chunk.content.strip():
+            chunks.append({"id": chunk.id, "content": chunk.content, "metadata": chunk.metadata})
+        else:
+            logger.warning(f"Skipping empty chunk: {chunk.id}")
+    if not chunks:
+        raise ValueError("No text chunks could be extracted from the document")
+
+    with open(job.path("chunks.json"), "w") as f:
+        json.dump(chunks, f)
+    logger.info(f"Prepared {len(chunks)} chunks for vectorization")
+    return {"chunk_count": len(chunks)}
+
+def _agentic_summarize_tables(job: PipelineJob) -> Dict[str, Any]:
+    with open(job.path("parsed.json"), "r") as f:
+        structured_doc = json.load(f)
+    tables = structured_doc.get("tables", [])
+
+    table_chunks = []
+    llm_client = get_llm_client()
+    if tables and getattr(llm_client, "client", None) is not None:
+        for table in tables:
+            table["ticker"] = structured_doc.get("ticker", "UNKNOWN")
+            table["fiscal_year"] = structured_doc.get("fiscal_year", "UNKNOWN")
+        analyst = FinancialAnalystAgent(llm_client, model_name=CURRENT_CONFIG["model"])
+        summaries = analyst.summarize_tables(tables)
+
+        # Each summary becomes a retrievable chunk that points back to its table
+        for table in tables:
+            summary = summaries.get(table["id"])
+            if not summary:
+                continue
+            table_chunks.append({
+                "id": f"table-{table['id']}",
+                "content": summary,
+                "metadata": {
+                    "table_id": table["id"],
+                    "table_content": table["content"],
+                    "section_name": table.get("section_name"),
+                    "section_key": table.get("section_key"),
+                    "item": table.get("item"),
+                    "form_type": structured_doc.get("form_type"),
+                    "page": table["page"],
+                    "ticker": table["ticker"],
+                    "fiscal_year": table["fiscal_year"],
+                    "source_filename": structured_doc.get("filename", "unknown"),
+                    "type": "table_summary"
+                }
+            })
+    elif tables:
+        logger.info("Current LLM client can't summarize tables, skipping table summaries")
+
+    with open(job.path("table_chunks.json"), "w") as f:
+        json.dump(table_chunks, f)
+    return {"table_count": len(tables), "table_summary_count": len(table_chunks)}
+
+def _agentic_load_chunks(job: PipelineJob) -> List[Dict[str, Any]]:
+    """Text chunks followed by table summary chunks, in a stable order."""
+    with open(job.path("chunks.json"), "r") as f:
+        chunks = json.load(f)
+    with open(job.path("table_chunks.json"), "r") as f:
+        chunks.extend(json.load(f))
+    return chunks
+
+def _agentic_embed(job: PipelineJob) -> Dict[str, Any]:
+    chunks = _agentic_load_chunks(job)
+    embeddings = get_llm_client().embeddings
+    vectors = embeddings.embed_documents([c["content"] for c in chunks])
+    with open(job.path("embeddings.json"), "w") as f:
+        json.dump(vectors, f)
+    return {"embedding_dimensions": len(vectors[0]) if vectors else 0}
+
+def _agentic_index(job: PipelineJob) -> Dict[str, Any]:
+    from langchain_community.vectorstores import FAISS
+    chunks = _agentic_load_chunks(job)
+    with open(job.path("embeddings.json"), "r") as f:
+        vectors = json.load(f)
+
+    # Build the index from the stored vectors instead of re-embedding
+    vector_store = FAISS.from_embeddings(
+        text_embeddings=[(c["content"], v) for c, v in zip(chunks, vectors)],
+        embedding=get_llm_client().embeddings,
+        metadatas=[c["metadata"] for c in chunks]
+    )
+    filename = os.path.basename(job.params["document_path"])
+    vector_db_path = f"{AGENTIC_VECTOR_DB_DIR}/{uuid.uuid4()}_{filename.replace('.pdf', '')}.faiss"
+    vector_store.save_local(vector_db_path)
+    logger.info(f"Agentic pipeline vector store saved at {vector_db_path}")
+
+    # The source copy and raw vectors are only needed to resume the earlier stages
+    import shutil
+    shutil.rmtree(job.path("source"), ignore_errors=True)
+    os.remove(job.path("embeddings.json"))
+    return {"vector_db_path": vector_db_path}
+
+def _agentic_step(job: PipelineJob, step: str, duration: Optional[float]):
+    _post_step(job.params.get("callback_url"), step, duration)
+
+agentic_runner = PipelineJobRunner(
+    stages=[
+        PipelineStage("downloaded", "Downloading Document", _agentic_download, artifacts=("source",)),
+        PipelineStage("parsed", "Parsing Layout", _agentic_parse, artifacts=("parsed.json",)),
+        PipelineStage("chunked", "Generating Chunks", _agentic_chunk, artifacts=("chunks.json",)),
+        PipelineStage("tables_summarized", "Summarizing Tables", _agentic_summarize_tables, artifacts=("table_chunks.json",)),
+        PipelineStage("embedded", "Embedding Chunks", _agentic_embed, artifacts=("embeddings.json",)),
+        PipelineStage("indexed", "Indexing Vectors", _agentic_index)
+    ],
+    on_step=_agentic_step
+)
+
+def agentic_job_id(document_path: str) -> str:
+    """Stable job id per document, so a re-submitted document resumes its checkpoints."""
+    return hashlib.sha256(document_path.encode("utf-8")).hexdigest()[:16]
+
+@app.on_event("startup")
+def resume_agentic_jobs():
+    try:
+        resumed = agentic_runner.resume_incomplete()
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} interrupted agentic pipeline jobs")
+    except Exception as e:
+        logger.error(f"Failed to resume agentic pipeline jobs: {e}")
+
 @app.post("/analyze_agentic")
-async def analyze_document_agentic(request: DocumentAnalysisRequest, background_tasks: BackgroundTasks):
+def analyze_document_agentic(request: DocumentAnalysisRequest):
     """
     Agentic analysis pipeline: Layout Parser -> Parent-Child Chunker -> Vector Store
     """
@@ -1151,111 +1408,41 @@ async def analyze_document_agentic(request: DocumentAnalysisRequest, background_
         logger.error(f"Document not found: {e}")
         raise HTTPException(status_code=404, detail=f"Document not found: {request.document_path}")
 
-    # Run analysis in background
-    background_tasks.add_task(process_agentic_pipeline, request.document_path, request.document_id, request.callback_url)
+    # Run analysis on the pipeline job runner
+    job = agentic_runner.submit(agentic_job_id(request.document_path), {
+        "document_path": request.document_path,
+        "document_id": request.document_id,
+        "callback_url": request.callback_url
+    })
     
-    return {"status": "processing", "message": "Agentic analysis started in background"}
-
-async def process_agentic_pipeline(document_path: str, document_id: Optional[int] = None, callback_url: Optional[str] = None):
-    logger.info(f"Starting agentic pipeline for {document_path}")
-    
-    try:
-        # Get LLM client for embeddings
-        llm_client = get_llm_client()
-
-        # 1. Download Document
-        if document_id and callback_url:
-            _update_step_callback(document_id, callback_url, "Downloading Document")
-            
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            minio_client.fget_object(DOCUMENTS_BUCKET, document_path, tmp_file.name)
-            temp_path = tmp_file.name
-
-        try:
-            # 2. Layout Parsing
-            if document_id and callback_url:
-                _update_step_callback(document_id, callback_url, "Parsing Layout")
-            
-            layout_agent = LayoutParserAgent()
-            structured_doc = layout_agent.parse_document(temp_path)
-            
-            # 3. Parent-Child Chunking
-            if document_id and callback_url:
-                _update_step_callback(document_id, callback_url, "Generating Chunks")
-                
-            chunker = ParentChildSplitter()
-            child_chunks = chunker.process_document(structured_doc)
-            
-            # 4. Vectorization (Indexing)
-            if document_id and callback_url:
-                _update_step_callback(document_id, callback_url, "Indexing Vectors")
-                
-            # Convert chunks to LangChain documents for FAISS
-            from langchain.docstore.document import Document
-            from langchain_community.vectorstores import FAISS # Import FAISS here for this function
-            docs = []
-            for chunk in child_chunks:
-                if chunk.content and isinstance(chunk.content, str) and chunk.content.strip():
-                    docs.append(Document(page_content=chunk.content, metadata=chunk.metadata))
-                else:
-                    logger.warning(f"Skipping empty chunk: {chunk.id}")
-            
-            logger.info(f"Prepared {len(docs)} documents for vectorization")
-            if docs:
-                logger.info(f"First doc content preview: {docs[0].page_content[:200]}")
-                logger.info(f"First doc metadata: {docs[0].metadata}")
-            
-            # Use the configured embeddings
-            embeddings = llm_client.embeddings
-            
-            # Generate unique vector store path
-            unique_id = str(uuid.uuid4())
-            if '/' in document_path:
-                filename = os.path.basename(document_path.split('/', 1)[1])
-            else:
-                filename = os.path.basename(document_path)
-            vector_db_path = f"/data/vector_dbs/{unique_id}_{filename.replace('.pdf', '')}.faiss"
-            
-            vector_store = FAISS.from_documents(docs, embeddings)
-            vector_store.save_local(vector_db_path)
-            
-            logger.info(f"Agentic pipeline completed. Vector store saved at {vector_db_path}")
-            
-            # Update status to completed
-            if document_id and callback_url:
-                # We need to send the vector_db_path back
-                # This requires updating the callback payload or just updating the step
-                # For now, we'll just mark as completed, but ideally we should save the path
-                # The current callback mechanism might be limited, but let's try to pass it
-                pass 
-                
-                # Note: The current document-service expects specific fields. 
-                # We might need to update the document-service to handle this new flow's results.
-                # For now, we just finish the task.
-                _update_step_callback(document_id, callback_url, "Completed")
-
-        finally:
-            if os.path.exists(temp_path):
-                os.unlink(temp_path)
-                
-    except Exception as e:
-        logger.error(f"Agentic pipeline failed: {e}")
-        if document_id and callback_url:
-             _update_step_callback(document_id, callback_url, "Failed")
+    return {
+        "status": "processing",
+        "message": "Agentic analysis started in background",
+        "job_id": job.job_id,
+        "resumed_from": job.completed_stages[-1] if job.completed_stages else None
+    }
 
-def _update_step_callback(document_id: int, callback_url: str, step: str):
-    try:
-        import requests
-        headers = {}
-        if INTERNAL_API_KEY:
-            headers["X-Internal-API-Key"] = INTERNAL_API_KEY
-        requests.patch(f"{callback_url}/step", json={"step": step}, headers=headers)
-    except Exception as e:
-        logger.error(f"Failed to update step callback: {e}")
+@app.get("/jobs/{job_id}")
+def get_agentic_job(job_id: str):
+    job = agentic_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/jobs/{job_id}/retry")
+def retry_agentic_job(job_id: str):
+    """Retry a failed job from its last completed stage."""
+    job = agentic_runner.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Job is already {job.status}")
+    job = agentic_runner.submit(job_id, job.params)
+    return {"status": job.status, "job_id": job_id, "completed_stages": job.completed_stages}
 
 @app.post("/ask", response_model=QuestionResponse)
 def ask_question(request: QuestionRequest):
-    llm_client = get_llm_client()
+    llm_client = get_llm_client(bypass_cache=request.bypass_cache)
     results = llm_client.answer_question(request.document_path, request.question, request.vector_db_path)
     
     # Convert source dictionaries to SourceReference objects
@@ -1274,6 +1461,31 @@ def ask_question(request: QuestionRequest):
 def health_check():
     return {"status": "healthy", "service": "llm-service"}
 
+@app.get("/admin/endpoints")
+def get_endpoint_stats_admin():
+    """Get per-endpoint routing, health and latency stats for the chat and embedding pools (admin only)"""
+    # Make sure both pools reflect the current configuration even before first use
+    get_chat_pool()
+    get_embedding_pool()
+    return {"pools": get_all_pool_stats()}
+
+@app.get("/admin/cache")
+def get_response_cache_stats_admin():
+    """Get LLM response cache statistics (admin only)"""
+    cache = get_response_cache()
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **cache.stats()}
+
+@app.delete("/admin/cache")
+def clear_response_cache_admin():
+    """Clear the LLM response cache (admin only)"""
+    cache = get_response_cache()
+    if cache is None:
+        return {"enabled": False, "message": "LLM response cache is disabled"}
+    cache.clear()
+    return {"enabled": True, "message": "LLM response cache cleared"}
+
 # Admin configuration endpoints
 
 @app.get("/admin/vendors")
@@ -1676,6 +1888,10 @@ def update_llm_config_admin(request: LLMConfig):
             CURRENT_CONFIG["embedding_model"] = request.embedding_model
         if request.embedding_base_url is not None:
             CURRENT_CONFIG["embedding_base_url"] = request.embedding_base_url
+        if request.base_urls is not None:
+            CURRENT_CONFIG["base_urls"] = request.base_urls
+        if request.embedding_base_urls is not None:
+            CURRENT_CONFIG["embedding_base_urls"] = request.embedding_base_urls
 
         # Save config to persistent storage
         save_config(CURRENT_CONFIG)
@@ -1698,7 +1914,9 @@ def update_llm_config_admin(request: LLMConfig):
             "model": CURRENT_CONFIG["model"],
             "base_url": CURRENT_CONFIG["base_url"],
             "embedding_model": CURRENT_CONFIG.get("embedding_model", "text-embedding-ada-002"),
-            "embedding_base_url": CURRENT_CONFIG.get("embedding_base_url", CURRENT_CONFIG.get("base_url", ""))
+            "embedding_base_url": CURRENT_CONFIG.get("embedding_base_url", CURRENT_CONFIG.get("base_url", "")),
+            "base_urls": CURRENT_CONFIG.get("base_urls", []),
+            "embedding_base_urls": CURRENT_CONFIG.get("embedding_base_urls", [])
         }
     }
 
@@ -1719,6 +1937,8 @@ def get_llm_config_admin():
             "base_url": current_config["base_url"],
             "embedding_model": current_config.get("embedding_model", "text-embedding-ada-002"),
             "embedding_base_url": current_config.get("embedding_base_url", current_config.get("base_url", "")),
+            "base_urls": current_config.get("base_urls", []),
+            "embedding_base_urls": current_config.get("embedding_base_urls", []),
             "temperature": current_config.get("temperature", 0.3),
             "max_tokens": current_config.get("max_tokens", 2000),
             "timeout": current_config.get("timeout", 300)
@@ -0,0 +1,212 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: "off" (default), "redis" or "disk"
+LLM_RESPONSE_CACHE = os.getenv("LLM_RESPONSE_CACHE", "off").lower()
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))  # Seconds
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+# Only deterministic-enough generations are worth replaying
+LLM_CACHE_MAX_TEMPERATURE = float(os.getenv("LLM_CACHE_MAX_TEMPERATURE", "0.3"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "/data/cache/llm_responses")
+
+def prompt_fingerprint(prompt: str, llm_string: str) -> str:
+    """
+    Exact-match key for a generation.
+
+    LangChain's llm_string is the serialized model parameters (model name,
+    temperature, max_tokens, ...), so hashing it with the prompt gives
+    hash(model, temperature, max_tokens, prompt).
+    """
+    digest = hashlib.sha256()
+    digest.update(llm_string.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+class ResponseCache(BaseCache):
+    """
+    LangChain cache that replays LLM generations for identical prompts.
+
+    Plugged into ChatOpenAI / Ollama through their `cache=` argument, so the
+    same cache covers direct `invoke` calls and the RetrievalQA chains.
+    Entries are stored in Redis (`backend="redis"`) or as JSON files on disk
+    (`backend="disk"`); both honour a TTL and a maximum number of entries,
+    evicting the least recently written entry first.
+    """
+
+    def __init__(self, backend: str = "disk", ttl: int = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_entry_bytes: int = LLM_CACHE_MAX_ENTRY_BYTES, cache_dir: str = LLM_CACHE_DIR, redis_client=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_entry_bytes = max_entry_bytes
+        self.cache_dir = cache_dir
+        self.redis = redis_client
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if self.backend == "redis" and self.redis is None:
+            import redis
+            redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+            try:
+                self.redis = redis.from_url(redis_url)
+                self.redis.ping()
+                logger.info(f"LLM response cache using Redis at {redis_url}")
+            except Exception as e:
+                logger.error(f"Failed to connect to Redis for LLM cache, falling back to disk: {e}")
+                self.backend = "disk"
+                self.redis = None
+
+        if self.backend == "disk":
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Redis layout: one string per entry plus a sorted set (key -> write time) for eviction
+    _REDIS_PREFIX = "llm_cache:"
+    _REDIS_INDEX = "llm_cache:index"
+
+    def _record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = prompt_fingerprint(prompt, llm_string)
+        try:
+            payload = self._get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            payload = None
+
+        if payload is None:
+            self._record(hit=False)
+            return None
+
+        try:
+            generations = loads(payload)
+        except Exception as e:
+            logger.warning(f"Discarding unreadable LLM cache entry {key}: {e}")
+            self._record(hit=False)
+            return None
+
+        self._record(hit=True)
+        logger.info(f"LLM cache hit for {key[:12]}")
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = prompt_fingerprint(prompt, llm_string)
+        try:
+            payload = dumps(return_val)
+            if len(payload.encode("utf-8")) > self.max_entry_bytes:
+                logger.info(f"Skipping LLM cache entry {key[:12]}: larger than {self.max_entry_bytes} bytes")
+                return
+            self._set(key, payload)
+        except Exception as e:
+            logger.warning(f"LLM cache update failed: {e}")
+
+    def clear(self, **kwargs: Any) -> None:
+        if self.backend == "redis":
+            keys = self.redis.zrange(self._REDIS_INDEX, 0, -1)
+            if keys:
+                self.redis.delete(*[self._REDIS_PREFIX + k.decode() for k in keys])
+            self.redis.delete(self._REDIS_INDEX)
+        else:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.unlink(os.path.join(self.cache_dir, name))
+
+    def stats(self) -> Dict[str, Any]:
+        if self.backend == "redis":
+            entries = self.redis.zcard(self._REDIS_INDEX)
+        else:
+            entries = len([n for n in os.listdir(self.cache_dir) if n.endswith(".json")])
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+    def _get(self, key: str) -> Optional[str]:
+        if self.backend == "redis":
+            value = self.redis.get(self._REDIS_PREFIX + key)
+            if value is None:
+                # Expired by TTL; drop it from the eviction index as well
+                self.redis.zrem(self._REDIS_INDEX, key)
+                return None
+            return value.decode("utf-8")
+
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.unlink(path)
+                return None
+            with open(path, "r") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _set(self, key: str, payload: str):
+        if self.backend == "redis":
+            pipe = self.redis.pipeline()
+            pipe.setex(self._REDIS_PREFIX + key, self.ttl, payload)
+            pipe.zadd(self._REDIS_INDEX, {key: time.time()})
+            pipe.execute()
+            overflow = self.redis.zcard(self._REDIS_INDEX) - self.max_entries
+            if overflow > 0:
+                oldest = self.redis.zrange(self._REDIS_INDEX, 0, overflow - 1)
+                if oldest:
+                    self.redis.delete(*[self._REDIS_PREFIX + k.decode() for k in oldest])
+                    self.redis.zrem(self._REDIS_INDEX, *oldest)
+            return
+
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            entries = [os.path.join(self.cache_dir, n) for n in os.listdir(self.cache_dir) if n.endswith(".json")]
+            overflow = len(entries) - self.max_entries
+            if overflow > 0:
+                entries.sort(key=os.path.getmtime)
+                for old_path in entries[:overflow]:
+                    try:
+                        os.unlink(old_path)
+                    except FileNotFoundError:
+                        pass
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache(temperature: Optional[float] = None, bypass: bool = False) -> Optional[ResponseCache]:
+    """
+    Shared response cache, or None when caching is off, bypassed for this
+    request, or the sampling temperature is too high for replay to be safe.
+    """
+    global _response_cache
+    if bypass or LLM_RESPONSE_CACHE not in ("redis", "disk"):
+        return None
+    if temperature is not None and temperature > LLM_CACHE_MAX_TEMPERATURE:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(backend=LLM_RESPONSE_CACHE)
+        return _response_cache
@@ -0,0 +1,96 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    depends_on: Tuple[str, ...] = ()
+    label: Optional[str] = None
+
+class StageFailed(Exception):
+    """Raised when a stage of the graph raises; carries the stage name."""
+
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+@dataclass
+class StageGraph:
+    """
+    Small dependency graph of analysis stages.
+
+    Each stage is a callable that receives the results of the stages it
+    depends on (keyed by stage name). Stages whose dependencies are satisfied
+    run concurrently on a thread pool, so the wall time of a run is roughly the
+    longest dependency chain instead of the sum of all stages.
+
+    `on_step(label, duration)` is called with duration=None when a stage starts
+    and with the elapsed seconds when it finishes, which lets callers forward
+    progress and per-stage timings through the existing step callback.
+    """
+    max_workers: int = 4
+    on_step: Optional[Callable[[str, Optional[float]], None]] = None
+    stages: Dict[str, Stage] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], depends_on: Tuple[str, ...] = (), label: Optional[str] = None) -> "StageGraph":
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        for dep in depends_on:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name=name, func=func, depends_on=tuple(depends_on), label=label)
+        return self
+
+    def _notify(self, stage: Stage, duration: Optional[float]):
+        if not self.on_step or not stage.label:
+            return
+        try:
+            self.on_step(stage.label, duration)
+        except Exception as e:
+            logger.warning(f"Step callback failed for stage {stage.name}: {e}")
+
+    def _run_stage(self, stage: Stage, inputs: Dict[str, Any]) -> Any:
+        self._notify(stage, None)
+        started = time.perf_counter()
+        try:
+            return stage.func(inputs)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[stage.name] = round(elapsed, 3)
+            logger.info(f"Stage '{stage.name}' finished in {elapsed:.2f}s")
+            self._notify(stage, elapsed)
+
+    def run(self) -> Dict[str, Any]:
+        """Run all stages and return their results keyed by stage name."""
+        results: Dict[str, Any] = {}
+        pending: List[Stage] = list(self.stages.values())
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                ready = [s for s in pending if all(dep in results for dep in s.depends_on)]
+                for stage in ready:
+                    pending.remove(stage)
+                    inputs = {dep: results[dep] for dep in stage.depends_on}
+                    running[executor.submit(self._run_stage, stage, inputs)] = stage
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        results[stage.name] = future.result()
+                    except Exception as e:
+                        # Let stages already in flight finish, but schedule nothing new
+                        for other in running:
+                            other.cancel()
+                        raise StageFailed(stage.name, e) from e
+
+        return results
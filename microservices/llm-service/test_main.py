@@ -194,5 +194,231 @@ def test_ask_question_endpoint():
     # This might return an error, but we're just checking the endpoint exists
     assert response.status_code in [422, 500, 200]  # Different possible responses
 
+def test_stage_graph_runs_independent_stages_concurrently():
+    """Independent branches of the analysis stage graph should overlap in time"""
+    import time
+    from stage_graph import StageGraph
+
+    steps = []
+    graph = StageGraph(on_step=lambda label, duration: steps.append((label, duration)))
+    graph.add("parse", lambda _: "text", label="Parsing")
+    graph.add("summary", lambda inputs: time.sleep(0.3) or inputs["parse"] + ":summary", depends_on=("parse",), label="Summary")
+    graph.add("index", lambda inputs: time.sleep(0.3) or inputs["parse"] + ":index", depends_on=("parse",), label="Indexing")
+
+    started = time.perf_counter()
+    results = graph.run()
+    elapsed = time.perf_counter() - started
+
+    assert results["summary"] == "text:summary"
+    assert results["index"] == "text:index"
+    assert elapsed < 0.55  # Sequential execution would take at least 0.6s
+    assert set(graph.timings) == {"parse", "summary", "index"}
+    # Every labelled stage reports a start (no duration) and a finish (with duration)
+    assert ("Summary", None) in steps
+    assert any(label == "Summary" and duration is not None for label, duration in steps)
+
+def test_stage_graph_reports_failed_stage():
+    """A failing stage should surface as StageFailed naming the stage"""
+    from stage_graph import StageGraph, StageFailed
+
+    def boom(_):
+        raise ValueError("bad pdf")
+
+    graph = StageGraph()
+    graph.add("parse", boom)
+    graph.add("summary", lambda inputs: "never", depends_on=("parse",))
+
+    with pytest.raises(StageFailed) as exc_info:
+        graph.run()
+    assert exc_info.value.stage == "parse"
+
+def test_response_cache_replays_exact_prompt(tmp_path):
+    """The disk response cache should replay identical prompts and miss on changed parameters"""
+    from langchain_core.outputs import Generation
+    from response_cache import ResponseCache
+
+    cache = ResponseCache(backend="disk", cache_dir=str(tmp_path), ttl=60, max_entries=2)
+    llm_string = '{"model": "test-model", "temperature": 0.0, "max_tokens": 100}'
+    cache.update("What is revenue?", llm_string, [Generation(text="$1.25 billion")])
+
+    hit = cache.lookup("What is revenue?", llm_string)
+    assert hit[0].text == "$1.25 billion"
+    assert cache.lookup("What is revenue?", llm_string.replace("0.0", "0.7")) is None
+
+    # Oldest entry is evicted once max_entries is exceeded
+    cache.update("q2", llm_string, [Generation(text="a2")])
+    cache.update("q3", llm_string, [Generation(text="a3")])
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["hits"] == 1
+
+def test_endpoint_pool_routes_to_least_outstanding_and_ejects_failures():
+    """The endpoint pool should balance by outstanding requests and eject failing endpoints"""
+    from endpoint_pool import EndpointPool, ENDPOINT_MAX_FAILURES
+
+    pool = EndpointPool("test", ["http://gpu1:1234/v1/", "http://gpu2:1234/v1"])
+    assert pool.primary_url == "http://gpu1:1234/v1"
+
+    busy = pool.select()
+    pool.begin(busy)
+    other = pool.select()
+    assert other.url != busy.url
+    pool.finish(busy, True, 0.1)
+
+    for _ in range(ENDPOINT_MAX_FAILURES):
+        with pytest.raises(RuntimeError):
+            with pool.track(other):
+                raise RuntimeError("connection refused")
+
+    stats = {s["url"]: s for s in pool.stats()}
+    assert stats[other.url]["ejected"] is True
+    assert stats[other.url]["failures"] == ENDPOINT_MAX_FAILURES
+    # While ejected, all traffic goes to the healthy endpoint
+    assert all(pool.select().url == busy.url for _ in range(5))
+
+def test_admin_endpoints_stats():
+    """The admin endpoints route should expose chat and embedding pool stats"""
+    response = client.get("/admin/endpoints")
+    assert response.status_code == 200
+    pools = response.json()["pools"]
+    assert "chat" in pools and "embeddings" in pools
+
+def test_pipeline_job_runner_resumes_from_last_checkpoint(tmp_path):
+    """A failed pipeline job should resume after its last completed stage on retry"""
+    import time
+    from job_runner import PipelineJobRunner, PipelineStage
+
+    calls = []
+    attempts = {"embedded": 0}
+
+    def write(name):
+        def stage(job):
+            calls.append(name)
+            with open(job.path(f"{name}.out"), "w") as f:
+                f.write(name)
+            return {name: True}
+        return stage
+
+    def flaky_embed(job):
+        calls.append("embedded")
+        attempts["embedded"] += 1
+        if attempts["embedded"] == 1:
+            raise RuntimeError("embedding server down")
+        return {"embedded": True}
+
+    runner = PipelineJobRunner(
+        stages=[
+            PipelineStage("downloaded", "Downloading", write("downloaded"), artifacts=("downloaded.out",)),
+            PipelineStage("parsed", "Parsing", write("parsed"), artifacts=("parsed.out",)),
+            PipelineStage("embedded", "Embedding", flaky_embed)
+        ],
+        checkpoint_dir=str(tmp_path),
+        max_workers=1
+    )
+
+    def wait_for(job_id, status):
+        for _ in range(100):
+            job = runner.get(job_id)
+            if job and job.status == status:
+                return job
+            time.sleep(0.02)
+        raise AssertionError(f"job never reached {status}")
+
+    runner.submit("job1", {"document_path": "docs/a.pdf"})
+    failed = wait_for("job1", "failed")
+    assert failed.completed_stages == ["downloaded", "parsed"]
+
+    runner.submit("job1", failed.params)
+    done = wait_for("job1", "completed")
+    assert calls == ["downloaded", "parsed", "embedded", "embedded"]
+    assert set(done.stage_timings) == {"downloaded", "parsed", "embedded"}
+    assert done.attempts == 2
+
+def test_layout_parser_detects_filing_items(tmp_path):
+    """Item headings should become sections, skipping the table of contents"""
+    import fitz
+    from agents.layout_parser import LayoutParserAgent
+
+    pdf = fitz.open()
+    pages = [
+        [("FORM 10-K", 14, True), ("Acme Corp annual report", 10, False)],
+        [("TABLE OF CONTENTS", 12, True), ("Item 1A. Risk Factors 3", 10, False), ("Item 7. Management's Discussion 4", 10, False)],
+        [("Item 1A. Risk Factors", 12, True)] + [("Supply chain disruption could hurt results.", 10, False)] * 8,
+        [("ITEM 7. MANAGEMENT'S DISCUSSION AND ANALYSIS", 12, True)] + [("Revenue grew 12% to $1.25 billion.", 10, False)] * 8,
+    ]
+    for lines in pages:
+        page = pdf.new_page()
+        for i, (text, size, bold) in enumerate(lines):
+            page.insert_text((50, 50 + i * 18), text, fontsize=size, fontname="hebo" if bold else "helv")
+    path = tmp_path / "ACME_2023.pdf"
+    pdf.save(str(path))
+
+    parsed = LayoutParserAgent().parse_document(str(path))
+    assert parsed["form_type"] == "10-K"
+    sections = {s["key"]: s for s in parsed["sections"]}
+    assert set(sections) == {"cover", "risk_factors", "mda"}
+    assert sections["risk_factors"]["start_page"] == 3
+    assert "Supply chain" in sections["risk_factors"]["content"]
+
+def test_route_question_to_sections():
+    """Questions should route to the filing sections they are about"""
+    from agents.sections import route_question
+
+    assert route_question("What are the main risk factors?") == ["risk_factors"]
+    assert route_question("Summarize Item 7A") == ["market_risk"]
+    assert route_question("Item 1A", form_type="10-Q") == ["risk_factors"]
+    assert route_question("What steps were taken?") == []
+
+def test_section_retriever_finds_sections_outside_the_nearest_chunks():
+    """A routed section should be retrieved even when none of its chunks rank among the nearest ones"""
+    from types import SimpleNamespace
+    from main import section_retriever
+
+    class FlatIndex:
+        """Mimics FAISS: take the fetch_k nearest chunks (here, in insertion order), then apply the filter"""
+        def __init__(self, docs):
+            self.docstore = SimpleNamespace(_dict={str(i): doc for i, doc in enumerate(docs)})
+            self.docs = docs
+
+        def as_retriever(self, search_kwargs):
+            def invoke(query):
+                kwargs = {"fetch_k": 20, **search_kwargs}
+                nearest = self.docs[:kwargs["fetch_k"]]
+                wanted = kwargs.get("filter", {}).get("section_key")
+                if wanted:
+                    nearest = [doc for doc in nearest if doc.metadata["section_key"] in wanted]
+                return nearest[:kwargs["k"]]
+            return SimpleNamespace(invoke=invoke)
+
+    def chunk(section_key):
+        return SimpleNamespace(page_content=section_key, metadata={"section_key": section_key, "form_type": "10-K"})
+
+    # 500 MD&A chunks rank ahead of every risk factor chunk
+    index = FlatIndex([chunk("mda") for _ in range(500)] + [chunk("risk_factors") for _ in range(6)])
+    retrieved = section_retriever(index, "What are the main risk factors?", k=4).invoke("risk factors")
+    assert [doc.metadata["section_key"] for doc in retrieved] == ["risk_factors"] * 4
+
+def test_table_summaries_are_cached_by_content(monkeypatch):
+    """Table summaries should be generated once per table content and then served from cache"""
+    from types import SimpleNamespace
+    from langchain_community.llms import FakeListLLM
+    from agents.analyst import FinancialAnalystAgent
+
+    monkeypatch.setenv("REDIS_URL", "redis://localhost:1/0")  # Force the in-memory cache
+    llm = FakeListLLM(responses=["Revenue grew 12%.", "Debt fell sharply."])
+    analyst = FinancialAnalystAgent(SimpleNamespace(client=llm), model_name="test-model")
+
+    tables = [
+        {"id": "p3_t0", "content": "Revenue | 2023 | 2022\n| 1,250 | 1,111", "section_name": "Item 7"},
+        {"id": "p9_t0", "content": "Debt | 2023 | 2022\n| 920 | 1,300", "section_name": "Item 8"}
+    ]
+    first = analyst.summarize_tables(tables)
+    assert set(first) == {"p3_t0", "p9_t0"}
+
+    # The same content under a new id is a cache hit, so the fake LLM isn't called again
+    llm.i = 0
+    llm.responses = ["should not be used"]
+    second = analyst.summarize_tables([{**tables[0], "id": "copy"}])
+    assert second["copy"] == first["p3_t0"]
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
@@ -9,6 +9,15 @@ from psycopg2.extras import RealDictCursor
 from datetime import datetime
 import json
 import io
+import threading
+
+from storage_ledger import (
+    LOCAL_BUCKET, UNOWNED, create_ledger_table, record_upload, record_delete, quota_status
+)
+from reconciler import LedgerReconciler
+from maintenance import (
+    MaintenanceProgress, maintenance_lock, maintenance_progress, sync_stored_files, cleanup_orphans
+)
 
 # OpenTelemetry tracing setup
 from opentelemetry import trace
@@ -139,21 +148,18 @@ def create_tables():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_stored_files_file_path ON stored_files (file_path)")
+        create_ledger_table(cursor)
         
         conn.commit()
         conn.close()
     except Exception as e:
         print(f"Error creating tables: {e}")
 
-def get_directory_size(path):
-    """Calculate the total size of a directory"""
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            if os.path.exists(filepath):
-                total_size += os.path.getsize(filepath)
-    return total_size
+# Keeps the storage_usage ledger in line with what is actually stored
+ledger_reconciler = LedgerReconciler(
+    get_db_connection, minio_client, [DOCUMENTS_BUCKET, AVATARS_BUCKET], DOCUMENTS_BUCKET, STORAGE_PATH
+)
 
 @app.on_event("startup")
 def startup_event():
@@ -164,6 +170,7 @@ def startup_event():
         os.makedirs(STORAGE_PATH, exist_ok=True)
         
     create_tables()
+    threading.Thread(target=ledger_reconciler.loop, name="storage-reconciler", daemon=True).start()
 
 @app.get("/")
 def root():
@@ -176,101 +183,124 @@ def health_check():
 
 @app.get("/admin/overview")
 def get_storage_overview():
-    """Get storage overview"""
-    total_size = get_directory_size(STORAGE_PATH)
+    """Get storage overview from the usage ledger"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT bucket, extension, SUM(size_bytes) AS size_bytes, SUM(object_count) AS object_count
+        FROM storage_usage
+        GROUP BY bucket, extension
+    """)
+    rows = cursor.fetchall()
+    conn.close()
+
+    total_size = 0
     total_files = 0
     file_types = {}
-
-    for dirpath, dirnames, filenames in os.walk(STORAGE_PATH):
-        for filename in filenames:
-            total_files += 1
-            _, ext = os.path.splitext(filename)
-            ext = ext.lower()
-            if ext in file_types:
-                file_types[ext] += 1
-            else:
-                file_types[ext] = 1
-
-    # Get MinIO storage statistics
-    try:
-        minio_objects = list(minio_client.list_objects(DOCUMENTS_BUCKET, recursive=True))
-        minio_size = sum(obj.size for obj in minio_objects if obj.size)
-        minio_count = len(minio_objects)
-
-        # Add file types from MinIO if available
-        for obj in minio_objects:
-            _, ext = os.path.splitext(obj.object_name)
-            ext = ext.lower()
-            if ext in file_types:
-                file_types[ext] += 1
-            else:
-                file_types[ext] = 1
-    except Exception as e:
-        minio_size = 0
-        minio_count = 0
-        print(f"Error getting MinIO stats: {e}")
-
-    total_size += minio_size
-    total_files += minio_count
+    buckets = {}
+    for row in rows:
+        size, count = int(row["size_bytes"]), int(row["object_count"])
+        total_size += size
+        total_files += count
+        file_types[row["extension"]] = file_types.get(row["extension"], 0) + count
+        bucket = buckets.setdefault(row["bucket"], {"size_bytes": 0, "file_count": 0})
+        bucket["size_bytes"] += size
+        bucket["file_count"] += count
 
     # Get available disk space
     statvfs = os.statvfs(STORAGE_PATH)
     free_size = statvfs.f_frsize * statvfs.f_bavail
 
+    minio_stats = {"size_bytes": 0, "file_count": 0}
+    for name, bucket in buckets.items():
+        if name != LOCAL_BUCKET:
+            minio_stats["size_bytes"] += bucket["size_bytes"]
+            minio_stats["file_count"] += bucket["file_count"]
+
     return {
         "total_size_bytes": total_size + free_size,
         "used_size_bytes": total_size,
         "free_size_bytes": free_size,
         "total_files": total_files,
         "file_types": file_types,
-        "minio_stats": {
-            "size_bytes": minio_size,
-            "file_count": minio_count
-        }
+        "minio_stats": minio_stats,
+        "buckets": buckets,
+        "reconciler": ledger_reconciler.stats()
     }
 
 @app.get("/admin/users")
 def get_user_storage_details(user_id: Optional[int] = None):
-    """Get user storage details"""
+    """Get user storage details from the usage ledger; files are listed for a single user only"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    
+
     if user_id:
         cursor.execute("""
-            SELECT * FROM stored_files WHERE user_id = %s
-            ORDER BY created_at DESC
+            SELECT owner_id, bucket, extension, size_bytes, object_count
+            FROM storage_usage WHERE owner_id = %s
         """, (user_id,))
     else:
-        cursor.execute("SELECT * FROM stored_files ORDER BY created_at DESC")
-    
-    files = cursor.fetchall()
-    conn.close()
-    
+        cursor.execute("""
+            SELECT owner_id, bucket, NULL AS extension,
+                   SUM(size_bytes) AS size_bytes, SUM(object_count) AS object_count
+            FROM storage_usage WHERE owner_id <> %s
+            GROUP BY owner_id, bucket
+        """, (UNOWNED,))
+    rows = cursor.fetchall()
+
     users_data = {}
-    for file_row in files:
-        uid = file_row["user_id"]
+    for row in rows:
+        uid = row["owner_id"]
         if uid not in users_data:
             users_data[uid] = {
                 "user_id": uid,
                 "total_size_bytes": 0,
                 "file_count": 0,
+                "buckets": {},
                 "files": []
             }
-        
-        file_info = {
-            "id": file_row["id"],
-            "filename": file_row["filename"],
-            "file_path": file_row["file_path"],
-            "file_size": file_row["file_size"],
-            "mime_type": file_row["mime_type"],
-            "created_at": file_row["created_at"]
-        }
-        
-        users_data[uid]["total_size_bytes"] += file_row["file_size"]
-        users_data[uid]["file_count"] += 1
-        users_data[uid]["files"].append(file_info)
-    
-    return {"users": list(users_data.values())}
+        user = users_data[uid]
+        size, count = int(row["size_bytes"]), int(row["object_count"])
+        user["total_size_bytes"] += size
+        user["file_count"] += count
+        bucket = user["buckets"].setdefault(row["bucket"], {"size_bytes": 0, "file_count": 0})
+        bucket["size_bytes"] += size
+        bucket["file_count"] += count
+        if row["extension"] is not None:
+            bucket.setdefault("file_types", {})[row["extension"]] = count
+
+    if user_id:
+        user = users_data.setdefault(user_id, {
+            "user_id": user_id, "total_size_bytes": 0, "file_count": 0, "buckets": {}, "files": []
+        })
+        user["quota"] = quota_status(cursor, user_id)
+        cursor.execute("""
+            SELECT id, filename, file_path, file_size, mime_type, created_at
+            FROM stored_files WHERE user_id = %s
+            ORDER BY created_at DESC
+        """, (user_id,))
+        user["files"] = cursor.fetchall()
+    conn.close()
+
+    users = sorted(users_data.values(), key=lambda user: user["total_size_bytes"], reverse=True)
+    return {"users": users}
+
+@app.get("/quota/{user_id}")
+def get_user_quota(user_id: int, incoming_bytes: int = 0):
+    """Check whether a user can store `incoming_bytes` more, served from the usage ledger"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    status = quota_status(cursor, user_id, incoming_bytes)
+    conn.close()
+    return status
+
+@app.post("/admin/reconcile")
+def reconcile_storage_ledger():
+    """Recompute the usage ledger now instead of waiting for the background run"""
+    try:
+        return ledger_reconciler.run_once()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reconciling storage ledger: {str(e)}")
 
 @app.post("/admin/cleanup/user/{user_id}")
 def cleanup_user_storage(user_id: int):
@@ -294,6 +324,7 @@ def cleanup_user_storage(user_id: int):
             try:
                 file_size = os.path.getsize(file_path)
                 os.remove(file_path)
+                record_delete(cursor, user_id, LOCAL_BUCKET, file_path, file_row["file_size"])
                 freed_size_bytes += file_size
                 cleaned_files_count += 1
             except Exception as e:
@@ -303,6 +334,7 @@ def cleanup_user_storage(user_id: int):
             try:
                 obj_stat = minio_client.stat_object(DOCUMENTS_BUCKET, file_path)
                 minio_client.remove_object(DOCUMENTS_BUCKET, file_path)
+                record_delete(cursor, user_id, DOCUMENTS_BUCKET, file_path, file_row["file_size"])
                 freed_size_bytes += obj_stat.size
                 cleaned_files_count += 1
             except Exception as e:
@@ -319,117 +351,84 @@ def cleanup_user_storage(user_id: int):
         "message": f"Cleaned up {cleaned_files_count} files for user {user_id}"
     }
 
-@app.post("/admin/cleanup/orphaned")
-def cleanup_orphaned_files():
-    """Clean up orphaned files"""
+def run_maintenance(operation: str, dry_run: bool, task):
+    """Run one maintenance operation at a time, publishing its progress"""
+    if not maintenance_lock.acquire(blocking=False):
+        running = [p.operation for p in maintenance_progress.values() if p.finished_at is None]
+        raise HTTPException(status_code=409, detail=f"Storage maintenance already running: {', '.join(running)}")
+    progress = MaintenanceProgress(operation, dry_run)
+    maintenance_progress[operation] = progress
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        return progress, task(conn, progress)
+    except Exception:
+        conn.rollback()
+        progress.phase = "failed"
+        raise
+    finally:
+        conn.close()
+        maintenance_lock.release()
 
-    # Get all files from database
-    cursor.execute("SELECT * FROM stored_files")
-    stored_files = cursor.fetchall()
-
-    # Collect all file paths in DB
-    db_file_paths = set()
-    for file_row in stored_files:
-        db_file_paths.add(file_row["file_path"])
-
-    # Walk through storage directory to find local files not in DB
-    orphaned_local_files = []
-    for dirpath, dirnames, filenames in os.walk(STORAGE_PATH):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            if filepath not in db_file_paths:
-                if os.path.isfile(filepath):  # Make sure it's a file
-                    orphaned_local_files.append(filepath)
-
-    # Find orphaned MinIO objects
+@app.post("/admin/cleanup/orphaned")
+def cleanup_orphaned_files(dry_run: bool = False):
+    """Clean up objects and files no document or stored file refers to"""
     try:
-        all_minio_objects = list(minio_client.list_objects(DOCUMENTS_BUCKET, recursive=True))
-        orphaned_minio_objects = []
-        for obj in all_minio_objects:
-            if obj.object_name not in db_file_paths:
-                orphaned_minio_objects.append(obj)
+        progress, result = run_maintenance(
+            "cleanup_orphaned", dry_run,
+            lambda conn, progress: cleanup_orphans(conn, minio_client, DOCUMENTS_BUCKET, STORAGE_PATH, progress)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error listing MinIO objects: {e}")
-        orphaned_minio_objects = []
-
-    # Remove orphaned local files
-    cleaned_files_count = 0
-    freed_size_bytes = 0
-
-    for filepath in orphaned_local_files:
-        try:
-            file_size = os.path.getsize(filepath)
-            os.remove(filepath)
-            freed_size_bytes += file_size
-            cleaned_files_count += 1
-        except Exception as e:
-            print(f"Error deleting orphaned local file {filepath}: {e}")
-
-    # Remove orphaned MinIO objects
-    for obj in orphaned_minio_objects:
-        try:
-            minio_client.remove_object(DOCUMENTS_BUCKET, obj.object_name)
-            freed_size_bytes += obj.size
-            cleaned_files_count += 1
-        except Exception as e:
-            print(f"Error deleting orphaned MinIO object {obj.object_name}: {e}")
-
-    conn.close()
+        print(f"Error cleaning up orphaned files: {e}")
+        raise HTTPException(status_code=500, detail=f"Error cleaning up orphaned files: {str(e)}")
 
+    if dry_run:
+        message = f"Found {progress.matched} orphaned files ({progress.processed_bytes} bytes); nothing deleted"
+    else:
+        message = f"Cleaned up {progress.processed} orphaned files"
+        if progress.errors:
+            message += f", {len(progress.errors)} could not be deleted"
     return {
-        "cleaned_files_count": cleaned_files_count,
-        "freed_size_bytes": freed_size_bytes,
-        "message": f"Cleaned up {cleaned_files_count} orphaned files"
+        "cleaned_files_count": 0 if dry_run else progress.processed,
+        "freed_size_bytes": 0 if dry_run else progress.processed_bytes,
+        "orphaned_files_count": progress.matched,
+        "dry_run": dry_run,
+        "sample": result["sample"],
+        "errors": progress.errors[:100],
+        "message": message
     }
 
 @app.post("/admin/sync")
-def sync_storage_metadata():
-    """Synchronize storage metadata with actual files in MinIO"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    synced_count = 0
-    
+def sync_storage_metadata(dry_run: bool = False):
+    """Register MinIO objects that no document or stored file refers to"""
     try:
-        # Get all objects from MinIO
-        minio_objects = list(minio_client.list_objects(DOCUMENTS_BUCKET, recursive=True))
-        
-        for obj in minio_objects:
-            # Check if file already exists in DB
-            cursor.execute("SELECT id FROM stored_files WHERE file_path = %s", (obj.object_name,))
-            existing = cursor.fetchone()
-            
-            if not existing:
-                # Infer user_id from metadata or path if possible, otherwise default to 1 (admin)
-                # In a real scenario, we'd need better metadata management
-                # For now, we'll assume a default user or try to parse from path if it follows a pattern
-                user_id = 1 
-                
-                # Insert into DB
-                cursor.execute("""
-                    INSERT INTO stored_files (filename, file_path, file_size, mime_type, user_id)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (
-                    os.path.basename(obj.object_name),
-                    obj.object_name,
-                    obj.size,
-                    "application/pdf", # Default to PDF for now
-                    user_id
-                ))
-                synced_count += 1
-        
-        conn.commit()
-        message = f"Synchronized {synced_count} new files from storage"
-        
+        progress, result = run_maintenance(
+            "sync", dry_run,
+            lambda conn, progress: sync_stored_files(conn, minio_client, DOCUMENTS_BUCKET, progress)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error syncing storage: {e}")
-        message = f"Error syncing storage: {str(e)}"
-    finally:
-        conn.close()
-        
-    return {"message": message, "synced_count": synced_count}
+        return {"message": f"Error syncing storage: {str(e)}", "synced_count": 0}
+
+    if dry_run:
+        message = f"Found {result['matched_count']} unregistered files; nothing synchronized"
+    else:
+        message = f"Synchronized {result['synced_count']} new files from storage"
+    return {
+        "message": message,
+        "synced_count": result["synced_count"],
+        "unregistered_count": result["matched_count"],
+        "dry_run": dry_run,
+        "sample": result["sample"]
+    }
+
+@app.get("/admin/maintenance/progress")
+def get_maintenance_progress():
+    """Progress of the running (or last) sync and orphan cleanup"""
+    return {name: progress.to_dict() for name, progress in maintenance_progress.items()}
 
 @app.post("/avatars/upload")
 async def upload_avatar(file: UploadFile = File(...)):
@@ -455,6 +454,13 @@ async def upload_avatar(file: UploadFile = File(...)):
             file_size,
             content_type=file.content_type
         )
+
+        # Avatars are not tied to a stored file, so they count as unowned
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        record_upload(cursor, UNOWNED, AVATARS_BUCKET, filename, file_size)
+        conn.commit()
+        conn.close()
         
         # Return the URL (relative or absolute depending on needs)
         # For now, return the filename, frontend can construct URL via gateway
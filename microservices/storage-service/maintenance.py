@@ -0,0 +1,243 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from minio.deleteobjects import DeleteObject
+from psycopg2.extras import execute_values
+
+from storage_ledger import EXTENSION_PATTERN, LOCAL_BUCKET, UNOWNED
+
+LISTING_BATCH = 5000  # Listed objects per insert into the temp table
+DELETE_BATCH = 1000  # Objects per multi-object delete request (the S3 maximum)
+SYNC_OWNER_ID = 1  # Owner given to objects adopted by /admin/sync
+SYNC_MIME_TYPE = "application/pdf"
+DRY_RUN_SAMPLE = 100  # Names returned by a dry run
+# Objects newer than this may belong to an upload whose row isn't committed yet
+MAINTENANCE_GRACE = float(os.getenv("STORAGE_MAINTENANCE_GRACE", "300"))  # Seconds
+
+# Listed objects that no documents or stored_files row refers to
+UNREFERENCED_SQL = """
+    FROM listed_objects l
+    WHERE NOT (l.bucket = %(documents_bucket)s
+               AND EXISTS (SELECT 1 FROM documents d WHERE d.file_path = l.name))
+      AND NOT EXISTS (SELECT 1 FROM stored_files s WHERE s.file_path = l.name)
+"""
+
+class MaintenanceProgress:
+    """Counters of a running (or the last) maintenance operation, readable from other requests."""
+
+    def __init__(self, operation: str, dry_run: bool = False):
+        self.operation = operation
+        self.dry_run = dry_run
+        self.phase = "listing"
+        self.listed = 0
+        self.matched = 0
+        self.processed = 0
+        self.processed_bytes = 0
+        self.errors: List[str] = []
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self._started = time.monotonic()
+
+    def finish(self):
+        self.phase = "finished"
+        self.finished_at = datetime.utcnow()
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._started if self.finished_at is None else \
+            (self.finished_at - self.started_at).total_seconds()
+        return {
+            "operation": self.operation,
+            "dry_run": self.dry_run,
+            "phase": self.phase,
+            "listed": self.listed,
+            "matched": self.matched,
+            "processed": self.processed,
+            "processed_bytes": self.processed_bytes,
+            "errors": len(self.errors),
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": round(elapsed, 1),
+        }
+
+# Held while an operation runs, so two cleanups never delete from the same listing
+maintenance_lock = threading.Lock()
+maintenance_progress: Dict[str, MaintenanceProgress] = {}
+
+def listing_cutoff(grace: float = MAINTENANCE_GRACE) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=grace)
+
+def _batches(items: Iterable[Tuple[str, str, int]], size: int) -> Iterator[List[Tuple[str, str, int]]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def bucket_objects(minio_client, bucket: str, cutoff: datetime) -> Iterator[Tuple[str, str, int]]:
+    for obj in minio_client.list_objects(bucket, recursive=True):
+        if obj.last_modified is None or obj.last_modified < cutoff:
+            yield bucket, obj.object_name, obj.size or 0
+
+def local_files(path: str, cutoff: datetime) -> Iterator[Tuple[str, str, int]]:
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                continue  # Removed while walking
+            if datetime.fromtimestamp(stat.st_mtime, timezone.utc) < cutoff:
+                yield LOCAL_BUCKET, filepath, stat.st_size
+
+def load_listing(cursor, sources: List[Iterable[Tuple[str, str, int]]],
+                 progress: Optional[MaintenanceProgress] = None) -> int:
+    """
+    Stream (bucket, name, size) rows into the transaction-scoped temp table
+    listed_objects, so listings are compared in SQL instead of in memory.
+    """
+    cursor.execute("CREATE TEMP TABLE listed_objects (bucket TEXT, name TEXT, size BIGINT) ON COMMIT DROP")
+    listed = 0
+    for source in sources:
+        for batch in _batches(source, LISTING_BATCH):
+            execute_values(cursor, "INSERT INTO listed_objects (bucket, name, size) VALUES %s", batch)
+            listed += len(batch)
+            if progress:
+                progress.listed = listed
+    cursor.execute("CREATE INDEX ON listed_objects (name)")
+    cursor.execute("ANALYZE listed_objects")
+    return listed
+
+def _ledger_delta(cursor, condition_sql: str, params: Dict[str, Any], owner_id: int, sign: int):
+    """Add (sign=1) or remove (sign=-1) the listed objects matching condition_sql to owner_id's ledger rows."""
+    cursor.execute(f"""
+        INSERT INTO storage_usage (owner_id, bucket, extension, size_bytes, object_count)
+        SELECT %(ledger_owner)s, l.bucket, COALESCE(lower(substring(l.name FROM %(pattern)s)), ''),
+               %(sign)s * SUM(l.size), %(sign)s * COUNT(*)
+        {condition_sql}
+        GROUP BY 1, 2, 3
+        ON CONFLICT (owner_id, bucket, extension) DO UPDATE SET
+            size_bytes = storage_usage.size_bytes + EXCLUDED.size_bytes,
+            object_count = storage_usage.object_count + EXCLUDED.object_count,
+            updated_at = CURRENT_TIMESTAMP
+    """, {**params, "ledger_owner": owner_id, "pattern": EXTENSION_PATTERN, "sign": sign})
+
+def sync_stored_files(conn, minio_client, documents_bucket: str, progress: MaintenanceProgress) -> Dict[str, Any]:
+    """
+    Register the objects of the documents bucket that no row refers to as
+    stored files of SYNC_OWNER_ID: one streamed listing, one anti-join and
+    one INSERT ... SELECT, in a single transaction.
+    """
+    cursor = conn.cursor()
+    load_listing(cursor, [bucket_objects(minio_client, documents_bucket, listing_cutoff())], progress)
+
+    progress.phase = "comparing"
+    params = {"documents_bucket": documents_bucket}
+    cursor.execute(f"SELECT COUNT(*) AS count, COALESCE(SUM(l.size), 0) AS size {UNREFERENCED_SQL}", params)
+    row = cursor.fetchone()
+    progress.matched = row["count"]
+    sample = []
+    if progress.dry_run:
+        cursor.execute(f"SELECT l.name {UNREFERENCED_SQL} ORDER BY l.name LIMIT %(limit)s",
+                       {**params, "limit": DRY_RUN_SAMPLE})
+        sample = [r["name"] for r in cursor.fetchall()]
+        conn.rollback()
+    else:
+        progress.phase = "inserting"
+        # The adopted objects stop being unowned in the ledger
+        _ledger_delta(cursor, UNREFERENCED_SQL, params, UNOWNED, -1)
+        _ledger_delta(cursor, UNREFERENCED_SQL, params, SYNC_OWNER_ID, 1)
+        cursor.execute(f"""
+            INSERT INTO stored_files (filename, file_path, file_size, mime_type, user_id)
+            SELECT regexp_replace(l.name, '^.*/', ''), l.name, l.size, %(mime_type)s, %(owner_id)s
+            {UNREFERENCED_SQL}
+        """, {**params, "mime_type": SYNC_MIME_TYPE, "owner_id": SYNC_OWNER_ID})
+        progress.processed = cursor.rowcount
+        progress.processed_bytes = int(row["size"])
+        conn.commit()
+    progress.finish()
+    return {"synced_count": progress.processed, "matched_count": progress.matched, "sample": sample}
+
+def _remove_minio_batch(minio_client, bucket: str, batch: List[Dict[str, Any]], progress: MaintenanceProgress):
+    errors = {error.name: error for error in minio_client.remove_objects(
+        bucket, [DeleteObject(row["name"]) for row in batch]
+    )}
+    for row in batch:
+        if row["name"] in errors:
+            progress.errors.append(f"{row['name']}: {errors[row['name']].message}")
+        else:
+            progress.processed += 1
+            progress.processed_bytes += row["size"]
+
+def _remove_local_batch(batch: List[Dict[str, Any]], progress: MaintenanceProgress):
+    for row in batch:
+        try:
+            os.remove(row["name"])
+            progress.processed += 1
+            progress.processed_bytes += row["size"]
+        except FileNotFoundError:
+            progress.processed += 1  # Already gone
+        except OSError as e:
+            progress.errors.append(f"{row['name']}: {e}")
+
+def cleanup_orphans(conn, minio_client, documents_bucket: str, local_path: str,
+                    progress: MaintenanceProgress) -> Dict[str, Any]:
+    """
+    Delete the objects of the documents bucket and the files under
+    local_path that no documents or stored_files row refers to.
+
+    The listing is streamed into a temp table and the orphans are found with
+    an anti-join, then read back through a server-side cursor and removed
+    DELETE_BATCH at a time with multi-object deletes. A dry run stops after
+    counting and returns a sample.
+    """
+    cursor = conn.cursor()
+    sources = [bucket_objects(minio_client, documents_bucket, listing_cutoff())]
+    if os.path.isdir(local_path):
+        sources.append(local_files(local_path, listing_cutoff()))
+    load_listing(cursor, sources, progress)
+
+    progress.phase = "comparing"
+    params = {"documents_bucket": documents_bucket}
+    cursor.execute(f"""
+        SELECT COUNT(*) AS count, COALESCE(SUM(l.size), 0) AS size
+        {UNREFERENCED_SQL}
+    """, params)
+    row = cursor.fetchone()
+    progress.matched = row["count"]
+    if progress.dry_run:
+        cursor.execute(f"SELECT l.bucket, l.name, l.size {UNREFERENCED_SQL} ORDER BY l.name LIMIT %(limit)s",
+                       {**params, "limit": DRY_RUN_SAMPLE})
+        sample = cursor.fetchall()
+        conn.rollback()
+        progress.processed_bytes = int(row["size"])
+        progress.finish()
+        return {"sample": sample}
+
+    progress.phase = "deleting"
+    # Orphans are counted as unowned by the reconciler
+    _ledger_delta(cursor, UNREFERENCED_SQL, params, UNOWNED, -1)
+    orphans = conn.cursor(name="orphaned_objects")
+    orphans.itersize = DELETE_BATCH
+    orphans.execute(f"SELECT l.bucket, l.name, l.size {UNREFERENCED_SQL} ORDER BY l.bucket", params)
+    while True:
+        batch = orphans.fetchmany(DELETE_BATCH)
+        if not batch:
+            break
+        for bucket in {row["bucket"] for row in batch}:
+            rows = [row for row in batch if row["bucket"] == bucket]
+            if bucket == LOCAL_BUCKET:
+                _remove_local_batch(rows, progress)
+            else:
+                _remove_minio_batch(minio_client, bucket, rows, progress)
+    orphans.close()
+    conn.commit()
+    if progress.errors:
+        print(f"Orphan cleanup finished with {len(progress.errors)} errors, first: {progress.errors[0]}")
+    progress.finish()
+    return {"sample": []}
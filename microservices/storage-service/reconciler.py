@@ -0,0 +1,139 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List
+
+from psycopg2.extras import execute_values
+
+from maintenance import bucket_objects, load_listing, local_files
+from storage_ledger import EXTENSION_PATTERN, LOCAL_BUCKET, UNOWNED
+
+RECONCILE_INTERVAL = float(os.getenv("STORAGE_RECONCILE_INTERVAL", "3600"))  # Seconds between runs
+RECONCILE_GRACE = float(os.getenv("STORAGE_RECONCILE_GRACE", "300"))  # Objects newer than this are left to the next run
+
+# Actual usage per ledger row. Owned objects are counted from the rows that
+# own them (documents, then stored_files); listed objects are only counted
+# when no row refers to them, as unowned.
+ACTUAL_USAGE_SQL = """
+    SELECT owner_id, bucket,
+           COALESCE(lower(substring(name FROM %(pattern)s)), '') AS extension,
+           SUM(size) AS size_bytes, COUNT(*) AS object_count
+    FROM (
+        SELECT owner_id, %(documents_bucket)s AS bucket, file_path AS name, file_size::BIGINT AS size
+        FROM documents
+        UNION ALL
+        SELECT s.user_id, CASE WHEN s.file_path LIKE '/%%' THEN %(local_bucket)s ELSE %(documents_bucket)s END,
+               s.file_path, s.file_size::BIGINT
+        FROM stored_files s
+        WHERE NOT EXISTS (SELECT 1 FROM documents d WHERE d.file_path = s.file_path)
+        UNION ALL
+        SELECT %(unowned)s, l.bucket, l.name, l.size
+        FROM listed_objects l
+        WHERE NOT (l.bucket = %(documents_bucket)s
+                   AND EXISTS (SELECT 1 FROM documents d WHERE d.file_path = l.name))
+          AND NOT EXISTS (SELECT 1 FROM stored_files s WHERE s.file_path = l.name)
+    ) usage
+    GROUP BY 1, 2, 3
+"""
+
+def reconcile(conn, minio_client, buckets: List[str], documents_bucket: str, local_path: str) -> Dict[str, Any]:
+    """
+    Recompute the storage ledger and correct the rows that drifted.
+
+    Buckets and STORAGE_PATH are listed into a temp table first (streamed,
+    never held in memory); the comparison and the corrections then run with
+    writers to the ledger locked out, so no upload or delete lands between
+    reading the actual usage and fixing the ledger. Objects modified within
+    RECONCILE_GRACE are skipped, because their owning row may not be
+    committed yet.
+    """
+    started = time.monotonic()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=RECONCILE_GRACE)
+    cursor = conn.cursor()
+    sources = [bucket_objects(minio_client, bucket, cutoff) for bucket in buckets]
+    if os.path.isdir(local_path):
+        sources.append(local_files(local_path, cutoff))
+    listed = load_listing(cursor, sources)
+
+    cursor.execute("LOCK TABLE storage_usage IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute(ACTUAL_USAGE_SQL, {
+        "pattern": EXTENSION_PATTERN,
+        "documents_bucket": documents_bucket,
+        "local_bucket": LOCAL_BUCKET,
+        "unowned": UNOWNED,
+    })
+    actual = {
+        (row["owner_id"], row["bucket"], row["extension"]): (int(row["size_bytes"]), int(row["object_count"]))
+        for row in cursor.fetchall()
+    }
+    cursor.execute("SELECT owner_id, bucket, extension, size_bytes, object_count FROM storage_usage")
+    recorded = {
+        (row["owner_id"], row["bucket"], row["extension"]): (row["size_bytes"], row["object_count"])
+        for row in cursor.fetchall()
+    }
+
+    drifted = [(key, value) for key, value in actual.items() if recorded.get(key) != value]
+    stale = [key for key in recorded if key not in actual]
+    if drifted:
+        execute_values(cursor, """
+            INSERT INTO storage_usage (owner_id, bucket, extension, size_bytes, object_count)
+            VALUES %s
+            ON CONFLICT (owner_id, bucket, extension) DO UPDATE SET
+                size_bytes = EXCLUDED.size_bytes,
+                object_count = EXCLUDED.object_count,
+                updated_at = CURRENT_TIMESTAMP
+        """, [(*key, *value) for key, value in drifted])
+    if stale:
+        execute_values(cursor, """
+            DELETE FROM storage_usage u USING (VALUES %s) AS stale (owner_id, bucket, extension)
+            WHERE u.owner_id = stale.owner_id AND u.bucket = stale.bucket AND u.extension = stale.extension
+        """, stale)
+    conn.commit()
+
+    result = {
+        "listed_objects": listed,
+        "corrected_rows": len(drifted) + len(stale),
+        "drift_bytes": sum(abs(value[0] - recorded.get(key, (0, 0))[0]) for key, value in drifted)
+                       + sum(abs(recorded[key][0]) for key in stale),
+        "seconds": round(time.monotonic() - started, 3),
+        "finished_at": datetime.utcnow().isoformat(),
+    }
+    if result["corrected_rows"]:
+        print(f"Storage ledger corrected {result['corrected_rows']} rows ({result['drift_bytes']} bytes of drift)")
+    return result
+
+class LedgerReconciler:
+    """Runs reconcile() every RECONCILE_INTERVAL seconds in a daemon thread."""
+
+    def __init__(self, connect: Callable, minio_client, buckets: List[str], documents_bucket: str, local_path: str):
+        self.connect = connect
+        self.minio_client = minio_client
+        self.buckets = buckets
+        self.documents_bucket = documents_bucket
+        self.local_path = local_path
+        self.last_result: Dict[str, Any] = {}
+        self.last_error = None
+
+    def run_once(self) -> Dict[str, Any]:
+        conn = self.connect()
+        try:
+            self.last_result = reconcile(conn, self.minio_client, self.buckets, self.documents_bucket, self.local_path)
+            self.last_error = None
+            return self.last_result
+        except Exception as e:
+            conn.rollback()
+            self.last_error = str(e)
+            raise
+        finally:
+            conn.close()
+
+    def loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error reconciling storage ledger: {e}")
+            time.sleep(RECONCILE_INTERVAL)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"last_run": self.last_result or None, "last_error": self.last_error}
@@ -0,0 +1,71 @@
+import os
+import re
+from typing import Any, Dict, Optional
+
+STORAGE_USER_QUOTA_BYTES = int(os.getenv("STORAGE_USER_QUOTA_BYTES", "0"))  # Per-user limit, 0 disables it
+LOCAL_BUCKET = "local"  # Files under STORAGE_PATH rather than in MinIO
+UNOWNED = 0  # Owner of objects no document or stored file refers to
+
+# The extension of an object name, shared with the reconciler's SQL so both
+# sides attribute an object to the same ledger row.
+EXTENSION_PATTERN = r"\.[^./]*$"
+
+def create_ledger_table(cursor):
+    """
+    Running totals per (owner, bucket, extension). Writers apply deltas in
+    the same transaction as the row that owns the object, so reads never
+    have to list buckets or walk directories.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS storage_usage (
+            owner_id INTEGER NOT NULL,
+            bucket TEXT NOT NULL,
+            extension TEXT NOT NULL,
+            size_bytes BIGINT NOT NULL DEFAULT 0,
+            object_count BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (owner_id, bucket, extension)
+        )
+    """)
+
+def object_extension(name: str) -> str:
+    match = re.search(EXTENSION_PATTERN, name or "")
+    return match.group(0).lower() if match else ""
+
+def record_usage(cursor, owner_id: int, bucket: str, name: str, size_bytes: int, object_count: int = 1):
+    """Add an object to the ledger; pass negative values when one is removed."""
+    cursor.execute("""
+        INSERT INTO storage_usage (owner_id, bucket, extension, size_bytes, object_count)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (owner_id, bucket, extension) DO UPDATE SET
+            size_bytes = storage_usage.size_bytes + EXCLUDED.size_bytes,
+            object_count = storage_usage.object_count + EXCLUDED.object_count,
+            updated_at = CURRENT_TIMESTAMP
+    """, (owner_id, bucket, object_extension(name), size_bytes, object_count))
+
+def record_upload(cursor, owner_id: int, bucket: str, name: str, size_bytes: int):
+    record_usage(cursor, owner_id, bucket, name, size_bytes, 1)
+
+def record_delete(cursor, owner_id: int, bucket: str, name: str, size_bytes: int):
+    record_usage(cursor, owner_id, bucket, name, -size_bytes, -1)
+
+def user_usage(cursor, owner_id: int) -> Dict[str, int]:
+    cursor.execute("""
+        SELECT COALESCE(SUM(size_bytes), 0) AS size_bytes, COALESCE(SUM(object_count), 0) AS object_count
+        FROM storage_usage WHERE owner_id = %s
+    """, (owner_id,))
+    row = cursor.fetchone()
+    return {"size_bytes": int(row["size_bytes"]), "object_count": int(row["object_count"])}
+
+def quota_status(cursor, owner_id: int, incoming_bytes: int = 0,
+                 quota_bytes: Optional[int] = None) -> Dict[str, Any]:
+    """Whether `owner_id` can store `incoming_bytes` more, from the ledger alone."""
+    quota = STORAGE_USER_QUOTA_BYTES if quota_bytes is None else quota_bytes
+    used = user_usage(cursor, owner_id)["size_bytes"]
+    return {
+        "user_id": owner_id,
+        "quota_bytes": quota or None,
+        "used_bytes": used,
+        "remaining_bytes": max(quota - used, 0) if quota else None,
+        "allowed": not quota or used + incoming_bytes <= quota,
+    }